@@ -0,0 +1,226 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_SEQUENCE = {
+    "sequence_title": "Benchmark outreach",
+    "steps": [
+        {
+            "step_title": "Intro",
+            "step_content": "Hi {{First_Name}}, I noticed your team is hiring and wanted to reach out."
+        },
+        {
+            "step_title": "Value",
+            "step_content": "Teams like yours cut their time-to-hire by a third with our platform."
+        },
+        {
+            "step_title": "Social proof",
+            "step_content": "Here is how a company your size filled five roles in a month."
+        },
+        {
+            "step_title": "Ask",
+            "step_content": "Would a 15 minute call next week work, {{First_Name}}?"
+        },
+    ],
+}
+CANNED_STEP = {
+    "step_title": "Follow up",
+    "step_content": "Just bumping this up, {{First_Name}} - happy to share a short demo."
+}
+CANNED_EDIT = "Shorter intro\nHi {{First_Name}}, quick note: we help teams like yours hire faster."
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for POST /v1/chat/completions.
+
+    Every call sleeps latency seconds (plus up to jitter) and answers with a
+    canned reply chosen from the prompt: an intent word for classification
+    prompts, a function call when functions are offered, a JSON step for
+    add-step prompts and a title/content pair for edit prompts. stream=True
+    is answered with SSE chunks. A share of calls (error_rate) fails with a
+    503 instead. Point the app at it with OPENAI_BASE_URL.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.1, host="127.0.0.1", port=0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def complete(self, body):
+        """
+        Return the canned message for body, or None for an injected error.
+        """
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return None
+        return _canned_message(body)
+
+
+def _canned_message(body):
+    messages = body.get("messages") or [{"content": ""}]
+    system = messages[0].get("content") or ""
+    user_turns = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+    last_user = user_turns[-1].lower() if user_turns else ""
+    functions = [f["name"] for f in body.get("functions") or []]
+
+    if "classify the intent" in system:
+        request_text = system.rsplit("User request:", 1)[-1].split("\n\n")[0].lower()
+        return {"content": _guess_intent(request_text)}
+    if "addStepToSequence" in functions:
+        intent = _guess_intent(last_user)
+        if intent == "add_step":
+            return _function_call("addStepToSequence", CANNED_STEP)
+        if intent == "edit_step":
+            match = re.search(r"step (\d+)", last_user)
+            return _function_call("editStepInSequence", {
+                "step_number": int(match.group(1)) if match else 1,
+                "step_title": "Shorter intro",
+                "step_content": CANNED_EDIT.split("\n", 1)[1]
+            })
+        return _function_call("performTaskInSequences", CANNED_SEQUENCE)
+    if functions:
+        return _function_call("performTaskInSequences", CANNED_SEQUENCE)
+    # Keyed on the reply format the add-step prompt asks for (see
+    # utils.build_add_step_messages) rather than its opening sentence.
+    if "one new step as a JSON object" in system:
+        return {"content": "```json\n" + json.dumps(CANNED_STEP) + "\n```"}
+    if "running summary" in system:
+        return {"content": "The user is writing recruiting outreach for engineering candidates."}
+    return {"content": CANNED_EDIT}
+
+
+def _guess_intent(text):
+    if re.search(r"\b(add|append|another|one more)\b", text):
+        return "add_step"
+    if re.search(r"\bstep \d+\b|\b(first|second|third|last) step\b", text):
+        return "edit_step"
+    return "new_sequence"
+
+
+def _function_call(name, arguments):
+    return {"content": None, "function_call": {"name": name, "arguments": json.dumps(arguments)}}
+
+
+def _completion(body, message):
+    finish_reason = "function_call" if message.get("function_call") else "stop"
+    return {
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", **message},
+            "finish_reason": finish_reason,
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+    }
+
+
+def _stream_chunks(body, message):
+    base = {
+        "id": "chatcmpl-" + uuid.uuid4().hex,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+    }
+    function_call = message.get("function_call")
+    if function_call:
+        arguments = function_call["arguments"]
+        pieces = [arguments[i:i + 24] for i in range(0, len(arguments), 24)]
+        deltas = [
+            {"function_call": {"name": function_call["name"] if i == 0 else None, "arguments": piece}}
+            for i, piece in enumerate(pieces)
+        ]
+    else:
+        deltas = [{"content": word + " "} for word in message["content"].split(" ")]
+    for delta in deltas:
+        yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+    finish_reason = "function_call" if function_call else "stop"
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+
+            message = server.complete(body)
+            if message is None:
+                self._send_json(503, {"error": {"message": "Injected failure", "type": "server_error"}})
+            elif body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in _stream_chunks(body, message):
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            else:
+                self._send_json(200, _completion(body, message))
+
+        def _send_json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake OpenAI chat completions server.")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with a 503")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer(args.latency, args.jitter, port=args.port, error_rate=args.error_rate)
+    print(f"Fake OpenAI listening on {fake.base_url} (set OPENAI_BASE_URL to this)")
+    fake.httpd.serve_forever()
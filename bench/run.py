@@ -0,0 +1,323 @@
+"""
+Offline load test for the Helix API.
+
+Starts a fake OpenAI server, seeds a fresh database with synthetic users
+(see seed.seed_synthetic_data), serves the app in-process and drives
+/api/chat (all three intents), /api/load, /api/classify and
+/api/sequence/update from concurrent clients. Reports p50/p95/p99 latency,
+requests/sec and database queries per request for each endpoint.
+
+    python -m bench.run --scale small,medium --concurrency 32 --duration 30
+    python -m bench.run --server asgi --llm-latency 1.5
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from .fake_openai import CANNED_STEP, FakeOpenAIServer
+
+SCALES = {
+    "small": (50, 20),
+    "medium": (500, 200),
+    "large": (2000, 1000),
+}
+
+# (label, weight) of the operations each client picks from.
+WORKLOAD = [
+    ("chat:new_sequence", 1),
+    ("chat:add_step", 2),
+    ("chat:edit_step", 2),
+    ("load", 3),
+    ("classify", 2),
+    ("sequence/update", 1),
+]
+
+CLASSIFY_MESSAGES = [
+    "add another step about pricing",
+    "make step 2 shorter",
+    "write a recruiting sequence for data engineers",
+    "can you make the last step more friendly",
+    "start over with a campaign for webinar attendees",
+]
+
+
+def _chat(client, user, label, message):
+    response = client.post(
+        "/api/chat",
+        json={"user_id": user["user_id"], "message": message},
+        headers={"X-Bench-Label": label}
+    )
+    if response.status_code == 200:
+        body = response.json()
+        if body.get("sequenceId"):
+            user["sequence_id"] = body["sequenceId"]
+            user["steps"] = len(body["sequence"])
+    return response
+
+
+def _run_operation(client, user, label):
+    if label == "chat:new_sequence":
+        return _chat(client, user, label, "Write a sales sequence for CFOs at logistics companies")
+    if label == "chat:add_step":
+        if user["steps"] >= 8:
+            return _chat(client, user, "chat:new_sequence", "Write a sales sequence for CFOs at logistics companies")
+        steps = user["steps"]
+        response = _chat(client, user, label, "Add another step about our pricing")
+        if response.status_code == 200:
+            # The fake answers the add-step prompt with CANNED_STEP; anything
+            # else means it fell through to another canned reply and the
+            # add_step timings are not measuring an added step.
+            titles = [step["stepTitle"] for step in response.json()["sequence"]]
+            assert user["steps"] == steps + 1 and CANNED_STEP["step_title"] in titles, (
+                f"chat:add_step did not append the fake's step: {titles}"
+            )
+        return response
+    if label == "chat:edit_step":
+        return _chat(client, user, label, f"Make step {random.randint(1, user['steps'])} shorter")
+    if label == "load":
+        return client.get("/api/load", params={"user_id": user["user_id"]}, headers={"X-Bench-Label": label})
+    if label == "classify":
+        return client.post(
+            "/api/classify", json={"message": random.choice(CLASSIFY_MESSAGES)}, headers={"X-Bench-Label": label}
+        )
+    return client.put(
+        "/api/sequence/update",
+        json={
+            "sequenceId": user["sequence_id"],
+            "stepNumber": 1,
+            "field": "stepContent",
+            "value": f"Hi {{{{First_Name}}}}, updated at {time.time():.3f}."
+        },
+        headers={"X-Bench-Label": label}
+    )
+
+
+def _client_loop(base_url, users, deadline, results, failures):
+    labels = [label for label, _ in WORKLOAD]
+    weights = [weight for _, weight in WORKLOAD]
+    with httpx.Client(base_url=base_url, timeout=120) as client:
+        while time.perf_counter() < deadline:
+            user = random.choice(users)
+            label = random.choices(labels, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = _run_operation(client, user, label)
+                status = response.status_code
+                label = response.request.headers.get("X-Bench-Label", label)
+            except httpx.HTTPError:
+                status = 0
+            except AssertionError as e:
+                failures.append(str(e))
+                return
+            results.append((label, time.perf_counter() - started, status))
+
+
+def _count_queries(app):
+    """
+    Count SQL statements per benchmark label (or Flask endpoint) from the
+    engine's before_cursor_execute event.
+    """
+    from flask import has_request_context, request
+    from sqlalchemy import event
+
+    from helix_app.app import db
+
+    counts = Counter()
+    lock = threading.Lock()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            label = request.headers.get("X-Bench-Label") or request.endpoint
+            with lock:
+                counts[label] += 1
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    return counts
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(app, server_type):
+    """
+    Serve app on a local port in a background thread.
+    Returns (base_url, stop).
+    """
+    if server_type == "asgi":
+        import uvicorn
+
+        from helix_app.asgi import create_asgi_app
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(
+            create_asgi_app(app), host="127.0.0.1", port=port, log_level="warning", lifespan="on"
+        ))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+        return f"http://127.0.0.1:{port}", stop
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    return f"http://127.0.0.1:{server.server_port}", stop
+
+
+def _percentile(sorted_values, pct):
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(results, query_counts, elapsed):
+    latencies = defaultdict(list)
+    errors = Counter()
+    for label, seconds, status in results:
+        latencies[label].append(seconds)
+        if status == 0 or status >= 400:
+            errors[label] += 1
+
+    report = {}
+    for label in sorted(latencies):
+        values = sorted(latencies[label])
+        report[label] = {
+            "requests": len(values),
+            "errors": errors[label],
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+            "requests_per_sec": len(values) / elapsed,
+            "queries_per_request": query_counts[label] / len(values),
+        }
+    return report
+
+
+def print_report(title, report, elapsed, total, llm_calls, llm_errors):
+    print(
+        f"\n{title}: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s), "
+        f"{llm_calls} fake LLM calls ({llm_errors} failed)"
+    )
+    print(f"{'endpoint':<20}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}{'queries':>9}")
+    for label, row in report.items():
+        print(
+            f"{label:<20}{row['requests']:>9}{row['errors']:>8}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}"
+            f"{row['p99_ms']:>9.1f}{row['requests_per_sec']:>8.1f}{row['queries_per_request']:>9.1f}"
+        )
+
+
+def run_scale(scale, users, messages, args, fake):
+    from helix_app.app import create_app
+
+    from seed import seed_synthetic_data
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = create_app({
+            "DATABASE_URL": database_url,
+            "CHAT_SINGLE_CALL": args.single_call,
+            "REQUEST_LOG_ENABLED": args.request_log
+        })
+
+        started = time.perf_counter()
+        seeded = seed_synthetic_data(users, messages, app=app)
+        print(f"Seeding {scale} took {time.perf_counter() - started:.1f}s")
+
+        client_users = [
+            {"user_id": user_id, "sequence_id": sequence_id, "steps": 3}
+            for user_id, sequence_id in seeded
+        ]
+        # Each client gets its own users so concurrent writes never race on
+        # the same sequence.
+        partitions = [client_users[i::args.concurrency] for i in range(args.concurrency)]
+        partitions = [p for p in partitions if p]
+
+        query_counts = _count_queries(app)
+        base_url, stop = _serve(app, args.server)
+        calls_before, errors_before = fake.calls, fake.errors
+        results, failures = [], []
+        started = time.perf_counter()
+        deadline = started + args.duration
+        threads = [
+            threading.Thread(target=_client_loop, args=(base_url, partition, deadline, results, failures))
+            for partition in partitions
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop()
+        if failures:
+            raise SystemExit(f"{scale}: {failures[0]}")
+
+        report = summarize(results, query_counts, elapsed)
+        print_report(
+            f"{scale} ({users} users x {messages} messages, {len(partitions)} clients, {args.server})",
+            report, elapsed, len(results), fake.calls - calls_before, fake.errors - errors_before
+        )
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the Helix API.")
+    parser.add_argument("--scale", default="small",
+                        help="comma separated list of " + ", ".join(SCALES) + " or USERSxMESSAGES, e.g. 100x500")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run each scale")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--single-call", action="store_true", help="run chat in CHAT_SINGLE_CALL mode")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake OpenAI latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="extra random fake OpenAI latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0,
+                        help="share of fake OpenAI calls that fail with a 503, to exercise retries")
+    parser.add_argument("--database-url", help="benchmark against this (empty) database instead of a temp SQLite file")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--request-log", action="store_true", help="keep the app's per-request JSON log lines")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer(args.llm_latency, args.llm_jitter, error_rate=args.llm_error_rate).start()
+    # Never let a benchmark reach the real API.
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+    reports = {}
+    for scale in args.scale.split(","):
+        if scale in SCALES:
+            users, messages = SCALES[scale]
+        else:
+            users, messages = (int(n) for n in scale.lower().split("x"))
+        reports[scale] = run_scale(scale, users, messages, args, fake)
+
+    fake.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
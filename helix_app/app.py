@@ -4,26 +4,114 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 
+from .database import configure_database, install_sqlite_pragmas
+from .llm import configure_llm
+from .metrics import init_metrics
+
 load_dotenv()
 
 db = SQLAlchemy()
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.url_map.strict_slashes = False
 
     CORS(app)
 
    
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///helix_database.db"
+    app.config["DATABASE_URL"] = os.getenv("DATABASE_URL", "sqlite:///helix_database.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["DB_POOL_SIZE"] = int(os.getenv("DB_POOL_SIZE", "10"))
+    app.config["DB_MAX_OVERFLOW"] = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    app.config["DB_POOL_TIMEOUT"] = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    app.config["DB_POOL_RECYCLE"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    app.config["SQLITE_CACHE_SIZE_KB"] = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+    app.config["DB_AUTO_UPGRADE"] = os.getenv("DB_AUTO_UPGRADE", "true").lower() in ("1", "true", "yes")
+    app.config["CHAT_SINGLE_CALL"] = os.getenv("CHAT_SINGLE_CALL", "false").lower() in ("1", "true", "yes")
+    app.config["ASYNC_DB_WORKERS"] = int(os.getenv("ASYNC_DB_WORKERS", "16"))
+    app.config["CONVERSATION_TOKEN_BUDGET"] = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "4000"))
+    app.config["CONVERSATION_SUMMARY_KEEP_RATIO"] = float(os.getenv("CONVERSATION_SUMMARY_KEEP_RATIO", "0.6"))
+    app.config["CONVERSATION_SUMMARY_MAX_INPUT_TOKENS"] = int(os.getenv("CONVERSATION_SUMMARY_MAX_INPUT_TOKENS", "8000"))
+    app.config["CONVERSATION_SUMMARY_MODEL"] = os.getenv("CONVERSATION_SUMMARY_MODEL", "gpt-4o-mini")
+    app.config["HISTORY_PAGE_SIZE"] = int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+    app.config["HISTORY_MAX_PAGE_SIZE"] = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+    app.config["HISTORY_SYNC_OVERLAP_SECONDS"] = int(os.getenv("HISTORY_SYNC_OVERLAP_SECONDS", "300"))
+    app.config["CHAT_ARCHIVE_AFTER_DAYS"] = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+    app.config["CHAT_ARCHIVE_KEEP_MESSAGES"] = int(os.getenv("CHAT_ARCHIVE_KEEP_MESSAGES", "1000"))
+    app.config["CHAT_ARCHIVE_INTERVAL_SECONDS"] = int(os.getenv("CHAT_ARCHIVE_INTERVAL_SECONDS", "0"))
+    app.config["INTENT_CONFIDENCE_THRESHOLD"] = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.85"))
+    app.config["REQUEST_LOG_ENABLED"] = os.getenv("REQUEST_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+    app.config["ACTIVE_SEQUENCE_CACHE_ENABLED"] = os.getenv("ACTIVE_SEQUENCE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    app.config["ACTIVE_SEQUENCE_CACHE_MAX_ENTRIES"] = int(os.getenv("ACTIVE_SEQUENCE_CACHE_MAX_ENTRIES", "10000"))
+    app.config["ACTIVE_SEQUENCE_CACHE_MAX_BYTES"] = int(os.getenv("ACTIVE_SEQUENCE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    app.config["ACTIVE_SEQUENCE_CACHE_URL"] = os.getenv("ACTIVE_SEQUENCE_CACHE_URL")
+    app.config["ACTIVE_SEQUENCE_CACHE_TTL"] = int(os.getenv("ACTIVE_SEQUENCE_CACHE_TTL", "3600"))
+    app.config["OPENAI_CLASSIFY_TIMEOUT"] = float(os.getenv("OPENAI_CLASSIFY_TIMEOUT", "10"))
+    app.config["OPENAI_STEP_TIMEOUT"] = float(os.getenv("OPENAI_STEP_TIMEOUT", "30"))
+    app.config["OPENAI_SEQUENCE_TIMEOUT"] = float(os.getenv("OPENAI_SEQUENCE_TIMEOUT", "60"))
+    app.config["OPENAI_SUMMARY_TIMEOUT"] = float(os.getenv("OPENAI_SUMMARY_TIMEOUT", "30"))
+    app.config["OPENAI_CONNECT_TIMEOUT"] = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    app.config["OPENAI_MAX_RETRIES"] = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    app.config["OPENAI_RETRY_BASE_DELAY"] = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+    app.config["OPENAI_RETRY_MAX_DELAY"] = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+    app.config["OPENAI_MAX_CONCURRENCY"] = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+    app.config["OPENAI_QUEUE_TIMEOUT"] = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "10"))
+    app.config["OPENAI_MAX_CONNECTIONS"] = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    app.config["OPENAI_BREAKER_FAILURES"] = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+    app.config["OPENAI_BREAKER_RESET_SECONDS"] = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+    app.config["CHAT_ASYNC_JOBS"] = os.getenv("CHAT_ASYNC_JOBS", "false").lower() in ("1", "true", "yes")
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", "4"))
+    app.config["JOB_MAX_WAIT_SECONDS"] = float(os.getenv("JOB_MAX_WAIT_SECONDS", "30"))
+    app.config["JOB_TIMEOUT_SECONDS"] = int(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+    app.config["JOB_WEBHOOK_ALLOWED_HOSTS"] = os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "")
+    app.config["JOB_WEBHOOK_TIMEOUT"] = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "5"))
+    app.config["IDEMPOTENCY_KEY_TTL_SECONDS"] = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+    app.config["COMPRESSION_ENABLED"] = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+    app.config["COMPRESSION_MIN_BYTES"] = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+    app.config["COMPRESSION_LEVEL"] = int(os.getenv("COMPRESSION_LEVEL", "5"))
+    app.config["EDIT_STEP_MAX_PARALLEL"] = int(os.getenv("EDIT_STEP_MAX_PARALLEL", "4"))
+    app.config["STEP_REVISION_SNAPSHOT_INTERVAL"] = int(os.getenv("STEP_REVISION_SNAPSHOT_INTERVAL", "10"))
+    app.config["SIMILAR_SEQUENCE_CACHE_ENABLED"] = os.getenv("SIMILAR_SEQUENCE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    app.config["SIMILAR_SEQUENCE_THRESHOLD"] = float(os.getenv("SIMILAR_SEQUENCE_THRESHOLD", "0.9"))
+    app.config["SIMILAR_SEQUENCE_SEED_THRESHOLD"] = float(os.getenv("SIMILAR_SEQUENCE_SEED_THRESHOLD", "0.6"))
+    app.config["SIMILAR_SEQUENCE_MIN_SHINGLES"] = int(os.getenv("SIMILAR_SEQUENCE_MIN_SHINGLES", "8"))
+    app.config["SIMILAR_SEQUENCE_SCOPE"] = os.getenv("SIMILAR_SEQUENCE_SCOPE", "user")
+    app.config["SIMILAR_SEQUENCE_MAX_ENTRIES"] = int(os.getenv("SIMILAR_SEQUENCE_MAX_ENTRIES", "10000"))
+    app.config["SIMILAR_SEQUENCE_TTL_SECONDS"] = int(os.getenv("SIMILAR_SEQUENCE_TTL_SECONDS", "86400"))
+    app.config.update(config or {})
 
    
+    configure_llm(app.config)
+    configure_database(app)
     db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, app.config)
+        init_metrics(app, db.engine)
 
     
-    with app.app_context():
-        db.create_all()
+    if app.config["DB_AUTO_UPGRADE"]:
+        from .migrations import upgrade_database
+        with app.app_context():
+            upgrade_database()
+
+    from .cache import init_active_sequence_cache
+    init_active_sequence_cache(app)
+
+    from .jobs import init_job_queue
+    init_job_queue(app)
+
+    from .compression import init_compression
+    init_compression(app)
+
+    from .similarity import init_similar_sequence_index
+    init_similar_sequence_index(app)
+
+    from .chat_archive import init_chat_archive
+    init_chat_archive(app)
+
+    from .cli import register_commands
+    register_commands(app)
 
     
     from .routes import main_bp
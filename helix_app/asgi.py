@@ -0,0 +1,454 @@
+import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response, current_app, g, jsonify
+
+from .app import create_app, db
+from .cache import load_active_sequence
+from .idempotency import HEADER as IDEMPOTENCY_HEADER, request_hash
+from .llm import chat_completion_async
+from .metrics import DEDUPLICATED_REQUESTS, finish_trace, set_request_intent, start_trace
+from .routes import (
+    _apply_added_step,
+    _apply_edit_responses,
+    _apply_new_sequence,
+    _apply_new_sequence_choice,
+    _apply_single_call_choice,
+    _chat_flight_key,
+    _chat_request_error,
+    _commit_chat,
+    _conversation_for,
+    _load_chat_context,
+    _normalized_message,
+    _openai_error,
+    _record_shared_chat,
+    _resolve_edit_targets,
+    _stale_sequence_reply,
+    _stage_generation_job,
+    _stage_incoming_messages,
+    _stored_chat_response,
+    _use_single_call
+)
+from .similarity import find_similar_sequence, similar_sequence_cache_enabled
+from .singleflight import AsyncSingleFlight
+from .utils import (
+    classify_intent_with_confidence_async,
+    function_definitions,
+    single_call_function_definitions,
+    build_single_call_messages,
+    build_seeded_sequence_messages,
+    build_add_step_messages,
+    extract_insert_position,
+    parse_added_step,
+    build_edit_step_messages
+)
+
+
+def create_asgi_app(flask_app=None):
+    """
+    Build an ASGI application around the Flask app from create_app.
+
+    /api/chat and /api/classify are served natively with the async OpenAI
+    client, so a chat waiting on the model only holds a coroutine. Database
+    work runs on a small thread pool. Every other route is passed through to
+    the Flask app unchanged.
+
+    Run with: uvicorn --factory helix_app.asgi:create_asgi_app
+    """
+    flask_app = flask_app or create_app()
+    wsgi_app = WsgiToAsgi(flask_app)
+    executor = ThreadPoolExecutor(
+        max_workers=flask_app.config["ASYNC_DB_WORKERS"],
+        thread_name_prefix="helix-db"
+    )
+    handlers = {
+        ("POST", "/api/chat"): chat,
+        ("POST", "/api/classify"): classify,
+    }
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await _lifespan(receive, send, executor)
+            return
+
+        handler = handlers.get((scope.get("method"), scope["path"].rstrip("/")))
+        if scope["type"] != "http" or handler is None:
+            # WsgiToAsgi calls send from its worker thread through
+            # AsyncToSync, which leaves its per-call executor in the context
+            # uvicorn keeps for the connection. The next request on a
+            # keep-alive connection would then fail with "CurrentThreadExecutor
+            # already quit", so each request starts from an empty context.
+            await contextvars.Context().run(asyncio.ensure_future, wsgi_app(scope, receive, send))
+            return
+
+        trace = start_trace(scope["path"].rstrip("/"), scope["method"], flask_app.config["REQUEST_LOG_ENABLED"])
+        bridge = _FlaskBridge(flask_app, scope, executor)
+        try:
+            data = json.loads(await _read_body(receive) or b"{}")
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            response = await bridge.respond(_error_reply, "Invalid JSON body.", 400)
+        else:
+            try:
+                response = await handler(bridge, data)
+            except Exception as e:
+                print("Async handler error:", e)
+                response = await bridge.respond(_error_reply, "Internal server error.", 500)
+        await _send_response(send, response)
+        finish_trace(trace, response.status_code)
+
+    return app
+
+
+class _FlaskBridge:
+    """
+    Runs blocking database work for an async request on the thread pool,
+    inside a Flask request context so Flask-SQLAlchemy sessions, jsonify and
+    the app's after_request hooks behave as they do under WSGI.
+    """
+
+    def __init__(self, flask_app, scope, executor):
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.path = scope["path"]
+        self.method = scope["method"]
+        self.headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        self.executor = executor
+
+    async def run(self, fn, *args):
+        def call():
+            with self.flask_app.test_request_context(self.path, method=self.method, headers=self.headers):
+                return fn(*args)
+
+        # Carry the request's context (its trace) into the worker thread.
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, call)
+
+    async def respond(self, fn, *args):
+        return await self.run(lambda: _finalize(fn(*args)))
+
+
+def _finalize(rv):
+    return current_app.process_response(current_app.make_response(rv))
+
+
+def _error_reply(reply, status):
+    return jsonify({"reply": reply, "sequence": []}), status
+
+
+_chat_flights = AsyncSingleFlight()
+_classify_flights = AsyncSingleFlight()
+
+
+async def classify(bridge, data):
+    user_input = data.get("message", "").strip()
+    if not user_input:
+        return await bridge.respond(jsonify, {"intent": "new_sequence"})
+    (intent, confidence, source), shared = await _classify_flights.do(
+        _normalized_message(user_input),
+        lambda: classify_intent_with_confidence_async(user_input, bridge.config["INTENT_CONFIDENCE_THRESHOLD"])
+    )
+    if shared:
+        DEDUPLICATED_REQUESTS.labels("classify", "coalesced").inc()
+    return await bridge.respond(jsonify, {"intent": intent, "confidence": confidence, "source": source})
+
+
+async def chat(bridge, data):
+    user_id = data.get("user_id")
+    if not user_id or not str(data.get("message", "")).strip():
+        return await _chat(bridge, data)
+
+    # Same coalescing as the WSGI route; see routes.chat. The response is
+    # shared after compression, so only clients accepting the same
+    # encodings share one.
+    key = await bridge.run(lambda: _chat_flight_key(data, load_active_sequence(user_id)))
+    key += (bridge.headers.get("accept-encoding"),)
+    response, shared = await _chat_flights.do(key, lambda: _chat(bridge, data))
+    if shared:
+        await bridge.run(_record_shared_chat, {
+            "user_id": user_id,
+            "idempotency_key": bridge.headers.get(IDEMPOTENCY_HEADER.lower()),
+            "request_hash": request_hash(data),
+        }, response)
+    return response
+
+
+async def _chat(bridge, data):
+    single_call, error = await bridge.run(_screen_chat, data)
+    if error is not None:
+        return error
+
+    # The intent classification runs concurrently with the initial database
+    # work. A request with an Idempotency-Key may be a replay, which needs
+    # no classification, so it is only classified once _prepare_chat has
+    # found no stored response.
+    classification = None
+    if single_call:
+        ctx = await bridge.run(_prepare_chat, data, single_call)
+    elif bridge.headers.get(IDEMPOTENCY_HEADER.lower()):
+        ctx = await bridge.run(_prepare_chat, data, single_call)
+        if not isinstance(ctx, Response):
+            classification = await _classify_chat(bridge, ctx["user_input"])
+    else:
+        ctx, classification = await asyncio.gather(
+            bridge.run(_prepare_chat, data, single_call),
+            _classify_chat(bridge, data["message"].strip())
+        )
+    if isinstance(ctx, Response):
+        return ctx
+
+    user_id = ctx["user_id"]
+    user_input = ctx["user_input"]
+    existing_steps = ctx["existing_steps"]
+
+    def fail(reply, status):
+        return bridge.respond(_finish, ctx, lambda active_sequence, steps: _error_reply(reply, status))
+
+    def openai_fail(error, reply):
+        return bridge.respond(_finish, ctx, lambda active_sequence, steps: _openai_error(error, reply))
+
+    if single_call:
+        if ctx["as_job"]:
+            return await bridge.respond(
+                _finish, ctx, lambda active_sequence, steps: _stage_generation_job(ctx, "single_call")
+            )
+
+        try:
+            response = await chat_completion_async(
+                "single_call",
+                model="gpt-4o",
+                messages=ctx["messages"],
+                functions=single_call_function_definitions,
+                function_call="auto",
+                temperature=0.7
+            )
+        except Exception as e:
+            return await openai_fail(e, "Error calling OpenAI API")
+
+        choice = response.choices[0]
+        return await bridge.respond(
+            _finish_on_steps, ctx,
+            lambda active_sequence, steps: _apply_single_call_choice(user_id, active_sequence, steps, choice)
+        )
+
+    intent = classification[0]
+    set_request_intent(intent)
+
+    if intent == "add_step":
+        if not ctx["active_sequence"]:
+            return await fail("No active sequence to add a step to.", 400)
+
+        try:
+            response = await chat_completion_async(
+                "add_step",
+                model="gpt-4o",
+                messages=build_add_step_messages(existing_steps, user_input),
+                temperature=0.7
+            )
+        except Exception as e:
+            return await openai_fail(e, "Error calling OpenAI API")
+
+        new_step = parse_added_step(response.choices[0].message.content)
+
+        def apply_added_step(active_sequence, steps):
+            if not active_sequence:
+                return _error_reply("No active sequence to add a step to.", 400)
+            step_number = extract_insert_position(user_input, len(steps))
+            return _apply_added_step(user_id, active_sequence, steps, new_step, intent, step_number)
+
+        return await bridge.respond(_finish_on_steps, ctx, apply_added_step)
+
+    elif intent == "edit_step":
+        if not ctx["active_sequence"]:
+            return await fail("No active sequence to edit.", 400)
+
+        target_steps, error = await bridge.run(_find_edit_targets, user_input, existing_steps)
+        if error:
+            return await bridge.respond(_finish, ctx, lambda active_sequence, steps: error)
+
+        try:
+            ai_responses = await _rewrite_steps(bridge, existing_steps, target_steps, user_input)
+        except Exception as e:
+            return await openai_fail(e, "Error calling OpenAI API for step edit")
+
+        def apply_edit_response(active_sequence, steps):
+            # The reloaded steps are new snapshots, so match the targets by ID.
+            steps_by_id = {s.id: s for s in steps}
+            missing = [t.step_number for t in target_steps if t.id not in steps_by_id]
+            if not active_sequence or missing:
+                return _error_reply(f"Step {missing[0] if missing else target_steps[0].step_number} not found.", 404)
+            return _apply_edit_responses(
+                user_id, active_sequence, steps, [steps_by_id[t.id] for t in target_steps], ai_responses, intent
+            )
+
+        return await bridge.respond(_finish_on_steps, ctx, apply_edit_response)
+
+    else:
+        db_history, similar, action = None, None, "miss"
+        if await bridge.run(similar_sequence_cache_enabled):
+            db_history = await bridge.run(_load_conversation, ctx)
+            similar, action = await bridge.run(find_similar_sequence, user_id, user_input, db_history)
+        if action == "serve":
+            return await bridge.respond(
+                _finish, ctx,
+                lambda active_sequence, steps: _apply_new_sequence(user_id, active_sequence, similar.args, intent)
+            )
+        if ctx["as_job"]:
+            return await bridge.respond(
+                _finish, ctx, lambda active_sequence, steps: _stage_generation_job(ctx, "new_sequence")
+            )
+
+        if db_history is None:
+            db_history = await bridge.run(_load_conversation, ctx)
+        messages = db_history
+        if action == "seed":
+            messages = build_seeded_sequence_messages(db_history, similar.args)
+
+        try:
+            response = await chat_completion_async(
+                "new_sequence",
+                model="gpt-4o",
+                messages=messages,
+                functions=function_definitions,
+                function_call="auto",
+                temperature=0.7
+            )
+        except Exception as e:
+            return await openai_fail(e, "Error calling OpenAI API")
+
+        choice = response.choices[0]
+        return await bridge.respond(
+            _finish, ctx,
+            lambda active_sequence, steps: _apply_new_sequence_choice(
+                user_id, active_sequence, choice, intent, user_input, db_history
+            )
+        )
+
+
+def _screen_chat(data):
+    error = _chat_request_error(data)
+    return _use_single_call(data), _finalize(error) if error else None
+
+
+def _classify_chat(bridge, user_input):
+    return classify_intent_with_confidence_async(user_input, bridge.config["INTENT_CONFIDENCE_THRESHOLD"])
+
+
+def _prepare_chat(data, single_call):
+    error, ctx = _load_chat_context(data)
+    if error:
+        return _finalize(error)
+    stored = _stored_chat_response(ctx)
+    if stored:
+        return _finalize(stored)
+    if single_call and not ctx["as_job"]:
+        ctx["messages"] = build_single_call_messages(ctx["existing_steps"], _load_conversation(ctx))
+    return ctx
+
+
+def _load_conversation(ctx):
+    # Building the window may update the user's running summary, which has
+    # to be committed here because this thread's session ends with the call.
+    messages = _conversation_for(ctx)
+    db.session.commit()
+    return messages
+
+
+def _find_edit_targets(user_input, existing_steps):
+    target_steps, error = _resolve_edit_targets(user_input, existing_steps)
+    return target_steps, _finalize(error) if error else None
+
+
+async def _rewrite_steps(bridge, existing_steps, target_steps, user_input):
+    """
+    Async counterpart of routes._rewrite_steps: one rewrite call per target
+    step, at most EDIT_STEP_MAX_PARALLEL in flight.
+    """
+    semaphore = asyncio.Semaphore(max(1, bridge.config["EDIT_STEP_MAX_PARALLEL"]))
+
+    async def rewrite(target_step):
+        async with semaphore:
+            response = await chat_completion_async(
+                "edit_step",
+                model="gpt-4o",
+                messages=build_edit_step_messages(existing_steps, target_step, user_input),
+                temperature=0.7
+            )
+        return response.choices[0].message.content.strip()
+
+    return await asyncio.gather(*[rewrite(target_step) for target_step in target_steps])
+
+
+def _finish(ctx, apply):
+    """
+    Write the request as one unit of work: stage the incoming messages,
+    look the active sequence up again in case another request changed it
+    while the model was generating, let apply stage the result and commit
+    once.
+    """
+    g.sequence_format = ctx["sequence_format"]
+    _stage_incoming_messages(ctx)
+    with db.session.no_autoflush:
+        active_sequence = load_active_sequence(ctx["user_id"], verify=True)
+        existing_steps = active_sequence.steps if active_sequence else []
+        rv = apply(active_sequence, existing_steps)
+    return _commit_chat(ctx, rv)
+
+
+def _finish_on_steps(ctx, apply):
+    """
+    _finish for a result the model built from the steps in ctx (an added or
+    edited step, or a single-call reply). If another request changed or
+    replaced the active sequence meanwhile, nothing is applied and the
+    answer is the 409 the WSGI path gives for a version mismatch.
+    """
+    def apply_if_current(active_sequence, steps):
+        if _sequence_version(active_sequence) != _sequence_version(ctx["active_sequence"]):
+            return _stale_sequence_reply(ctx["user_id"])
+        return apply(active_sequence, steps)
+
+    return _finish(ctx, apply_if_current)
+
+
+def _sequence_version(active_sequence):
+    return (active_sequence.id, active_sequence.version) if active_sequence else None
+
+
+async def _read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def _send_response(send, response):
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [
+            (key.lower().encode("latin-1"), value.encode("latin-1"))
+            for key, value in response.headers.items()
+        ],
+    })
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+async def _lifespan(receive, send, executor):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,334 @@
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select
+
+from .app import db
+from .models import Sequence
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_MISSING = object()
+
+
+class StepSnapshot:
+    """
+    One step of a SequenceSnapshot. step_number is the step's place in its
+    sequence, counted from 1; id and position identify and order the row.
+    """
+    __slots__ = ("step_number", "title", "content", "id", "position")
+
+    def __init__(self, step_number, title, content, id=None, position=None):
+        self.step_number = step_number
+        self.title = title
+        self.content = content
+        self.id = id
+        self.position = position
+
+
+def number_steps(steps, positions=None):
+    """
+    StepSnapshots of steps (SequenceStep rows or snapshots) in the given
+    order, numbered from 1. positions, when given, replaces the steps'
+    positions.
+    """
+    steps = list(steps)
+    if positions is None:
+        positions = [step.position for step in steps]
+    return [
+        StepSnapshot(number, step.title, step.content, step.id, position)
+        for number, (step, position) in enumerate(zip(steps, positions), start=1)
+    ]
+
+
+class SequenceSnapshot:
+    """
+    Read-only copy of a user's active sequence and its ordered steps, safe
+    to share between requests and threads. Changes are made by building a
+    new snapshot, never by mutating a cached one.
+    """
+    __slots__ = ("id", "title", "steps", "version")
+
+    def __init__(self, id, title, steps, version=1):
+        self.id = id
+        self.title = title
+        self.steps = steps
+        self.version = version
+
+    @classmethod
+    def from_model(cls, sequence, steps):
+        return cls(sequence.id, sequence.title, number_steps(steps), sequence.version)
+
+    def with_steps(self, steps, version):
+        return SequenceSnapshot(self.id, self.title, steps, version)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "version": self.version,
+            "steps": [[s.step_number, s.title, s.content, s.id, s.position] for s in self.steps],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data["title"], [StepSnapshot(*step) for step in data["steps"]], data.get("version", 1))
+
+    def size(self):
+        size = sys.getsizeof(self.title or "") + 200
+        for step in self.steps:
+            size += sys.getsizeof(step.title or "") + sys.getsizeof(step.content or "") + 120
+        return size
+
+
+class ActiveSequenceCache:
+    """
+    In-process LRU cache of user_id -> SequenceSnapshot (or None for users
+    without a sequence), bounded by entry count and approximate memory.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sequence_owners = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return _MISSING
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, snapshot):
+        size = snapshot.size() if snapshot else 100
+        with self.lock:
+            self._insert(user_id, snapshot, size)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self._remove(user_id)
+
+    def patch_step(self, sequence_id, step_id, version, **changes):
+        """
+        Apply a committed change to one step of a cached sequence, if that
+        sequence is some user's cached active sequence. version is the
+        sequence's version after the change.
+        """
+        # Read and replace the entry under one lock, so a concurrent set()
+        # or invalidate() is never overwritten with a patched older entry.
+        with self.lock:
+            user_id = self.sequence_owners.get(sequence_id)
+            entry = self.entries.get(user_id) if user_id else None
+            if not entry or not entry[0] or entry[0].id != sequence_id:
+                return
+            snapshot = entry[0].with_steps([
+                _patched(s, changes) if s.id == step_id else s
+                for s in entry[0].steps
+            ], version)
+            self._insert(user_id, snapshot, snapshot.size())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": "memory",
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _insert(self, user_id, snapshot, size):
+        self._remove(user_id)
+        if size > self.max_bytes:
+            return
+        self.entries[user_id] = (snapshot, size)
+        self.total_bytes += size
+        if snapshot:
+            self.sequence_owners[snapshot.id] = user_id
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry:
+            self.total_bytes -= entry[1]
+            if entry[0] and self.sequence_owners.get(entry[0].id) == user_id:
+                del self.sequence_owners[entry[0].id]
+
+
+class RedisActiveSequenceCache:
+    """
+    Shared cache for running several server processes. Entries are JSON
+    snapshots with a TTL; Redis' maxmemory/LRU policy does the eviction.
+    """
+
+    def __init__(self, url, ttl_seconds):
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, user_id):
+        raw = self.client.get(f"helix:active_sequence:{user_id}")
+        if raw is None:
+            return _MISSING
+        data = json.loads(raw)
+        if data and any(len(step) < 5 for step in data["steps"]):
+            # Written before steps carried their ID and position.
+            return _MISSING
+        return SequenceSnapshot.from_dict(data) if data else None
+
+    def set(self, user_id, snapshot):
+        pipe = self.client.pipeline()
+        pipe.set(
+            f"helix:active_sequence:{user_id}",
+            json.dumps(snapshot.to_dict() if snapshot else None),
+            ex=self.ttl_seconds
+        )
+        if snapshot:
+            pipe.set(f"helix:sequence_owner:{snapshot.id}", user_id, ex=self.ttl_seconds)
+        pipe.execute()
+
+    def invalidate(self, user_id):
+        self.client.delete(f"helix:active_sequence:{user_id}")
+
+    def patch_step(self, sequence_id, step_id, version, **changes):
+        # Patching would need a read-modify-write across processes; dropping
+        # the entry is cheaper and always correct.
+        user_id = self.client.get(f"helix:sequence_owner:{sequence_id}")
+        if user_id:
+            self.invalidate(user_id.decode())
+
+    def stats(self):
+        return {"backend": "redis"}
+
+
+class NullActiveSequenceCache:
+    def get(self, user_id):
+        return _MISSING
+
+    def set(self, user_id, snapshot):
+        pass
+
+    def invalidate(self, user_id):
+        pass
+
+    def patch_step(self, sequence_id, step_id, version, **changes):
+        pass
+
+    def stats(self):
+        return {"backend": "disabled"}
+
+
+def _patched(step, changes):
+    return StepSnapshot(
+        step.step_number,
+        changes.get("title", step.title),
+        changes.get("content", step.content),
+        step.id,
+        step.position
+    )
+
+
+def init_active_sequence_cache(app):
+    config = app.config
+    url = config["ACTIVE_SEQUENCE_CACHE_URL"]
+    if not config["ACTIVE_SEQUENCE_CACHE_ENABLED"]:
+        cache = NullActiveSequenceCache()
+    elif url:
+        if redis is None:
+            raise RuntimeError("ACTIVE_SEQUENCE_CACHE_URL is set but the redis package is not installed.")
+        cache = RedisActiveSequenceCache(url, config["ACTIVE_SEQUENCE_CACHE_TTL"])
+    else:
+        cache = ActiveSequenceCache(
+            config["ACTIVE_SEQUENCE_CACHE_MAX_ENTRIES"],
+            config["ACTIVE_SEQUENCE_CACHE_MAX_BYTES"]
+        )
+    app.extensions["active_sequence_cache"] = cache
+
+
+def get_active_sequence_cache():
+    return current_app.extensions["active_sequence_cache"]
+
+
+def _is_current(user_id, snapshot):
+    row = db.session.execute(
+        select(Sequence.id, Sequence.version)
+        .where(Sequence.user_id == user_id, Sequence.archived_at.is_(None))
+        .order_by(Sequence.created_at.desc())
+        .limit(1)
+    ).first()
+    if snapshot is None:
+        return row is None
+    return row is not None and (row.id, row.version) == (snapshot.id, snapshot.version)
+
+
+def load_active_sequence(user_id, verify=False):
+    """
+    Return the user's active sequence as a SequenceSnapshot (None if they
+    have none), from the cache when possible.
+
+    With verify, a cached snapshot is first checked against the stored
+    sequence's ID and version with one small query, and reloaded if they
+    differ. Use it before writing: the in-process cache does not hear about
+    writes made by other server processes.
+    """
+    cache = get_active_sequence_cache()
+    snapshot = cache.get(user_id)
+    if snapshot is not _MISSING:
+        if not verify or _is_current(user_id, snapshot):
+            return snapshot
+        cache.invalidate(user_id)
+
+    with db.session.no_autoflush:
+        sequence = Sequence.query.filter_by(
+            user_id=user_id, archived_at=None
+        ).order_by(Sequence.created_at.desc()).first()
+        snapshot = SequenceSnapshot.from_model(sequence, sequence.steps) if sequence else None
+    cache.set(user_id, snapshot)
+    return snapshot
+
+
+def stage_active_sequence(user_id, snapshot=_MISSING):
+    """
+    Record the user's active sequence as it will be once the current
+    session commits. commit_with_cache() writes it through to the cache.
+    Without a snapshot the entry is dropped and reloaded on the next read.
+    """
+    db.session.info.setdefault("active_sequence_updates", {})[user_id] = snapshot
+
+
+def commit_with_cache():
+    """
+    Commit the session and write staged active-sequence changes through to
+    the cache. If the commit fails the affected users are evicted instead.
+    """
+    updates = db.session.info.pop("active_sequence_updates", {})
+    cache = get_active_sequence_cache()
+    try:
+        db.session.commit()
+    except Exception:
+        for user_id in updates:
+            cache.invalidate(user_id)
+        raise
+    for user_id, snapshot in updates.items():
+        if snapshot is _MISSING:
+            cache.invalidate(user_id)
+        else:
+            cache.set(user_id, snapshot)
@@ -0,0 +1,288 @@
+import json
+import threading
+import time
+import zlib
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, or_, select
+
+from .app import db
+from .models import ChatMessage, ChatMessageArchive, ConversationSummary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+
+# Archive rows (days) read per query when paging through archived history.
+FETCH_BATCH_DAYS = 7
+
+# What an archived message reads back as; it has the ChatMessage attributes
+# the history and conversation code use.
+ArchivedMessage = namedtuple("ArchivedMessage", "id sender message created_at token_count")
+
+
+def _compress(data):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Chat history was archived with zstd; pip install zstandard to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown chat archive codec {codec!r}.")
+
+
+def pack_messages(messages):
+    """
+    (codec, data) for a day's messages: a JSON list of [id, sender, message,
+    created_at, token_count], compressed with zstd when zstandard is
+    installed and zlib otherwise.
+    """
+    payload = [
+        [msg.id, msg.sender, msg.message, msg.created_at.isoformat(), msg.token_count]
+        for msg in messages
+    ]
+    return _compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def unpack_messages(codec, data):
+    """
+    The ArchivedMessages of an archive row, oldest first.
+    """
+    return [
+        ArchivedMessage(msg_id, sender, message, datetime.fromisoformat(created_at), token_count)
+        for msg_id, sender, message, created_at, token_count in json.loads(_decompress(codec, data))
+    ]
+
+
+def _at_or_before(cursor):
+    created_at, msg_id = cursor
+    return or_(
+        ChatMessage.created_at < created_at,
+        and_(ChatMessage.created_at == created_at, ChatMessage.id <= msg_id)
+    )
+
+
+def compact_chat_history(batch_size=1000):
+    """
+    Move old chat messages of every user into ChatMessageArchive; see
+    compact_user_history(). Returns (users, messages) moved.
+    """
+    config = current_app.config
+    after_days = config["CHAT_ARCHIVE_AFTER_DAYS"]
+    keep = config["CHAT_ARCHIVE_KEEP_MESSAGES"]
+    if after_days <= 0 and keep <= 0:
+        return 0, 0
+    cutoff = datetime.utcnow() - timedelta(days=after_days) if after_days > 0 else None
+
+    users = messages = 0
+    last_user_id = None
+    while True:
+        query = (
+            select(ConversationSummary.user_id)
+            .where(ConversationSummary.summarized_through_id.is_not(None))
+            .order_by(ConversationSummary.user_id)
+            .limit(batch_size)
+        )
+        if last_user_id is not None:
+            query = query.where(ConversationSummary.user_id > last_user_id)
+        user_ids = db.session.execute(query).scalars().all()
+        for user_id in user_ids:
+            moved = compact_user_history(user_id, cutoff, keep, batch_size)
+            if moved:
+                users += 1
+                messages += moved
+        if len(user_ids) < batch_size:
+            return users, messages
+        last_user_id = user_ids[-1]
+
+
+def compact_user_history(user_id, cutoff, keep, batch_size=1000):
+    """
+    Move a user's messages created before cutoff, or older than their
+    newest keep messages, into one compressed ChatMessageArchive row per
+    day, batch_size messages per transaction. Returns how many were moved.
+
+    Only messages already folded into the user's conversation summary are
+    moved, so the chat context (build_conversation_window) never has to
+    read the archive. What is archived is always the oldest part of the
+    history.
+    """
+    summary = db.session.get(ConversationSummary, user_id)
+    if summary is None or summary.summarized_through_id is None:
+        return 0
+    marker = (summary.summarized_through_at, summary.summarized_through_id)
+
+    rules = []
+    if cutoff is not None:
+        rules.append(ChatMessage.created_at < cutoff)
+    if keep > 0:
+        oldest_kept = db.session.execute(
+            select(ChatMessage.created_at, ChatMessage.id)
+            .where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .offset(keep)
+            .limit(1)
+        ).first()
+        if oldest_kept:
+            rules.append(_at_or_before(oldest_kept))
+    if not rules:
+        return 0
+
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select(ChatMessage.id, ChatMessage.sender, ChatMessage.message, ChatMessage.created_at, ChatMessage.token_count)
+            .where(ChatMessage.user_id == user_id, _at_or_before(marker), or_(*rules))
+            .order_by(ChatMessage.created_at, ChatMessage.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return moved
+
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[row.created_at.date()].append(row)
+        for day, day_rows in by_day.items():
+            _merge_into_archive(user_id, day, day_rows)
+        db.session.execute(delete(ChatMessage).where(ChatMessage.id.in_([row.id for row in rows])))
+        db.session.commit()
+
+        moved += len(rows)
+        if len(rows) < batch_size:
+            return moved
+
+
+def _merge_into_archive(user_id, day, rows):
+    """
+    Add rows to the user's archive row for day, creating it if needed. A
+    message already in the archive (from an overlapping run) is kept once.
+    """
+    archive = db.session.execute(
+        select(ChatMessageArchive)
+        .where(ChatMessageArchive.user_id == user_id, ChatMessageArchive.day == day)
+        .with_for_update()
+    ).scalar_one_or_none()
+
+    messages = {}
+    if archive is not None:
+        messages = {msg.id: msg for msg in unpack_messages(archive.codec, archive.data)}
+    for row in rows:
+        messages[row.id] = ArchivedMessage(row.id, row.sender, row.message, row.created_at, row.token_count)
+    ordered = sorted(messages.values(), key=lambda msg: (msg.created_at, msg.id))
+    codec, data = pack_messages(ordered)
+
+    if archive is None:
+        archive = ChatMessageArchive(user_id=user_id, day=day)
+        db.session.add(archive)
+    archive.first_message_id = min(messages)
+    archive.last_message_id = max(messages)
+    archive.message_count = len(ordered)
+    archive.codec = codec
+    archive.data = data
+
+
+def has_archived_messages(user_id):
+    return db.session.execute(
+        select(ChatMessageArchive.id).where(ChatMessageArchive.user_id == user_id).limit(1)
+    ).first() is not None
+
+
+def load_archived_page(user_id, before, limit):
+    """
+    Return (messages, has_more) for the newest limit archived messages
+    older than the (created_at, id) cursor before, in chronological order,
+    like the hot-table page in routes._load_chat_page. Only the days the
+    page needs are decompressed.
+    """
+    newest_first = []
+    day_filter = ChatMessageArchive.day <= before[0].date() if before else None
+    while len(newest_first) <= limit:
+        query = (
+            select(ChatMessageArchive.day, ChatMessageArchive.codec, ChatMessageArchive.data)
+            .where(ChatMessageArchive.user_id == user_id)
+            .order_by(ChatMessageArchive.day.desc())
+            .limit(FETCH_BATCH_DAYS)
+        )
+        if day_filter is not None:
+            query = query.where(day_filter)
+        rows = db.session.execute(query).all()
+
+        for row in rows:
+            for msg in reversed(unpack_messages(row.codec, row.data)):
+                if before is None or (msg.created_at, msg.id) < before:
+                    newest_first.append(msg)
+            if len(newest_first) > limit:
+                break
+        if len(rows) < FETCH_BATCH_DAYS:
+            break
+        day_filter = ChatMessageArchive.day < rows[-1].day
+
+    has_more = len(newest_first) > limit
+    return list(reversed(newest_first[:limit])), has_more
+
+
+def archived_messages_since(user_id, message_id, limit):
+    """
+    Up to limit archived messages with an id above message_id, by id, for
+    sync tokens issued before their messages were archived.
+    """
+    found = []
+    last_day = None
+    while len(found) < limit:
+        query = (
+            select(ChatMessageArchive.day, ChatMessageArchive.codec, ChatMessageArchive.data)
+            .where(ChatMessageArchive.user_id == user_id, ChatMessageArchive.last_message_id > message_id)
+            .order_by(ChatMessageArchive.day)
+            .limit(FETCH_BATCH_DAYS)
+        )
+        if last_day is not None:
+            query = query.where(ChatMessageArchive.day > last_day)
+        rows = db.session.execute(query).all()
+        for row in rows:
+            found.extend(msg for msg in unpack_messages(row.codec, row.data) if msg.id > message_id)
+        if len(rows) < FETCH_BATCH_DAYS:
+            break
+        last_day = rows[-1].day
+    return sorted(found, key=lambda msg: msg.id)[:limit]
+
+
+def init_chat_archive(app):
+    """
+    Compact chat history every CHAT_ARCHIVE_INTERVAL_SECONDS in a
+    background thread. Off (0) by default; "flask --app run.py
+    compact-chat-history" does the same from cron.
+    """
+    interval = app.config["CHAT_ARCHIVE_INTERVAL_SECONDS"]
+    if interval <= 0:
+        return
+    thread = threading.Thread(
+        target=_compact_periodically, args=(app, interval), name="helix-chat-archive", daemon=True
+    )
+    thread.start()
+
+
+def _compact_periodically(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                users, messages = compact_chat_history()
+                if messages:
+                    print(f"Archived {messages} chat messages of {users} users.")
+            except Exception as e:
+                print("Chat history compaction error:", e)
+                db.session.rollback()
+            finally:
+                db.session.remove()
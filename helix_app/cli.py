@@ -0,0 +1,88 @@
+import click
+
+
+def register_commands(app):
+    """
+    Register the app's flask CLI commands, e.g. flask --app run.py upgrade-db
+    """
+
+    @app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """Create missing tables and apply pending schema migrations."""
+        from .migrations import current_version, upgrade_database
+        upgrade_database()
+        click.echo(f"Database schema is at version {current_version()}.")
+
+    @app.cli.command("prune-idempotency-keys")
+    def prune_idempotency_keys_command():
+        """Delete stored chat responses older than IDEMPOTENCY_KEY_TTL_SECONDS."""
+        from .idempotency import prune_stored_responses
+        click.echo(f"Deleted {prune_stored_responses()} expired idempotency keys.")
+
+    @app.cli.command("compact-chat-history")
+    @click.option("--batch-size", type=int, default=1000, show_default=True, help="Messages moved per transaction.")
+    def compact_chat_history_command(batch_size):
+        """Move chat messages older than CHAT_ARCHIVE_AFTER_DAYS or CHAT_ARCHIVE_KEEP_MESSAGES into the archive."""
+        from .chat_archive import compact_chat_history
+        users, messages = compact_chat_history(max(1, batch_size))
+        click.echo(f"Archived {messages} chat messages of {users} users.")
+
+    @app.cli.command("render-sequence")
+    @click.argument("sequence_id", type=int)
+    @click.argument("recipients", type=click.File("r", encoding="utf-8"))
+    @click.option("--output", "-o", type=click.File("w", encoding="utf-8"), default="-",
+                  help="Where to write the rendered NDJSON (default: stdout).")
+    @click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]),
+                  help="Recipient file format (default: from the file extension, else ndjson).")
+    @click.option("--workers", type=int, default=1, show_default=True, help="Worker processes.")
+    @click.option("--chunk-size", type=int, default=1000, show_default=True, help="Recipients per work unit.")
+    def render_sequence_command(sequence_id, recipients, output, fmt, workers, chunk_size):
+        """Render a sequence's {{Variable}} placeholders for every recipient in a CSV or NDJSON file."""
+        import time
+        from sqlalchemy.orm import selectinload
+        from .app import db
+        from .models import Sequence
+        from .personalize import compile_sequence, read_recipients, render_to_stream
+
+        sequence = db.session.get(Sequence, sequence_id, options=[selectinload(Sequence.steps)])
+        if sequence is None:
+            raise click.ClickException(f"Sequence {sequence_id} not found.")
+        compiled = compile_sequence(sequence)
+        db.session.remove()
+
+        fmt = fmt or ("csv" if recipients.name.lower().endswith(".csv") else "ndjson")
+        started = time.perf_counter()
+        rendered, missing, errors = render_to_stream(
+            compiled, read_recipients(recipients, fmt), output, workers, max(1, chunk_size)
+        )
+        seconds = time.perf_counter() - started
+
+        click.echo(
+            f"Rendered {rendered} recipients in {seconds:.2f}s ({rendered / seconds if seconds else 0:.0f}/s).",
+            err=True
+        )
+        for name, count in missing.most_common():
+            click.echo(f"  {count} recipients have no {name}.", err=True)
+        if errors:
+            click.echo(f"  {errors} rows could not be read; their output lines hold the error.", err=True)
+
+    @app.cli.command("export-data")
+    @click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+    @click.option("--batch-size", type=int, default=1000, show_default=True, help="Rows fetched per round trip.")
+    def export_data_command(output, batch_size):
+        """Export users, sequences, steps, step revisions, chat history and conversation summaries as NDJSON."""
+        from .transfer import export_records
+        counts = export_records(output, max(1, batch_size))
+        click.echo("Exported " + ", ".join(f"{count} {name}s" for name, count in counts.items()) + ".", err=True)
+
+    @app.cli.command("import-data")
+    @click.argument("input_file", metavar="INPUT", type=click.File("r", encoding="utf-8"))
+    @click.option("--batch-size", type=int, default=1000, show_default=True, help="Records per bulk insert and commit.")
+    def import_data_command(input_file, batch_size):
+        """Import an export-data NDJSON file, keeping its IDs."""
+        from .transfer import import_records
+        try:
+            counts = import_records(input_file, max(1, batch_size))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo("Imported " + ", ".join(f"{count} {name}s" for name, count in counts.items()) + ".", err=True)
@@ -0,0 +1,70 @@
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/plain", "text/html", "text/css", "application/javascript")
+
+
+def _encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def _compress(data, encoding, level):
+    if encoding == "br":
+        # Brotli levels run 0-11; map gzip's 1-9 onto the fast end.
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def decoded_body(response):
+    """
+    The response body without its Content-Encoding, for code that stores
+    a response to send again later (to clients that may accept other
+    encodings).
+    """
+    data = response.get_data()
+    encoding = response.headers.get("Content-Encoding")
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    return data
+
+
+def init_compression(app):
+    """
+    Compress responses of at least COMPRESSION_MIN_BYTES with brotli (when
+    installed) or gzip, whichever the client prefers. Streamed responses
+    (SSE) are sent as they are.
+    """
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config["COMPRESSION_ENABLED"]:
+            return response
+        if (
+            response.is_streamed
+            or response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        if len(data) < app.config["COMPRESSION_MIN_BYTES"]:
+            return response
+        encoding = request.accept_encodings.best_match(_encodings())
+        if encoding is None:
+            return response
+
+        response.set_data(_compress(data, encoding, app.config["COMPRESSION_LEVEL"]))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,220 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, event, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .app import db
+from .llm import chat_completion
+from .models import ChatMessage, ConversationSummary
+from .tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+FETCH_BATCH_SIZE = 50
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and Helix, an assistant that writes "
+    "multi-step sales, outreach and recruiting sequences. Update the existing summary with the new messages. "
+    "Keep everything needed to continue the work: who the user is, their company and product, the target "
+    "audience, tone and length preferences, and decisions already made about the sequence. "
+    "Reply with the updated summary only, in at most 200 words."
+)
+
+
+def _message_tokens(msg):
+    tokens = msg.token_count
+    if tokens is None:
+        tokens = count_tokens(msg.message)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def _to_openai(msg):
+    role = "assistant" if msg.sender == "ai" else "user"
+    return {"role": role, "content": msg.message}
+
+
+def _newest_messages(user_id, after, before=None):
+    """
+    Yield the user's messages newest first, strictly between the (created_at, id)
+    cursors after and before, fetching FETCH_BATCH_SIZE rows at a time.
+    """
+    while True:
+        query = ChatMessage.query.filter(ChatMessage.user_id == user_id)
+        if after:
+            query = query.filter(or_(
+                ChatMessage.created_at > after[0],
+                and_(ChatMessage.created_at == after[0], ChatMessage.id > after[1])
+            ))
+        if before:
+            query = query.filter(or_(
+                ChatMessage.created_at < before[0],
+                and_(ChatMessage.created_at == before[0], ChatMessage.id < before[1])
+            ))
+        batch = query.order_by(
+            ChatMessage.created_at.desc(), ChatMessage.id.desc()
+        ).limit(FETCH_BATCH_SIZE).all()
+
+        yield from batch
+        if len(batch) < FETCH_BATCH_SIZE:
+            return
+        before = (batch[-1].created_at, batch[-1].id)
+
+
+def build_conversation_window(user_id, system_prompt, pending_messages=()):
+    """
+    Build the OpenAI message list for a user's conversation within
+    CONVERSATION_TOKEN_BUDGET tokens.
+
+    Only messages newer than the stored running summary are read, newest
+    first, using the token counts cached on each ChatMessage, so the cost is
+    proportional to the recent turns rather than the whole history. When
+    they no longer fit, the older ones are folded into the summary (see
+    _fold_into_summary) and the window shrinks to
+    CONVERSATION_SUMMARY_KEEP_RATIO of the budget, leaving room for several
+    more turns before the next summary update.
+
+    pending_messages are OpenAI-style messages not yet written to the
+    database; they are appended last and count against the budget.
+    """
+    config = current_app.config
+    budget = config["CONVERSATION_TOKEN_BUDGET"]
+
+    summary = db.session.get(ConversationSummary, user_id)
+    marker = None
+    available = budget - count_tokens(system_prompt) - MESSAGE_OVERHEAD_TOKENS
+    available -= sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in pending_messages)
+    if summary:
+        marker = (summary.summarized_through_at, summary.summarized_through_id)
+        available -= summary.token_count + MESSAGE_OVERHEAD_TOKENS
+
+    window = []
+    used = 0
+    overflow = False
+    for msg in _newest_messages(user_id, marker):
+        cost = _message_tokens(msg)
+        if used + cost > available:
+            overflow = True
+            break
+        window.append(msg)
+        used += cost
+
+    if overflow:
+        summary, window = _fold_into_summary(
+            user_id, summary, marker, window, int(available * config["CONVERSATION_SUMMARY_KEEP_RATIO"])
+        )
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({
+            "role": "system",
+            "content": "Summary of the earlier conversation:\n" + summary.summary
+        })
+    messages.extend(_to_openai(msg) for msg in reversed(window))
+    messages.extend(pending_messages)
+    return messages
+
+
+def _fold_into_summary(user_id, summary, marker, window, keep_tokens):
+    """
+    Keep the newest messages of window that fit in keep_tokens and fold
+    everything between the old summary marker and them into the running
+    summary. At most CONVERSATION_SUMMARY_MAX_INPUT_TOKENS of the newest
+    unsummarized messages are sent to the model.
+
+    The summary is staged in the session and written by the caller's
+    commit. If the model call fails the old summary is kept and the
+    overflow is simply dropped from this request's window.
+
+    Returns (summary, kept_messages).
+    """
+    config = current_app.config
+
+    keep = []
+    used = 0
+    for msg in window:
+        cost = _message_tokens(msg)
+        if used + cost > keep_tokens:
+            break
+        keep.append(msg)
+        used += cost
+
+    oldest_kept = (keep[-1].created_at, keep[-1].id) if keep else None
+    to_fold = []
+    fold_tokens = 0
+    for msg in _newest_messages(user_id, marker, oldest_kept):
+        cost = _message_tokens(msg)
+        if to_fold and fold_tokens + cost > config["CONVERSATION_SUMMARY_MAX_INPUT_TOKENS"]:
+            break
+        to_fold.append(msg)
+        fold_tokens += cost
+    if not to_fold:
+        return summary, keep
+
+    transcript = "\n".join(
+        f"{'Helix' if msg.sender == 'ai' else 'User'}: {msg.message}"
+        for msg in reversed(to_fold)
+    )
+    previous = summary.summary if summary else "(none yet)"
+    try:
+        response = chat_completion(
+            "summarize",
+            model=config["CONVERSATION_SUMMARY_MODEL"],
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Existing summary:\n{previous}\n\nNew messages:\n{transcript}"},
+            ],
+            temperature=0
+        )
+        summary_text = response.choices[0].message.content.strip()
+    except Exception as e:
+        print("Summary update error:", e)
+        return summary, keep
+
+    new = summary is None
+    if new:
+        summary = ConversationSummary(user_id=user_id)
+    summary.summary = summary_text
+    summary.token_count = count_tokens(summary_text)
+    summary.summarized_through_at = to_fold[0].created_at
+    summary.summarized_through_id = to_fold[0].id
+    if new:
+        _stage_new_summary(summary)
+    return summary, keep
+
+
+def _stage_new_summary(summary):
+    """
+    Stage a user's first summary. Two chats of a new user can both create
+    one, so instead of a plain INSERT it is written as an upsert by the
+    caller's commit (see _write_new_summaries); the later one wins.
+    """
+    db.session.info.setdefault("new_conversation_summaries", {})[summary.user_id] = summary
+
+
+_UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+@event.listens_for(db.session, "before_commit")
+def _write_new_summaries(session):
+    summaries = session.info.pop("new_conversation_summaries", None)
+    if not summaries:
+        return
+    upsert = _UPSERTS.get(session.get_bind().dialect.name)
+    if upsert is None:
+        session.add_all(summaries.values())
+        return
+    statement = upsert(ConversationSummary).values([
+        {
+            "user_id": summary.user_id,
+            "summary": summary.summary,
+            "token_count": summary.token_count,
+            "summarized_through_at": summary.summarized_through_at,
+            "summarized_through_id": summary.summarized_through_id,
+            "updated_at": datetime.utcnow(),
+        }
+        for summary in summaries.values()
+    ])
+    columns = ("summary", "token_count", "summarized_through_at", "summarized_through_id", "updated_at")
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[ConversationSummary.user_id],
+        set_={column: statement.excluded[column] for column in columns}
+    ))
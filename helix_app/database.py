@@ -0,0 +1,53 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def configure_database(app):
+    """
+    Read the database URI from DATABASE_URL and derive engine options.
+
+    Server databases (e.g. Postgres) get a sized, pre-pinged connection pool.
+    SQLite gets its connect-time pragmas installed by install_sqlite_pragmas.
+    """
+    config = app.config
+    uri = config.get("SQLALCHEMY_DATABASE_URI") or config["DATABASE_URL"]
+    if uri.startswith("postgres://"):
+        uri = "postgresql://" + uri[len("postgres://"):]
+    config["SQLALCHEMY_DATABASE_URI"] = uri
+
+    if make_url(uri).get_backend_name() == "sqlite":
+        return
+
+    options = {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": True,
+    }
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def install_sqlite_pragmas(engine, config):
+    """
+    Apply WAL journaling, synchronous=NORMAL, a busy timeout and a larger
+    page cache to every new SQLite connection. Does nothing for other
+    backends.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+    ]
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
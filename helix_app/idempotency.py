@@ -0,0 +1,77 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app, jsonify
+from sqlalchemy import delete
+
+from .app import db
+from .compression import decoded_body
+from .models import IdempotentRequest
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Fields of a chat body that must match for a stored response to be replayed.
+HASHED_FIELDS = ("user_id", "message", "singleCall", "async", "webhookUrl", "sequenceFormat")
+# Response headers stored along with the body.
+STORED_HEADERS = ("Content-Type", "Location")
+
+
+def request_hash(data):
+    payload = json.dumps({field: data.get(field) for field in HASHED_FIELDS}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cutoff():
+    return datetime.utcnow() - timedelta(seconds=current_app.config["IDEMPOTENCY_KEY_TTL_SECONDS"])
+
+
+def find_stored_response(user_id, key, req_hash):
+    """
+    Return the response stored for the user's key: a copy of the original,
+    or a 422 if the key was used for a different request. None if nothing
+    (unexpired) is stored.
+    """
+    record = db.session.get(IdempotentRequest, (user_id, key))
+    if record is None or record.created_at < _cutoff():
+        return None
+    if record.request_hash != req_hash:
+        return jsonify({"reply": f"{HEADER} was already used for a different request.", "sequence": []}), 422
+
+    response = current_app.response_class(
+        record.body, status=record.status_code, headers=json.loads(record.headers or "{}")
+    )
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+def stage_stored_response(user_id, key, req_hash, response):
+    """
+    Stage response to be stored under the user's key by the current
+    transaction. Server errors are not stored, so retrying them regenerates.
+    The body is stored uncompressed; replays are compressed again to suit
+    the client.
+    """
+    if response.status_code >= 500:
+        return
+    db.session.merge(IdempotentRequest(
+        user_id=user_id,
+        key=key,
+        request_hash=req_hash,
+        status_code=response.status_code,
+        headers=json.dumps({name: response.headers[name] for name in STORED_HEADERS if name in response.headers}),
+        body=decoded_body(response).decode(),
+        created_at=datetime.utcnow()
+    ))
+
+
+def prune_stored_responses():
+    """
+    Delete stored responses older than IDEMPOTENCY_KEY_TTL_SECONDS. Returns
+    how many were deleted.
+    """
+    result = db.session.execute(delete(IdempotentRequest).where(IdempotentRequest.created_at < _cutoff()))
+    db.session.commit()
+    return result.rowcount
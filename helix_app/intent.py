@@ -0,0 +1,168 @@
+import math
+import re
+import threading
+from collections import Counter
+
+from .metrics import INTENT_CLASSIFICATIONS
+
+INTENTS = ("add_step", "edit_step", "new_sequence")
+
+ADD_PATTERN = re.compile(
+    r"\b(add|append|insert|include|another|one more|extra|additional)\b.*\bsteps?\b"
+    r"|\bsteps?\b.*\b(add|append|insert)(ed)?\b"
+)
+NEW_SEQUENCE_PATTERN = re.compile(r"\b(sequences?|campaigns?|start over|from scratch)\b")
+EDIT_PATTERN = re.compile(
+    r"\b(edit|change|update|rewrite|revise|shorten|shorter|lengthen|longer|tweak|fix|modify|"
+    r"replace|rephrase|reword|make|remove|simplify|expand)\b"
+)
+
+TRAINING_EXAMPLES = [
+    ("add a step", "add_step"),
+    ("add another step about pricing", "add_step"),
+    ("add one more step at the end", "add_step"),
+    ("append a follow up email", "add_step"),
+    ("append a step asking for a meeting", "add_step"),
+    ("insert a new step with a case study", "add_step"),
+    ("can you add a final step with a call to action", "add_step"),
+    ("include an extra follow up", "add_step"),
+    ("one more email please", "add_step"),
+    ("add a breakup email", "add_step"),
+    ("we need an additional step about the free trial", "add_step"),
+    ("add a reminder step", "add_step"),
+    ("also add a thank you note", "add_step"),
+    ("put another touchpoint after that", "add_step"),
+    ("tack on a closing message", "add_step"),
+    ("make step 2 shorter", "edit_step"),
+    ("shorten the second step", "edit_step"),
+    ("edit step 3 to mention our discount", "edit_step"),
+    ("change the last step to be more friendly", "edit_step"),
+    ("rewrite the intro step", "edit_step"),
+    ("the first step is too long", "edit_step"),
+    ("step 3 should be shorter", "edit_step"),
+    ("update the final step with a link", "edit_step"),
+    ("make it more casual", "edit_step"),
+    ("tweak the tone of the third step", "edit_step"),
+    ("rephrase step 1", "edit_step"),
+    ("replace the subject line in step 2", "edit_step"),
+    ("make the last one punchier", "edit_step"),
+    ("remove the jargon from step 4", "edit_step"),
+    ("fix the typo in the second email", "edit_step"),
+    ("write a sales sequence for a saas founder", "new_sequence"),
+    ("create a recruiting outreach sequence", "new_sequence"),
+    ("generate a 3 step cold email campaign", "new_sequence"),
+    ("i need an outreach sequence for software engineers", "new_sequence"),
+    ("draft a letter to a potential investor", "new_sequence"),
+    ("start over with a new sequence", "new_sequence"),
+    ("build me a follow up campaign for webinar attendees", "new_sequence"),
+    ("help me recruit a senior designer", "new_sequence"),
+    ("a sequence to reengage churned customers", "new_sequence"),
+    ("cold outreach for a marketing agency", "new_sequence"),
+    ("write emails to book demos with cfos", "new_sequence"),
+    ("hi", "new_sequence"),
+    ("hello can you help me", "new_sequence"),
+    ("new campaign for our product launch", "new_sequence"),
+    ("let's do a different sequence targeting nurses", "new_sequence"),
+]
+
+_classification_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def _features(text):
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class NaiveBayesIntentModel:
+    """
+    Multinomial naive Bayes over word unigrams and bigrams.
+    Small enough to train at import time from TRAINING_EXAMPLES.
+    """
+
+    def __init__(self, examples, alpha=1.0):
+        self.alpha = alpha
+        self.class_counts = Counter()
+        self.feature_counts = {intent: Counter() for intent in INTENTS}
+        self.vocabulary = set()
+        for text, intent in examples:
+            self.class_counts[intent] += 1
+            features = _features(text)
+            self.feature_counts[intent].update(features)
+            self.vocabulary.update(features)
+        self.totals = {intent: sum(counts.values()) for intent, counts in self.feature_counts.items()}
+
+    def predict_proba(self, text):
+        n_examples = sum(self.class_counts.values())
+        vocab_size = len(self.vocabulary)
+        features = [f for f in _features(text) if f in self.vocabulary]
+        log_scores = {}
+        for intent in INTENTS:
+            score = math.log((self.class_counts[intent] + self.alpha) / (n_examples + self.alpha * len(INTENTS)))
+            denominator = self.totals[intent] + self.alpha * vocab_size
+            for feature in features:
+                score += math.log((self.feature_counts[intent][feature] + self.alpha) / denominator)
+            log_scores[intent] = score
+        peak = max(log_scores.values())
+        exp_scores = {intent: math.exp(score - peak) for intent, score in log_scores.items()}
+        total = sum(exp_scores.values())
+        return {intent: value / total for intent, value in exp_scores.items()}
+
+
+_model = NaiveBayesIntentModel(TRAINING_EXAMPLES)
+
+
+def local_classify(user_input):
+    """
+    Classify intent in-process without calling the LLM.
+
+    Explicit phrasing is handled by rules first: an add verb next to "step"
+    is add_step, and any step reference understood by extract_step_numbers
+    ("step 3", "last step", "steps 2-4", "all steps") is edit_step. Messages that talk
+    about a whole sequence or campaign, and everything else, are scored by
+    the naive Bayes model.
+
+    Returns a tuple of (intent, confidence) with confidence in [0, 1].
+    """
+    from .utils import extract_step_numbers
+
+    lower_input = user_input.lower()
+    if not NEW_SEQUENCE_PATTERN.search(lower_input):
+        if ADD_PATTERN.search(lower_input):
+            return "add_step", 0.95
+        # Only whether there is a reference matters, not the step count.
+        if extract_step_numbers(user_input, 1):
+            return "edit_step", 0.97 if EDIT_PATTERN.search(lower_input) else 0.9
+
+    probabilities = _model.predict_proba(user_input)
+    intent = max(probabilities, key=probabilities.get)
+    return intent, probabilities[intent]
+
+
+def record_classification(path):
+    with _counts_lock:
+        _classification_counts[path] += 1
+    INTENT_CLASSIFICATIONS.labels(path).inc()
+
+
+def get_classification_stats():
+    """
+    Return how often each classification path was taken.
+
+    "local" requests were answered in-process, "llm" requests fell back to
+    GPT and "llm_error" requests fell back to GPT but the call failed.
+    """
+    with _counts_lock:
+        counts = dict(_classification_counts)
+    local = counts.get("local", 0)
+    llm = counts.get("llm", 0)
+    llm_error = counts.get("llm_error", 0)
+    total = local + llm + llm_error
+    return {
+        "local": local,
+        "llm": llm,
+        "llm_error": llm_error,
+        "total": total,
+        "llm_calls_saved": local,
+        "local_ratio": (local / total) if total else 0.0,
+    }
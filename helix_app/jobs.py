@@ -0,0 +1,164 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import httpx
+from flask import current_app
+
+from .app import db
+from .models import GenerationJob
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# How often a long-poll re-reads the job, for jobs finished by another
+# server process (jobs finished in this process wake it up at once).
+POLL_INTERVAL_SECONDS = 1.0
+
+
+class GenerationJobQueue:
+    """
+    In-process worker pool for generation jobs. Each job runs in its own
+    app context; waiters are woken whenever a job finishes.
+    """
+
+    def __init__(self, app, workers):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="helix-job")
+        self.condition = threading.Condition()
+
+    def submit(self, job_id, run):
+        self.executor.submit(self._run, job_id, run)
+
+    def wait(self, timeout):
+        with self.condition:
+            self.condition.wait(timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def _run(self, job_id, run):
+        with self.app.app_context():
+            try:
+                run(job_id)
+            except Exception as e:
+                print("Generation job error:", e)
+                db.session.rollback()
+                job = db.session.get(GenerationJob, job_id)
+                if job and job.status not in FINISHED_STATUSES:
+                    finish_job(job, {"reply": "Internal server error.", "sequence": []}, 500)
+                    db.session.commit()
+
+            job = db.session.get(GenerationJob, job_id)
+            if job and job.webhook_url and job.status in FINISHED_STATUSES:
+                _deliver_webhook(job)
+
+        with self.condition:
+            self.condition.notify_all()
+
+
+def init_job_queue(app):
+    app.extensions["generation_jobs"] = GenerationJobQueue(app, app.config["JOB_WORKERS"])
+
+
+def get_job_queue():
+    return current_app.extensions["generation_jobs"]
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def webhook_allowed(url):
+    """
+    Webhooks may only go to http(s) hosts listed in JOB_WEBHOOK_ALLOWED_HOSTS.
+    """
+    allowed = {
+        host.strip().lower()
+        for host in current_app.config["JOB_WEBHOOK_ALLOWED_HOSTS"].split(",")
+        if host.strip()
+    }
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and (parsed.hostname or "").lower() in allowed
+
+
+def stage_generation_job(job, run):
+    """
+    Add job to the session. submit_staged_jobs() hands it to run(job_id) on
+    the worker pool once the session has committed.
+    """
+    db.session.add(job)
+    db.session.info.setdefault("generation_jobs", []).append((job.id, run))
+
+
+def submit_staged_jobs():
+    queue = get_job_queue()
+    for job_id, run in db.session.info.pop("generation_jobs", []):
+        queue.submit(job_id, run)
+
+
+def discard_staged_jobs():
+    db.session.info.pop("generation_jobs", None)
+
+
+def finish_job(job, payload, status_code):
+    """
+    Stage the job's outcome. payload is the /api/chat response body the
+    request would have returned synchronously.
+    """
+    job.status = "succeeded" if status_code < 400 else "failed"
+    job.status_code = status_code
+    job.result = json.dumps(payload)
+    job.completed_at = datetime.utcnow()
+
+
+def expire_stale_job(job):
+    """
+    Fail a job that has not finished within JOB_TIMEOUT_SECONDS, e.g.
+    because the process running it stopped. Returns True if it was expired.
+    """
+    timeout = timedelta(seconds=current_app.config["JOB_TIMEOUT_SECONDS"])
+    if job.status in FINISHED_STATUSES or datetime.utcnow() - job.created_at < timeout:
+        return False
+    finish_job(job, {"reply": "Generation timed out. Please try again.", "sequence": []}, 504)
+    return True
+
+
+def wait_for_job(job_id, timeout):
+    """
+    Return the job once it has finished or timeout seconds have passed
+    (None if there is no such job).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        job = db.session.get(GenerationJob, job_id, populate_existing=True)
+        remaining = deadline - time.monotonic()
+        if job is None or job.status in FINISHED_STATUSES or remaining <= 0:
+            return job
+        # End the read transaction so the next read sees the worker's commit.
+        db.session.rollback()
+        get_job_queue().wait(min(remaining, POLL_INTERVAL_SECONDS))
+
+
+def job_payload(job):
+    return {
+        "jobId": job.id,
+        "status": job.status,
+        "statusCode": job.status_code,
+        "createdAt": job.created_at.isoformat() if job.created_at else None,
+        "completedAt": job.completed_at.isoformat() if job.completed_at else None,
+        "result": json.loads(job.result) if job.result else None,
+    }
+
+
+def _deliver_webhook(job):
+    try:
+        response = httpx.post(
+            job.webhook_url, json=job_payload(job), timeout=current_app.config["JOB_WEBHOOK_TIMEOUT"]
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Webhook for job {job.id} failed:", e)
@@ -0,0 +1,39 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask's default JSON provider, with orjson doing the encoding and
+    decoding when it is installed. The result decodes to the same data as
+    the default provider's (sorted keys, HTTP dates for datetimes), but the
+    bytes differ: non-ASCII characters are written as raw UTF-8 rather than
+    \\uXXXX escapes (the default provider sets ensure_ascii). Anything
+    orjson cannot encode falls back to json.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # jsonify passes only separators (or indent when debugging).
+        if orjson is not None and set(kwargs) <= {"separators", "indent"}:
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if kwargs.get("indent"):
+                option |= orjson.OPT_INDENT_2
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode()
+            except orjson.JSONEncodeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass
+        return super().loads(s, **kwargs)
@@ -0,0 +1,327 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import openai
+
+from .metrics import OPENAI_CIRCUIT_OPEN, OPENAI_REJECTED, record_openai_call
+
+DEFAULT_SETTINGS = {
+    "OPENAI_CLASSIFY_TIMEOUT": 10.0,
+    "OPENAI_STEP_TIMEOUT": 30.0,
+    "OPENAI_SEQUENCE_TIMEOUT": 60.0,
+    "OPENAI_SUMMARY_TIMEOUT": 30.0,
+    "OPENAI_CONNECT_TIMEOUT": 5.0,
+    "OPENAI_MAX_RETRIES": 2,
+    "OPENAI_RETRY_BASE_DELAY": 0.5,
+    "OPENAI_RETRY_MAX_DELAY": 8.0,
+    "OPENAI_MAX_CONCURRENCY": 32,
+    "OPENAI_QUEUE_TIMEOUT": 10.0,
+    "OPENAI_MAX_CONNECTIONS": 100,
+    "OPENAI_BREAKER_FAILURES": 5,
+    "OPENAI_BREAKER_RESET_SECONDS": 30.0,
+}
+
+# Which timeout setting applies to each call type.
+CALL_TIMEOUTS = {
+    "classify": "OPENAI_CLASSIFY_TIMEOUT",
+    "add_step": "OPENAI_STEP_TIMEOUT",
+    "edit_step": "OPENAI_STEP_TIMEOUT",
+    "new_sequence": "OPENAI_SEQUENCE_TIMEOUT",
+    "single_call": "OPENAI_SEQUENCE_TIMEOUT",
+    "summarize": "OPENAI_SUMMARY_TIMEOUT",
+}
+
+# Errors that say the upstream is unhealthy: retried, and counted by the
+# circuit breaker. Anything else (bad request, auth) fails immediately.
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+class LLMUnavailableError(Exception):
+    """
+    Raised without calling OpenAI when the circuit breaker is open or no
+    concurrency slot frees up within OPENAI_QUEUE_TIMEOUT. retry_after is
+    a hint in seconds for the client.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive upstream failures and then
+    rejects calls for reset_seconds. After that a single probe call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.probing = True
+            return True
+
+    def retry_after(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(1, int(self.reset_seconds - (time.monotonic() - self.opened_at)) + 1)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+        OPENAI_CIRCUIT_OPEN.set(0)
+
+    def cancel_probe(self):
+        """
+        Give up a probe that ended without telling us anything about the
+        upstream (queue timeout, cancellation).
+        """
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if not self.probing and self.failures < self.failure_threshold:
+                return
+            self.opened_at = time.monotonic()
+            self.probing = False
+        OPENAI_CIRCUIT_OPEN.set(1)
+
+
+_settings = dict(DEFAULT_SETTINGS)
+_breaker = CircuitBreaker(_settings["OPENAI_BREAKER_FAILURES"], _settings["OPENAI_BREAKER_RESET_SECONDS"])
+_semaphore = threading.BoundedSemaphore(_settings["OPENAI_MAX_CONCURRENCY"])
+_async_semaphores = weakref.WeakKeyDictionary()
+_async_clients = weakref.WeakKeyDictionary()
+_client = None
+_client_lock = threading.Lock()
+
+
+def configure_llm(config):
+    """
+    Apply the OPENAI_* settings from the app config. Called by create_app;
+    resets the circuit breaker and concurrency limits.
+    """
+    global _breaker, _semaphore
+    _settings.update({key: config.get(key, default) for key, default in DEFAULT_SETTINGS.items()})
+    _breaker = CircuitBreaker(_settings["OPENAI_BREAKER_FAILURES"], _settings["OPENAI_BREAKER_RESET_SECONDS"])
+    _semaphore = threading.BoundedSemaphore(_settings["OPENAI_MAX_CONCURRENCY"])
+    _async_semaphores.clear()
+    OPENAI_CIRCUIT_OPEN.set(0)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=_settings["OPENAI_MAX_CONNECTIONS"],
+        max_keepalive_connections=_settings["OPENAI_MAX_CONNECTIONS"]
+    )
+
+
+def get_client():
+    """
+    Return the process-wide OpenAI client. It keeps a persistent connection
+    pool; retries are done by chat_completion, not the SDK.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=httpx.Client(limits=_limits())
+            )
+        return _client
+
+
+def get_async_client():
+    """
+    Return the AsyncOpenAI client for the running event loop. Its connection
+    pool belongs to that loop, so there is one client per loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=_limits())
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _timeout(call_type):
+    return httpx.Timeout(
+        _settings[CALL_TIMEOUTS.get(call_type, "OPENAI_SEQUENCE_TIMEOUT")],
+        connect=_settings["OPENAI_CONNECT_TIMEOUT"]
+    )
+
+
+def _retry_delay(attempt, error):
+    """
+    Full-jitter exponential backoff, or the server's Retry-After if it asks
+    for longer, capped at OPENAI_RETRY_MAX_DELAY.
+    """
+    delay = random.uniform(0, min(
+        _settings["OPENAI_RETRY_MAX_DELAY"],
+        _settings["OPENAI_RETRY_BASE_DELAY"] * 2 ** (attempt - 1)
+    ))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return min(delay, _settings["OPENAI_RETRY_MAX_DELAY"])
+
+
+def _check_breaker():
+    if not _breaker.allow():
+        OPENAI_REJECTED.labels("circuit_open").inc()
+        raise LLMUnavailableError("OpenAI circuit breaker is open.", _breaker.retry_after())
+
+
+def _create(kwargs, timeout):
+    return get_client().chat.completions.create(timeout=timeout, **kwargs)
+
+
+async def _create_async(kwargs, timeout):
+    return await get_async_client().chat.completions.create(timeout=timeout, **kwargs)
+
+
+def chat_completion(call_type, **kwargs):
+    """
+    Call chat.completions.create with kwargs on behalf of call_type
+    (classify, add_step, edit_step, new_sequence, single_call, summarize).
+
+    The call gets that call type's timeout and waits for one of
+    OPENAI_MAX_CONCURRENCY slots. Rate limits, 5xx responses and connection
+    errors are retried up to OPENAI_MAX_RETRIES times with jittered backoff
+    and count towards the circuit breaker. Raises LLMUnavailableError
+    without calling OpenAI when the breaker is open or no slot is free in
+    time; other failures are re-raised.
+    """
+    model = kwargs.get("model")
+    _check_breaker()
+    if not _semaphore.acquire(timeout=_settings["OPENAI_QUEUE_TIMEOUT"]):
+        _breaker.cancel_probe()
+        OPENAI_REJECTED.labels("busy").inc()
+        raise LLMUnavailableError("Too many OpenAI calls in flight.", 1)
+
+    release = _semaphore.release
+    started = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            try:
+                response = _create(kwargs, _timeout(call_type))
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt >= _settings["OPENAI_MAX_RETRIES"]:
+                    _breaker.record_failure()
+                    record_openai_call(call_type, model, time.perf_counter() - started, retries=attempt, error=e)
+                    raise
+                attempt += 1
+                time.sleep(_retry_delay(attempt, e))
+            except Exception as e:
+                # OpenAI answered, so the upstream itself is healthy.
+                _breaker.record_success()
+                record_openai_call(call_type, model, time.perf_counter() - started, retries=attempt, error=e)
+                raise
+
+        _breaker.record_success()
+        if kwargs.get("stream"):
+            stream, release = _observed_stream(call_type, model, started, response, attempt, release), None
+            return stream
+        record_openai_call(call_type, model, time.perf_counter() - started, response, attempt)
+        return response
+    except BaseException:
+        _breaker.cancel_probe()
+        raise
+    finally:
+        if release:
+            release()
+
+
+async def chat_completion_async(call_type, **kwargs):
+    """
+    chat_completion for the async serving path, using the running loop's
+    AsyncOpenAI client. Streaming is not supported here.
+    """
+    model = kwargs.get("model")
+    _check_breaker()
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _async_semaphores[loop] = asyncio.Semaphore(_settings["OPENAI_MAX_CONCURRENCY"])
+    try:
+        await asyncio.wait_for(semaphore.acquire(), _settings["OPENAI_QUEUE_TIMEOUT"])
+    except asyncio.TimeoutError:
+        _breaker.cancel_probe()
+        OPENAI_REJECTED.labels("busy").inc()
+        raise LLMUnavailableError("Too many OpenAI calls in flight.", 1)
+
+    started = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            try:
+                response = await _create_async(kwargs, _timeout(call_type))
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt >= _settings["OPENAI_MAX_RETRIES"]:
+                    _breaker.record_failure()
+                    record_openai_call(call_type, model, time.perf_counter() - started, retries=attempt, error=e)
+                    raise
+                attempt += 1
+                await asyncio.sleep(_retry_delay(attempt, e))
+            except Exception as e:
+                # OpenAI answered, so the upstream itself is healthy.
+                _breaker.record_success()
+                record_openai_call(call_type, model, time.perf_counter() - started, retries=attempt, error=e)
+                raise
+    except BaseException:
+        _breaker.cancel_probe()
+        raise
+    finally:
+        semaphore.release()
+
+    _breaker.record_success()
+    record_openai_call(call_type, model, time.perf_counter() - started, response, attempt)
+    return response
+
+
+def _observed_stream(call_type, model, started, stream, retries, release):
+    # A streamed call holds its concurrency slot and is recorded until the
+    # last chunk has arrived (or the consumer stops reading).
+    error = None
+    try:
+        yield from stream
+    except Exception as e:
+        error = e
+        if isinstance(e, RETRYABLE_ERRORS):
+            _breaker.record_failure()
+        raise
+    finally:
+        release()
+        record_openai_call(call_type, model, time.perf_counter() - started, retries=retries, error=error)
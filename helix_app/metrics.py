@@ -0,0 +1,286 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+from sqlalchemy import event
+
+from .json_provider import OrjsonProvider
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SLOW_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+SQL_KINDS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+REQUEST_SECONDS = Histogram(
+    "helix_request_duration_seconds", "HTTP request duration.",
+    ["route", "method", "status", "intent"], buckets=SLOW_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "helix_stage_duration_seconds", "Time spent in one stage of a request (classify, openai, db, json).",
+    ["stage"], buckets=FAST_BUCKETS + SLOW_BUCKETS[7:]
+)
+OPENAI_SECONDS = Histogram(
+    "helix_openai_request_duration_seconds", "OpenAI chat completion call duration.",
+    ["call_type", "model", "outcome"], buckets=SLOW_BUCKETS
+)
+OPENAI_TOKENS = Counter(
+    "helix_openai_tokens_total", "Tokens reported by OpenAI.", ["call_type", "model", "kind"]
+)
+OPENAI_ERRORS = Counter(
+    "helix_openai_errors_total", "Failed OpenAI calls.", ["call_type", "error"]
+)
+OPENAI_RETRIES = Counter(
+    "helix_openai_retries_total", "Retried OpenAI requests.", ["call_type"]
+)
+OPENAI_REJECTED = Counter(
+    "helix_openai_rejected_total", "OpenAI calls refused without being sent (circuit_open, busy).", ["reason"]
+)
+OPENAI_CIRCUIT_OPEN = Gauge(
+    "helix_openai_circuit_open", "1 while the OpenAI circuit breaker is open.", multiprocess_mode="max"
+)
+DB_QUERY_SECONDS = Histogram(
+    "helix_db_query_duration_seconds", "SQL statement duration.", ["statement"], buckets=FAST_BUCKETS
+)
+DEDUPLICATED_REQUESTS = Counter(
+    "helix_deduplicated_requests_total",
+    "Requests answered from another request's result (coalesced, idempotent_replay).", ["endpoint", "reason"]
+)
+SIMILAR_SEQUENCE_LOOKUPS = Counter(
+    "helix_similar_sequence_lookups_total",
+    "New-sequence prompts looked up in the similar-sequence cache, by result (serve, seed, miss, skip).", ["result"]
+)
+INTENT_CLASSIFICATIONS = Counter(
+    "helix_intent_classifications_total", "Intent classifications by path (local, llm, llm_error).", ["path"]
+)
+
+_current_trace = contextvars.ContextVar("helix_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Timing breakdown of one request: a span per OpenAI call, classification
+    and JSON encoding, plus the count and total time of its SQL statements.
+    """
+
+    def __init__(self, route, method, log=True):
+        self.route = route
+        self.method = method
+        self.log = log
+        self.intent = None
+        self.attrs = {}
+        self.spans = []
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_span(self, stage, seconds, **attrs):
+        with self.lock:
+            self.spans.append({"stage": stage, "ms": round(seconds * 1000, 2), **attrs})
+
+    def add_query(self, seconds):
+        with self.lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+
+def current_trace():
+    trace = _current_trace.get()
+    if trace is None and has_app_context():
+        trace = g.get("helix_trace")
+    return trace
+
+
+def in_current_trace(fn):
+    """
+    Wrap fn so that, run on another thread, it records spans and queries
+    on the current request's trace.
+    """
+    trace = current_trace()
+
+    def run(*args, **kwargs):
+        token = _current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+    return run
+
+
+def start_trace(route, method, log=True):
+    """
+    Start a trace for a request handled outside Flask's request hooks (the
+    native ASGI handlers). It is visible to everything running in the
+    current context, including work handed to threads with copy_context().
+    """
+    trace = RequestTrace(route, method, log)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace, status):
+    seconds = time.perf_counter() - trace.started
+    intent = trace.intent or "none"
+    REQUEST_SECONDS.labels(trace.route, trace.method, str(status), intent).observe(seconds)
+    if trace.log:
+        print(json.dumps({
+            "event": "request",
+            "route": trace.route,
+            "method": trace.method,
+            "status": status,
+            "intent": intent,
+            "duration_ms": round(seconds * 1000, 2),
+            "db_queries": trace.db_queries,
+            "db_ms": round(trace.db_seconds * 1000, 2),
+            "spans": trace.spans,
+            **trace.attrs,
+        }), flush=True)
+
+
+def set_request_intent(intent):
+    trace = current_trace()
+    if trace:
+        trace.intent = intent
+
+
+def annotate_request(**attrs):
+    """
+    Add fields to the current request's log line.
+    """
+    trace = current_trace()
+    if trace:
+        trace.attrs.update(attrs)
+
+
+@contextmanager
+def span(stage, **attrs):
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(seconds)
+        trace = current_trace()
+        if trace:
+            trace.add_span(stage, seconds, **attrs)
+
+
+def record_openai_call(call_type, model, seconds, response=None, retries=0, error=None):
+    """
+    Record one chat completion call: latency, token usage, retries and
+    errors in Prometheus, and an "openai" span on the current request.
+    """
+    model = model or "unknown"
+    outcome = "error" if error else "ok"
+    OPENAI_SECONDS.labels(call_type, model, outcome).observe(seconds)
+    STAGE_SECONDS.labels("openai").observe(seconds)
+    if retries:
+        OPENAI_RETRIES.labels(call_type).inc(retries)
+
+    attrs = {"call_type": call_type, "model": model, "retries": retries}
+    if error:
+        OPENAI_ERRORS.labels(call_type, type(error).__name__).inc()
+        attrs["error"] = type(error).__name__
+    usage = getattr(response, "usage", None)
+    if usage:
+        OPENAI_TOKENS.labels(call_type, model, "prompt").inc(usage.prompt_tokens)
+        OPENAI_TOKENS.labels(call_type, model, "completion").inc(usage.completion_tokens)
+        attrs["prompt_tokens"] = usage.prompt_tokens
+        attrs["completion_tokens"] = usage.completion_tokens
+
+    trace = current_trace()
+    if trace:
+        trace.add_span("openai", seconds, **attrs)
+
+
+class TimedJSONProvider(OrjsonProvider):
+    """
+    The app's JSON provider (see json_provider) with every dumps() timed as
+    a "json" span.
+    """
+
+    def dumps(self, obj, **kwargs):
+        with span("json"):
+            return super().dumps(obj, **kwargs)
+
+
+def install_query_metrics(engine):
+    """
+    Time every SQL statement with engine events and attribute it to the
+    current request's trace.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("helix_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _record_query(conn, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and exception_context.statement:
+            _record_query(conn, exception_context.statement)
+
+
+def _record_query(conn, statement):
+    started = conn.info.get("helix_query_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERY_SECONDS.labels(kind if kind in SQL_KINDS else "OTHER").observe(seconds)
+    STAGE_SECONDS.labels("db").observe(seconds)
+    trace = current_trace()
+    if trace:
+        trace.add_query(seconds)
+
+
+def render_metrics():
+    """
+    Return (body, content_type) for the /metrics endpoint. With
+    PROMETHEUS_MULTIPROC_DIR set, samples from all worker processes are
+    merged.
+    """
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app, engine):
+    """
+    Trace every Flask request, time SQL on engine and JSON encoding.
+    """
+    app.json = TimedJSONProvider(app)
+    install_query_metrics(engine)
+
+    @app.before_request
+    def start_request_trace():
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        g.helix_trace = RequestTrace(route, request.method, app.config["REQUEST_LOG_ENABLED"])
+
+    @app.after_request
+    def finish_request_trace(response):
+        trace = g.get("helix_trace")
+        if trace:
+            # Streamed responses are still running here, so the trace is
+            # closed when the server closes the response.
+            response.call_on_close(lambda: finish_trace(trace, response.status_code))
+        return response
@@ -0,0 +1,182 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, bindparam, func, inspect, select, text
+
+from .app import db
+from .models import ChatMessage, Sequence, SequenceStep
+from .ranks import initial_ranks
+from .tokens import count_tokens
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+# sequence_step as it was before migration 4 replaced step_number with
+# position, for the migrations that still expect the old columns.
+_numbered_steps = Table(
+    "sequence_step",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("sequence_id", Integer),
+    Column("step_number", Integer),
+    Index("uq_sequence_step_sequence_id_step_number", "sequence_id", "step_number", unique=True),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Register an upgrade step. Migrations run in version order, each in its
+    own transaction, and receive the connection to run against.
+
+    db.create_all() runs first and creates any missing tables with their
+    current columns and indexes, so migrations only have to change tables
+    that already existed and must tolerate objects that are already there.
+    """
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def upgrade_database():
+    """
+    Create missing tables and apply pending migrations. A brand-new database
+    is created at the current schema, so its migrations are only recorded.
+    """
+    engine = db.engine
+    fresh = not inspect(engine).get_table_names()
+    db.create_all()
+
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+    for version, description, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            if not fresh:
+                upgrade(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        if not fresh:
+            print(f"Applied migration {version}: {description}")
+
+
+def current_version():
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table(schema_migrations.name):
+            return 0
+        return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def _create_index(conn, table, name):
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(conn, checkfirst=True)
+
+
+@migration(1, "Index chat history, sequences and steps for their hot queries")
+def _index_hot_queries(conn):
+    steps = _numbered_steps
+
+    # The unique index on (sequence_id, step_number) cannot be created while
+    # duplicates exist, so renumber those sequences in their current order.
+    duplicated = conn.execute(
+        select(steps.c.sequence_id)
+        .group_by(steps.c.sequence_id, steps.c.step_number)
+        .having(func.count() > 1)
+        .distinct()
+    ).scalars().all()
+    for sequence_id in duplicated:
+        rows = conn.execute(
+            select(steps.c.id)
+            .where(steps.c.sequence_id == sequence_id)
+            .order_by(steps.c.step_number, steps.c.id)
+        ).scalars().all()
+        # A plain UPDATE so renumbering leaves updated_at alone.
+        conn.execute(
+            text("UPDATE sequence_step SET step_number = :number WHERE id = :step_id"),
+            [{"number": number, "step_id": step_id} for number, step_id in enumerate(rows, start=1)]
+        )
+
+    _create_index(conn, ChatMessage.__table__, "ix_chat_message_user_id_created_at")
+    _create_index(conn, Sequence.__table__, "ix_sequence_user_id_created_at")
+    _create_index(conn, steps, "uq_sequence_step_sequence_id_step_number")
+
+
+@migration(2, "Cache token counts on chat messages")
+def _add_message_token_counts(conn):
+    messages = ChatMessage.__table__
+    columns = {column["name"] for column in inspect(conn).get_columns(messages.name)}
+    if "token_count" not in columns:
+        conn.execute(text("ALTER TABLE chat_message ADD COLUMN token_count INTEGER"))
+
+    while True:
+        rows = conn.execute(
+            select(messages.c.id, messages.c.message)
+            .where(messages.c.token_count.is_(None))
+            .limit(1000)
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            messages.update().where(messages.c.id == bindparam("message_id")),
+            [{"message_id": row.id, "token_count": count_tokens(row.message)} for row in rows]
+        )
+
+
+@migration(3, "Version sequences for request coalescing and conflict checks")
+def _add_sequence_version(conn):
+    columns = {column["name"] for column in inspect(conn).get_columns(Sequence.__table__.name)}
+    if "version" not in columns:
+        conn.execute(text("ALTER TABLE sequence ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+@migration(4, "Order steps by a rank key instead of a stored step number")
+def _add_step_positions(conn):
+    steps = SequenceStep.__table__
+    columns = {column["name"] for column in inspect(conn).get_columns(steps.name)}
+    if "position" not in columns:
+        collation = ' COLLATE "C"' if conn.dialect.name == "postgresql" else ""
+        conn.execute(text(f"ALTER TABLE sequence_step ADD COLUMN position VARCHAR{collation}"))
+    if "step_number" not in columns:
+        return
+
+    rows = conn.execute(
+        select(_numbered_steps.c.id, _numbered_steps.c.sequence_id)
+        .order_by(_numbered_steps.c.sequence_id, _numbered_steps.c.step_number, _numbered_steps.c.id)
+    ).all()
+    by_sequence = {}
+    for row in rows:
+        by_sequence.setdefault(row.sequence_id, []).append(row.id)
+    updates = [
+        {"step_id": step_id, "position": rank}
+        for step_ids in by_sequence.values()
+        for step_id, rank in zip(step_ids, initial_ranks(len(step_ids)))
+    ]
+    for start in range(0, len(updates), 1000):
+        # Setting updated_at to itself keeps its onupdate default from
+        # stamping every step with the migration time.
+        conn.execute(
+            steps.update().where(steps.c.id == bindparam("step_id")).values(updated_at=steps.c.updated_at),
+            updates[start:start + 1000]
+        )
+
+    conn.execute(text("DROP INDEX IF EXISTS uq_sequence_step_sequence_id_step_number"))
+    conn.execute(text("ALTER TABLE sequence_step DROP COLUMN step_number"))
+    _create_index(conn, steps, "ix_sequence_step_sequence_id_position")
+
+
+@migration(5, "Archive replaced sequences instead of deleting them")
+def _add_sequence_archived_at(conn):
+    columns = {column["name"] for column in inspect(conn).get_columns(Sequence.__table__.name)}
+    if "archived_at" not in columns:
+        conn.execute(text("ALTER TABLE sequence ADD COLUMN archived_at TIMESTAMP"))
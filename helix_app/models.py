@@ -1,35 +1,134 @@
 from datetime import datetime
+from sqlalchemy.dialects import postgresql
 from .app import db
+from .tokens import count_tokens
+
+
+def _message_token_count(context):
+    return count_tokens(context.get_current_parameters().get("message"))
+
 
 class User(db.Model):
     id = db.Column(db.String, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    sequences = db.relationship("Sequence", backref="user")
+    messages = db.relationship("ChatMessage", backref="user")
+    generation_jobs = db.relationship("GenerationJob", backref="user")
+
 class Sequence(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=False)
     title = db.Column(db.String)
+    version = db.Column(db.Integer, nullable=False, default=1)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set when a new sequence replaces this one; archived sequences can be
+    # restored.
+    archived_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_sequence_user_id_created_at", "user_id", "created_at"),
+    )
 
     steps = db.relationship(
         "SequenceStep",
         backref="sequence",
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        order_by="(SequenceStep.position, SequenceStep.id)"
     )
 
 class SequenceStep(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     sequence_id = db.Column(db.Integer, db.ForeignKey("sequence.id"), nullable=False)
-    step_number = db.Column(db.Integer)
+    # Sort key from helix_app.ranks; the step number shown to users is the
+    # step's place in this order, worked out when the steps are read.
+    position = db.Column(db.String().with_variant(postgresql.VARCHAR(collation="C"), "postgresql"), nullable=False)
     title = db.Column(db.String)
     content = db.Column(db.String)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_sequence_step_sequence_id_position", "sequence_id", "position"),
+    )
+
+class StepRevision(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    step_id = db.Column(db.Integer, db.ForeignKey("sequence_step.id"), nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    # The sequence's version once this revision was written.
+    sequence_version = db.Column(db.Integer)
+    # Snapshots hold the full title and content; other revisions hold
+    # helix_app.revisions deltas from the previous revision.
+    snapshot = db.Column(db.Boolean, nullable=False, default=False)
+    title = db.Column(db.String)
+    content = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("uq_step_revision_step_id_revision", "step_id", "revision", unique=True),
+    )
+
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=False)
     message = db.Column(db.String)
     sender = db.Column(db.String)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    token_count = db.Column(db.Integer, default=_message_token_count)
+
+    __table_args__ = (
+        db.Index("ix_chat_message_user_id_created_at", "user_id", "created_at", "id"),
+    )
+
+class ChatMessageArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=False)
+    # One row per user and UTC day; data holds that day's archived messages
+    # as a compressed helix_app.chat_archive blob.
+    day = db.Column(db.Date, nullable=False)
+    first_message_id = db.Column(db.Integer)
+    last_message_id = db.Column(db.Integer)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    codec = db.Column(db.String, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("uq_chat_message_archive_user_id_day", "user_id", "day", unique=True),
+    )
+
+class ConversationSummary(db.Model):
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), primary_key=True)
+    summary = db.Column(db.String)
+    token_count = db.Column(db.Integer)
+    summarized_through_at = db.Column(db.DateTime)
+    summarized_through_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class GenerationJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey("user.id"), nullable=False)
+    mode = db.Column(db.String)
+    status = db.Column(db.String, default="queued")
+    status_code = db.Column(db.Integer)
+    result = db.Column(db.String)
+    webhook_url = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_generation_job_user_id_created_at", "user_id", "created_at"),
+    )
+
+class IdempotentRequest(db.Model):
+    user_id = db.Column(db.String, primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    request_hash = db.Column(db.String)
+    status_code = db.Column(db.Integer)
+    headers = db.Column(db.String)
+    body = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+
+def _compile_template(text, index):
+    """
+    Turn text with {{Variable}} placeholders into a str.format() string
+    with a positional field per placeholder, numbered by index[name].
+    """
+    parts = []
+    position = 0
+    for match in PLACEHOLDER.finditer(text or ""):
+        parts.append(text[position:match.start()].replace("{", "{{").replace("}", "}}"))
+        parts.append("{%d}" % index[match.group(1)])
+        position = match.end()
+    parts.append((text or "")[position:].replace("{", "{{").replace("}", "}}"))
+    return "".join(parts)
+
+
+class CompiledSequence:
+    """
+    A sequence's steps compiled once for rendering: each title and content
+    becomes a format string over the sequence's variables, so rendering a
+    recipient is one lookup per variable and one str.format() per field.
+    Plain data, so it is sent to each worker process once.
+    """
+
+    def __init__(self, sequence_id, title, steps):
+        self.sequence_id = sequence_id
+        self.title = title
+        self.variables = sorted({
+            match.group(1)
+            for step in steps
+            for text in (step.title, step.content)
+            for match in PLACEHOLDER.finditer(text or "")
+        })
+        index = {name: i for i, name in enumerate(self.variables)}
+        # (step number, title format, content format)
+        self.steps = [
+            (number, _compile_template(step.title, index), _compile_template(step.content, index))
+            for number, step in enumerate(steps, start=1)
+        ]
+
+    def render(self, values):
+        """
+        Returns (steps, missing): the rendered steps as API step dicts and
+        the names of variables the recipient has no (or an empty) value
+        for. Those are left in the text as {{Name}}.
+        """
+        args = []
+        missing = []
+        for name in self.variables:
+            value = values.get(name)
+            if value is None or value == "":
+                missing.append(name)
+                value = "{{%s}}" % name
+            args.append(value)
+        steps = [
+            {
+                "stepNumber": step_number,
+                "stepTitle": title.format(*args),
+                "stepContent": content.format(*args)
+            }
+            for step_number, title, content in self.steps
+        ]
+        return steps, missing
+
+
+def compile_sequence(sequence):
+    """
+    Compile a Sequence (or SequenceSnapshot); both hold their steps in
+    order.
+    """
+    return CompiledSequence(sequence.id, sequence.title, sequence.steps)
+
+
+def read_recipients(stream, fmt):
+    """
+    Yield one recipient per row of a CSV (with a header row) or NDJSON text
+    stream, without reading the whole file. CSV rows come as dicts (fields
+    beyond the header under the None key); NDJSON lines are passed on
+    unparsed and decoded by the renderer, which may run in a worker process.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _parse_recipient(recipient):
+    """
+    Returns (recipient, error): the recipient as a dict, or None and why
+    the row cannot be rendered.
+    """
+    if isinstance(recipient, str):
+        try:
+            recipient = json.loads(recipient)
+        except json.JSONDecodeError as e:
+            return None, f"Invalid JSON: {e}"
+        if not isinstance(recipient, dict):
+            return None, "Expected a JSON object."
+    elif None in recipient:
+        return None, f"Row has {len(recipient[None])} more fields than the header."
+    return recipient, None
+
+
+def _render_chunk(compiled, first_row, recipients):
+    """
+    Render a chunk of recipients into NDJSON lines. Returns (text, count,
+    missing, errors): count recipients were rendered, missing counts them
+    per missing variable, and errors rows could not be rendered. Those get
+    a {"row", "error"} line instead.
+    """
+    out = io.StringIO()
+    missing_counts = Counter()
+    errors = 0
+    for row, recipient in enumerate(recipients, start=first_row):
+        recipient, error = _parse_recipient(recipient)
+        if error:
+            errors += 1
+            out.write(_dumps({"row": row, "error": error}))
+        else:
+            steps, missing = compiled.render(recipient)
+            missing_counts.update(missing)
+            out.write(_dumps({"row": row, "recipient": recipient, "steps": steps, "missing": missing}))
+        out.write("\n")
+    return out.getvalue(), len(recipients) - errors, missing_counts, errors
+
+
+_worker_sequence = None
+
+
+def _init_worker(compiled):
+    global _worker_sequence
+    _worker_sequence = compiled
+
+
+def _render_chunk_in_worker(first_row, recipients):
+    return _render_chunk(_worker_sequence, first_row, recipients)
+
+
+def _chunks(recipients, chunk_size):
+    chunk = []
+    first_row = 1
+    for recipient in recipients:
+        chunk.append(recipient)
+        if len(chunk) == chunk_size:
+            yield first_row, chunk
+            first_row += len(chunk)
+            chunk = []
+    if chunk:
+        yield first_row, chunk
+
+
+def render_recipients(compiled, recipients, workers=1, chunk_size=1000):
+    """
+    Render compiled for every recipient, yielding (ndjson_text, count,
+    missing, errors) per chunk of chunk_size recipients, in input order.
+    Each output line is {"row", "recipient", "steps", "missing"}, or
+    {"row", "error"} for a malformed row; rows count from 1.
+
+    With workers > 1 the chunks are rendered in a process pool; at most two
+    chunks per worker are read ahead, so recipients are streamed rather than
+    loaded up front.
+    """
+    chunks = _chunks(recipients, chunk_size)
+    if workers <= 1:
+        for first_row, chunk in chunks:
+            yield _render_chunk(compiled, first_row, chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(compiled,)) as executor:
+        pending = deque()
+        for first_row, chunk in chunks:
+            pending.append(executor.submit(_render_chunk_in_worker, first_row, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def render_to_stream(compiled, recipients, out, workers=1, chunk_size=1000):
+    """
+    Write rendered NDJSON for recipients to out. Returns (rendered,
+    missing, errors): how many recipients were rendered, a Counter of how
+    many of them were missing each variable, and how many rows were
+    malformed.
+    """
+    rendered = errors = 0
+    missing_counts = Counter()
+    for text, count, missing, chunk_errors in render_recipients(compiled, recipients, workers, chunk_size):
+        out.write(text)
+        rendered += count
+        missing_counts.update(missing)
+        errors += chunk_errors
+    return rendered, missing_counts, errors
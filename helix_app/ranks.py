@@ -0,0 +1,134 @@
+from bisect import bisect_left
+
+# Rank keys are strings over these digits, compared byte by byte (the
+# column uses the "C" collation on PostgreSQL). A key is read as a base-62
+# fraction, 0.<digits>, and never ends in "0", so there is always room for
+# another key on either side of it.
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+# Keys grow by about one digit per six inserts into the same gap. Past this
+# length the whole sequence is re-spread instead.
+MAX_RANK_LENGTH = 12
+
+
+def _midpoint(before, after):
+    """
+    A key between before and after (after None meaning the end).
+    """
+    if after is not None:
+        n = 0
+        while n < len(after) and (before[n] if n < len(before) else "0") == after[n]:
+            n += 1
+        if n:
+            return after[:n] + _midpoint(before[n:], after[n:])
+
+    low = DIGITS.index(before[0]) if before else 0
+    high = DIGITS.index(after[0]) if after is not None else BASE
+    if high - low > 1:
+        return DIGITS[(low + high) // 2]
+    if after is not None and len(after) > 1:
+        return after[0]
+    return DIGITS[low] + _midpoint(before[1:], None)
+
+
+def rank_between(before, after):
+    """
+    A key that sorts between before and after; either may be None for the
+    start or the end. Returns None when there is no usable key (before is
+    not below after, or the keys have grown past MAX_RANK_LENGTH) and the
+    sequence should be rebalanced.
+    """
+    if before is not None and after is not None and before >= after:
+        return None
+    rank = _midpoint(before or "", after)
+    return rank if len(rank) <= MAX_RANK_LENGTH else None
+
+
+def ranks_between(before, after, count):
+    """
+    count increasing keys between before and after, spread by bisection so
+    they stay short. None when rank_between() gives up.
+    """
+    if count == 0:
+        return []
+    middle = rank_between(before, after)
+    if middle is None:
+        return None
+    half = (count - 1) // 2
+    lower = ranks_between(before, middle, half)
+    upper = ranks_between(middle, after, count - 1 - half)
+    if lower is None or upper is None:
+        return None
+    return lower + [middle] + upper
+
+
+def initial_ranks(count):
+    """
+    count evenly spaced keys, as short as possible with room between them.
+    """
+    length = 1
+    while BASE ** length < (count + 1) * 8:
+        length += 1
+    spacing = BASE ** length // (count + 1)
+    ranks = []
+    for i in range(1, count + 1):
+        value = i * spacing
+        digits = []
+        for _ in range(length):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        ranks.append("".join(reversed(digits)).rstrip("0"))
+    return ranks
+
+
+def unmoved(ranks):
+    """
+    The indexes of a longest strictly increasing run of ranks (in list
+    order): the items that can keep their key when a list is reordered.
+    """
+    tails, tail_ranks = [], []
+    previous = [None] * len(ranks)
+    for i, rank in enumerate(ranks):
+        if rank is None:
+            continue
+        length = bisect_left(tail_ranks, rank)
+        previous[i] = tails[length - 1] if length else None
+        if length == len(tails):
+            tails.append(i)
+            tail_ranks.append(rank)
+        else:
+            tails[length] = i
+            tail_ranks[length] = rank
+    keep = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        keep.add(i)
+        i = previous[i]
+    return keep
+
+
+def reposition(ranks, keep):
+    """
+    New keys for a list in its new order. ranks holds each item's current
+    key (None for new items); the items at the indexes in keep keep theirs
+    and the others get keys between their neighbours. When that is not
+    possible every item gets a fresh key from initial_ranks().
+    """
+    result = list(ranks)
+    i = 0
+    while i < len(result):
+        if i in keep:
+            i += 1
+            continue
+        j = i
+        while j < len(result) and j not in keep:
+            j += 1
+        new_ranks = ranks_between(
+            result[i - 1] if i else None, result[j] if j < len(result) else None, j - i
+        )
+        if new_ranks is None:
+            return initial_ranks(len(result))
+        result[i:j] = new_ranks
+        i = j
+    return result
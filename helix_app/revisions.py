@@ -0,0 +1,169 @@
+import json
+import re
+from difflib import SequenceMatcher
+
+from flask import current_app
+from sqlalchemy import case, func, insert, select
+
+from .app import db
+from .models import SequenceStep, StepRevision
+
+_TOKEN = re.compile(r"\s+|\S+")
+
+
+def text_delta(old, new):
+    """
+    A compact edit script turning old into new, computed over words: a list
+    where a positive int n copies the next n characters of old, a negative
+    int skips -n characters of old, and a string is inserted.
+    """
+    old_tokens = _TOKEN.findall(old)
+    new_tokens = _TOKEN.findall(new)
+    ops = []
+
+    def push(op):
+        # Merge runs of the same kind of op.
+        if ops and type(ops[-1]) is type(op) and (isinstance(op, str) or (ops[-1] > 0) == (op > 0)):
+            ops[-1] += op
+        else:
+            ops.append(op)
+
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            push(sum(len(token) for token in old_tokens[i1:i2]))
+            continue
+        if i2 > i1:
+            push(-sum(len(token) for token in old_tokens[i1:i2]))
+        if j2 > j1:
+            push("".join(new_tokens[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    parts = []
+    position = 0
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.append(old[position:position + op])
+            position += op
+        else:
+            position -= op
+    return "".join(parts)
+
+
+def _encode_delta(old, new):
+    return json.dumps(text_delta(old, new), ensure_ascii=False, separators=(",", ":"))
+
+
+def record_step_revisions(sequence_version, changes):
+    """
+    Add a revision for each step in changes ({step_id: (title, content)})
+    before the new text is written over the old. Must run in the write's
+    transaction: the steps are read FOR UPDATE so concurrent edits of a
+    step are applied (and numbered) one at a time.
+
+    A step's first revision is its text from before its first recorded
+    edit. After that each revision is a delta from the one before, except
+    every STEP_REVISION_SNAPSHOT_INTERVAL revisions (or when a delta would
+    not be smaller) a full snapshot is stored, so rebuilding any revision
+    applies a bounded number of deltas. Steps whose text is unchanged get
+    no revision.
+    """
+    if not changes:
+        return
+    interval = current_app.config["STEP_REVISION_SNAPSHOT_INTERVAL"]
+    latest = (
+        select(
+            StepRevision.step_id,
+            func.max(StepRevision.revision).label("revision"),
+            func.max(case((StepRevision.snapshot, StepRevision.revision))).label("snapshot_revision"),
+        )
+        .where(StepRevision.step_id.in_(changes))
+        .group_by(StepRevision.step_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(SequenceStep.id, SequenceStep.title, SequenceStep.content, latest.c.revision, latest.c.snapshot_revision)
+        .outerjoin(latest, latest.c.step_id == SequenceStep.id)
+        .where(SequenceStep.id.in_(changes))
+        .with_for_update(of=SequenceStep)
+    ).all()
+
+    revisions = []
+    for row in rows:
+        old_title, old_content = row.title or "", row.content or ""
+        title, content = (text or "" for text in changes[row.id])
+        if (title, content) == (old_title, old_content):
+            continue
+        revision, snapshot_revision = row.revision, row.snapshot_revision
+        if revision is None:
+            revisions.append({
+                "step_id": row.id, "revision": 1, "sequence_version": sequence_version - 1,
+                "snapshot": True, "title": old_title, "content": old_content,
+            })
+            revision = snapshot_revision = 1
+
+        revision += 1
+        snapshot = revision - snapshot_revision >= interval
+        if not snapshot:
+            title_delta = _encode_delta(old_title, title)
+            content_delta = _encode_delta(old_content, content)
+            snapshot = len(title_delta) + len(content_delta) >= len(title) + len(content)
+        revisions.append({
+            "step_id": row.id, "revision": revision, "sequence_version": sequence_version,
+            "snapshot": snapshot,
+            "title": title if snapshot else title_delta,
+            "content": content if snapshot else content_delta,
+        })
+    if revisions:
+        db.session.execute(insert(StepRevision), revisions)
+
+
+def list_step_revisions(step_id, limit, before=None):
+    """
+    Revision metadata (no text) for a step, newest first: at most limit
+    rows with a revision number below before.
+    """
+    query = (
+        select(StepRevision.revision, StepRevision.sequence_version, StepRevision.snapshot, StepRevision.created_at)
+        .where(StepRevision.step_id == step_id)
+        .order_by(StepRevision.revision.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(StepRevision.revision < before)
+    return db.session.execute(query).all()
+
+
+def load_step_revision(step_id, revision):
+    """
+    Rebuild a step's (title, content) at revision from the latest snapshot
+    at or before it and the deltas after that. Returns None if the step
+    has no such revision.
+    """
+    snapshot_revision = (
+        select(func.max(StepRevision.revision))
+        .where(StepRevision.step_id == step_id, StepRevision.snapshot, StepRevision.revision <= revision)
+        .scalar_subquery()
+    )
+    rows = db.session.execute(
+        select(StepRevision.revision, StepRevision.snapshot, StepRevision.title, StepRevision.content)
+        .where(
+            StepRevision.step_id == step_id,
+            StepRevision.revision >= snapshot_revision,
+            StepRevision.revision <= revision,
+        )
+        .order_by(StepRevision.revision)
+    ).all()
+    if not rows or rows[-1].revision != revision:
+        return None
+    title, content = rows[0].title, rows[0].content
+    for row in rows[1:]:
+        if row.snapshot:
+            title, content = row.title, row.content
+        else:
+            title, content = apply_delta(title, json.loads(row.title)), apply_delta(content, json.loads(row.content))
+    return title, content
@@ -1,30 +1,125 @@
 
+import hashlib
 import json
-import re
-from datetime import datetime
-from flask import Blueprint, request, jsonify
-import openai
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context, url_for
+from sqlalchemy import and_, case, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 from .app import db
-from .models import User, Sequence, SequenceStep, ChatMessage
+from .models import User, Sequence, SequenceStep, ChatMessage, ChatMessageArchive, GenerationJob
+from .cache import (
+    SequenceSnapshot,
+    StepSnapshot,
+    commit_with_cache,
+    get_active_sequence_cache,
+    load_active_sequence,
+    number_steps,
+    stage_active_sequence
+)
+from .ranks import initial_ranks, reposition, unmoved
+from .revisions import list_step_revisions, load_step_revision, record_step_revisions
+from .chat_archive import archived_messages_since, has_archived_messages, load_archived_page
 
 from .utils import (
     load_db_conversation,
-    extract_step_number,
+    extract_insert_position,
+    extract_step_numbers,
     classify_intent,
-    function_definitions
+    classify_intent_with_confidence,
+    function_definitions,
+    single_call_function_definitions,
+    SINGLE_CALL_FUNCTION_INTENTS,
+    build_single_call_messages,
+    build_seeded_sequence_messages,
+    build_add_step_messages,
+    parse_added_step,
+    build_edit_step_messages,
+    parse_edited_step
+)
+from .idempotency import (
+    HEADER as IDEMPOTENCY_HEADER,
+    MAX_KEY_LENGTH as MAX_IDEMPOTENCY_KEY_LENGTH,
+    find_stored_response,
+    request_hash,
+    stage_stored_response
+)
+from .intent import get_classification_stats
+from .similarity import find_similar_sequence, remember_sequence, similar_sequence_cache_enabled
+from .jobs import (
+    expire_stale_job,
+    finish_job,
+    job_payload,
+    new_job_id,
+    discard_staged_jobs,
+    stage_generation_job,
+    submit_staged_jobs,
+    wait_for_job,
+    webhook_allowed
 )
+from .llm import LLMUnavailableError, chat_completion
+from .metrics import DEDUPLICATED_REQUESTS, annotate_request, in_current_trace, render_metrics, set_request_intent
+from .singleflight import SingleFlight
+from .streaming import sse_event, SequenceArgumentStream
 
 main_bp = Blueprint("main_bp", __name__)
 
+LLM_UNAVAILABLE_REPLY = "The AI service is busy right now. Please try again shortly."
+
+# How /api/chat returns a changed sequence: every step, or only the changed ones.
+SEQUENCE_FORMATS = ("full", "diff")
+
+# How far before a sync token's timestamp /api/load?since= looks for
+# changed sequences.
+SYNC_OVERLAP_SECONDS = 5
+
+# Identical requests in flight at the same time share one model call.
+_chat_flights = SingleFlight()
+_classify_flights = SingleFlight()
+
 @main_bp.route("/api/classify", methods=["POST"])
 def classify():
     data = request.get_json()
     user_input = data.get("message", "").strip()
     if not user_input:
         return jsonify({"intent": "new_sequence"})
-    intent = classify_intent(user_input)
-    return jsonify({"intent": intent})
+    (intent, confidence, source), shared = _classify_flights.do(
+        _normalized_message(user_input), lambda: classify_intent_with_confidence(user_input)
+    )
+    if shared:
+        DEDUPLICATED_REQUESTS.labels("classify", "coalesced").inc()
+    set_request_intent(intent)
+    return jsonify({"intent": intent, "confidence": confidence, "source": source})
+
+
+@main_bp.route("/api/classify/stats", methods=["GET"])
+def classify_stats():
+    return jsonify(get_classification_stats())
+
+
+@main_bp.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@main_bp.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    # wait=<seconds> long-polls until the job has finished.
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds."}), 400
+    wait = max(0.0, min(wait, current_app.config["JOB_MAX_WAIT_SECONDS"]))
+
+    job = wait_for_job(job_id, wait)
+    if not job:
+        return jsonify({"error": "Job not found."}), 404
+    if expire_stale_job(job):
+        db.session.commit()
+    return jsonify(job_payload(job))
 
 
 @main_bp.route("/api/sequence/update", methods=["PUT"])
@@ -37,333 +132,1309 @@ def update_sequence():
 
     if not sequence_id or not step_number or not field:
         return jsonify({"error": "Missing required parameters."}), 400
+    try:
+        step_number = int(step_number)
+    except (TypeError, ValueError):
+        return jsonify({"error": "stepNumber must be an integer."}), 400
 
-    step = SequenceStep.query.filter_by(sequence_id=sequence_id, step_number=step_number).first()
+    step = _find_step(sequence_id, step_number)
     if not step:
         return jsonify({"error": "Step not found."}), 404
 
     if field == "stepTitle":
-        step.title = value
+        changes = {"title": value}
     elif field == "stepContent":
-        step.content = value
+        changes = {"content": value}
     else:
         return jsonify({"error": "Invalid field."}), 400
 
+    sequence_id, step_id = step.sequence_id, step.id
+    version = _bump_sequence_version(sequence_id)
+    record_step_revisions(version, {step_id: (changes.get("title", step.title), changes.get("content", step.content))})
+    for name, text in changes.items():
+        setattr(step, name, text)
     db.session.commit()
+    get_active_sequence_cache().patch_step(sequence_id, step_id, version, **changes)
     return jsonify({"message": "Step updated."}), 200
 
 
+def _find_step(sequence_id, step_number):
+    """
+    The SequenceStep at step_number, the step's place in its sequence's
+    position order, or None.
+    """
+    if not isinstance(step_number, int) or step_number < 1:
+        return None
+    return SequenceStep.query.filter_by(sequence_id=sequence_id).order_by(
+        SequenceStep.position, SequenceStep.id
+    ).offset(step_number - 1).first()
+
+
+def _page_args():
+    """
+    (limit, before) from the query string for the revision and archive
+    listings, or raise ValueError.
+    """
+    limit = max(1, min(int(request.args.get("limit", 50)), 500))
+    before = int(request.args["before"]) if "before" in request.args else None
+    return limit, before
+
+
+@main_bp.route("/api/sequence/<int:sequence_id>/steps/<int:step_number>/revisions", methods=["GET"])
+def get_step_revisions(sequence_id, step_number):
+    """
+    List a step's revisions, newest first, without their text. limit
+    (default 50) and before=<revision> page through them. A step that has
+    never been edited has one revision: its current text.
+    """
+    try:
+        limit, before = _page_args()
+    except ValueError:
+        return jsonify({"error": "limit and before must be integers."}), 400
+
+    step = _find_step(sequence_id, step_number)
+    if not step:
+        return jsonify({"error": "Step not found."}), 404
+    rows = list_step_revisions(step.id, limit + 1, before)
+    has_more = len(rows) > limit
+    revisions = [
+        {
+            "revision": row.revision,
+            "sequenceVersion": row.sequence_version,
+            "snapshot": row.snapshot,
+            "createdAt": row.created_at.isoformat(),
+        }
+        for row in rows[:limit]
+    ]
+    if not rows and before is None:
+        revisions = [{"revision": 1, "sequenceVersion": None, "snapshot": True, "createdAt": step.created_at.isoformat()}]
+    return jsonify({
+        "sequenceId": sequence_id,
+        "stepNumber": step_number,
+        "revisions": revisions,
+        "has_more": has_more,
+        "next_before": revisions[-1]["revision"] if has_more else None,
+    })
+
+
+def _step_revision_text(step, revision):
+    """
+    (title, content) of a step at revision, or None. Revision 1 of a step
+    that has never been edited is its current text.
+    """
+    found = load_step_revision(step.id, revision)
+    if found is None and revision == 1 and not list_step_revisions(step.id, 1):
+        return step.title, step.content
+    return found
+
+
+@main_bp.route("/api/sequence/<int:sequence_id>/steps/<int:step_number>/revisions/<int:revision>", methods=["GET"])
+def get_step_revision(sequence_id, step_number, revision):
+    step = _find_step(sequence_id, step_number)
+    if not step:
+        return jsonify({"error": "Step not found."}), 404
+    found = _step_revision_text(step, revision)
+    if found is None:
+        return jsonify({"error": "Revision not found."}), 404
+    title, content = found
+    return jsonify({
+        "sequenceId": sequence_id,
+        "stepNumber": step_number,
+        "revision": revision,
+        "stepTitle": title,
+        "stepContent": content,
+    })
+
+
+@main_bp.route(
+    "/api/sequence/<int:sequence_id>/steps/<int:step_number>/revisions/<int:revision>/restore", methods=["POST"]
+)
+def restore_step_revision(sequence_id, step_number, revision):
+    """
+    Put a step's text back to an earlier revision. The restore is itself a
+    new revision, so it can be undone the same way.
+    """
+    step = _find_step(sequence_id, step_number)
+    if not step:
+        return jsonify({"error": "Step not found."}), 404
+    found = _step_revision_text(step, revision)
+    if found is None:
+        return jsonify({"error": "Revision not found."}), 404
+    title, content = found
+
+    step_id = step.id
+    version = _bump_sequence_version(sequence_id)
+    record_step_revisions(version, {step_id: (title, content)})
+    step.title, step.content = title, content
+    db.session.commit()
+    get_active_sequence_cache().patch_step(sequence_id, step_id, version, title=title, content=content)
+    return jsonify({
+        "sequenceId": sequence_id,
+        "version": version,
+        "step": {"stepNumber": step_number, "stepTitle": title, "stepContent": content},
+    })
+
+
+@main_bp.route("/api/sequence/archived", methods=["GET"])
+def get_archived_sequences():
+    """
+    List a user's archived (replaced) sequences, newest first, without
+    their steps. limit (default 50) and before=<sequence_id> page through
+    them.
+    """
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"error": "Missing user_id."}), 400
+    try:
+        limit, before = _page_args()
+    except ValueError:
+        return jsonify({"error": "limit and before must be integers."}), 400
+
+    step_count = select(func.count()).where(SequenceStep.sequence_id == Sequence.id).scalar_subquery()
+    query = (
+        select(
+            Sequence.id, Sequence.title, Sequence.version, Sequence.created_at, Sequence.archived_at,
+            step_count.label("step_count")
+        )
+        .where(Sequence.user_id == user_id, Sequence.archived_at.is_not(None))
+        .order_by(Sequence.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        query = query.where(Sequence.id < before)
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    sequences = [
+        {
+            "sequence_id": row.id,
+            "title": row.title,
+            "version": row.version,
+            "step_count": row.step_count,
+            "created_at": row.created_at.isoformat(),
+            "archived_at": row.archived_at.isoformat(),
+        }
+        for row in rows[:limit]
+    ]
+    return jsonify({
+        "sequences": sequences,
+        "has_more": has_more,
+        "next_before": sequences[-1]["sequence_id"] if has_more else None,
+    })
+
+
+@main_bp.route("/api/sequence/<int:sequence_id>", methods=["GET"])
+def get_sequence(sequence_id):
+    sequence = db.session.get(Sequence, sequence_id, options=[selectinload(Sequence.steps)])
+    if not sequence:
+        return jsonify({"error": "Sequence not found."}), 404
+    payload = _serialize_sequence(sequence)
+    payload["archived_at"] = sequence.archived_at.isoformat() if sequence.archived_at else None
+    return jsonify(payload)
+
+
+@main_bp.route("/api/sequence/<int:sequence_id>/restore", methods=["POST"])
+def restore_sequence(sequence_id):
+    """
+    Make an archived sequence its user's active sequence again. The
+    sequence it replaces is archived in its place.
+    """
+    row = db.session.execute(
+        select(Sequence.user_id, Sequence.archived_at).where(Sequence.id == sequence_id)
+    ).first()
+    if not row:
+        return jsonify({"error": "Sequence not found."}), 404
+    if row.archived_at is None:
+        return jsonify({"error": "Sequence is not archived."}), 400
+
+    db.session.execute(
+        update(Sequence)
+        .where(Sequence.user_id == row.user_id, Sequence.archived_at.is_(None))
+        .values(archived_at=datetime.utcnow())
+    )
+    version = db.session.execute(
+        update(Sequence)
+        .where(Sequence.id == sequence_id)
+        .values(archived_at=None, version=Sequence.version + 1)
+        .returning(Sequence.version)
+    ).scalar_one()
+    _, _, steps = _sequence_state(sequence_id)
+    stage_active_sequence(row.user_id)
+    commit_with_cache()
+    return jsonify({"sequenceId": sequence_id, "version": version, "sequence": _serialize_steps(steps)})
+
+
+@main_bp.route("/api/sequence/steps", methods=["PATCH"])
+def patch_sequence_steps():
+    """
+    Apply a batch of step edits in one transaction. The body is
+    {sequenceId, version?, steps: [{stepNumber, stepTitle?, stepContent?}],
+    order?: [stepNumber, ...]}; order lists every current step number in
+    its new position. Reordering only rewrites the position of the steps
+    that moved relative to the others, so dragging one step to a new place
+    writes one row. With version, the batch is rejected with a 409 if the
+    sequence has changed since the client read that version.
+    """
+    data = request.get_json()
+    sequence_id = data.get("sequenceId")
+    patches = data.get("steps") or []
+    order = data.get("order")
+    expected_version = data.get("version")
+
+    if not sequence_id or not isinstance(patches, list) or (order is not None and not isinstance(order, list)):
+        return jsonify({"error": "Missing required parameters."}), 400
+    if expected_version is not None and not isinstance(expected_version, int):
+        return jsonify({"error": "version must be an integer."}), 400
+    if not patches and not order:
+        return jsonify({"error": "Nothing to update."}), 400
+
+    state = _sequence_state(sequence_id)
+    if not state:
+        return jsonify({"error": "Sequence not found."}), 404
+    user_id, version, current_steps = state
+    if expected_version is not None and expected_version != version:
+        return _version_conflict(version, current_steps)
+
+    steps_by_number = {s.step_number: s for s in current_steps}
+    titles, contents = {}, {}
+    for patch in patches:
+        number = patch.get("stepNumber") if isinstance(patch, dict) else None
+        if not isinstance(number, int) or number not in steps_by_number:
+            return jsonify({"error": f"Step {number} not found."}), 404
+        for field, values in (("stepTitle", titles), ("stepContent", contents)):
+            if field in patch:
+                if not isinstance(patch[field], str):
+                    return jsonify({"error": f"{field} must be a string."}), 400
+                values[steps_by_number[number].id] = patch[field]
+    if order is not None and (
+        not all(isinstance(number, int) for number in order)
+        or len(order) != len(steps_by_number)
+        or set(order) != set(steps_by_number)
+    ):
+        return jsonify({"error": "order must list every step number exactly once."}), 400
+
+    # Read before writing: a cache miss here must not pick up this
+    # transaction's uncommitted rows.
+    active_sequence = load_active_sequence(user_id)
+
+    new_version = _bump_sequence_version(sequence_id, expected_version)
+    if new_version is None:
+        db.session.rollback()
+        _, version, current_steps = _sequence_state(sequence_id)
+        return _version_conflict(version, current_steps)
+
+    record_step_revisions(new_version, {
+        s.id: (titles.get(s.id, s.title), contents.get(s.id, s.content))
+        for s in current_steps
+        if s.id in titles or s.id in contents
+    })
+    _bulk_update_steps(sequence_id, "title", titles)
+    _bulk_update_steps(sequence_id, "content", contents)
+    ordered = [steps_by_number[number] for number in order] if order else current_steps
+    positions = [s.position for s in ordered]
+    if order:
+        positions = reposition(positions, unmoved(positions))
+        _bulk_update_steps(sequence_id, "position", {
+            s.id: position for s, position in zip(ordered, positions) if position != s.position
+        })
+
+    steps = number_steps([
+        StepSnapshot(s.step_number, titles.get(s.id, s.title), contents.get(s.id, s.content), s.id)
+        for s in ordered
+    ], positions)
+    if active_sequence and active_sequence.id == sequence_id:
+        stage_active_sequence(user_id, active_sequence.with_steps(steps, new_version))
+    commit_with_cache()
+
+    return jsonify({"sequenceId": sequence_id, "version": new_version, "sequence": _serialize_steps(steps)})
+
+
+def _sequence_state(sequence_id):
+    """
+    Read a sequence's owner, version and ordered steps without loading ORM
+    objects. Returns (user_id, version, steps) or None.
+    """
+    row = db.session.execute(
+        select(Sequence.user_id, Sequence.version).where(Sequence.id == sequence_id)
+    ).first()
+    if not row:
+        return None
+    steps = number_steps(db.session.execute(
+        select(SequenceStep.id, SequenceStep.position, SequenceStep.title, SequenceStep.content)
+        .where(SequenceStep.sequence_id == sequence_id)
+        .order_by(SequenceStep.position, SequenceStep.id)
+    ))
+    return row.user_id, row.version, steps
+
+
+def _version_conflict(version, steps):
+    return jsonify({
+        "error": "The sequence was changed by another request.",
+        "version": version,
+        "sequence": _serialize_steps(steps)
+    }), 409
+
+
+def _bulk_update_steps(sequence_id, column, values_by_id):
+    """
+    Set column for several steps of a sequence with a single UPDATE ...
+    SET column = CASE id WHEN ... END.
+    """
+    if not values_by_id:
+        return
+    db.session.execute(
+        update(SequenceStep)
+        .where(SequenceStep.sequence_id == sequence_id, SequenceStep.id.in_(values_by_id))
+        .values({column: case(values_by_id, value=SequenceStep.id)})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _serialize_steps(steps):
+    return [
+        {
+            "stepNumber": s.step_number,
+            "stepTitle": s.title,
+            "stepContent": s.content
+        }
+        for s in steps
+    ]
+
+
+def _parse_function_args(fn_args_json):
+    try:
+        return json.loads(fn_args_json) if isinstance(fn_args_json, str) else fn_args_json
+    except json.JSONDecodeError:
+        return {}
+
+
+def _chat_request_error(data):
+    """
+    The 400 response for a chat request that cannot go ahead, or None.
+    Only the request itself is checked; nothing is read from the database.
+    """
+    if not data.get("user_id"):
+        return jsonify({"reply": "Missing user_id.", "sequence": []}), 400
+
+    if not data.get("message", "").strip():
+        return jsonify({"reply": "Empty message.", "sequence": []}), 400
+
+    webhook_url = data.get("webhookUrl")
+    if webhook_url and not webhook_allowed(webhook_url):
+        return jsonify({"reply": "webhookUrl is not an allowed webhook host.", "sequence": []}), 400
+
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({"reply": f"{IDEMPOTENCY_HEADER} is too long.", "sequence": []}), 400
+
+    if data.get("sequenceFormat", "full") not in SEQUENCE_FORMATS:
+        return jsonify({"reply": "sequenceFormat must be full or diff.", "sequence": []}), 400
+    return None
+
+
+def _load_chat_context(data):
+    """
+    Validate a chat request and read everything the handler needs: whether
+    the user exists, their active sequence and its steps. Nothing is written
+    here, so no write transaction is open while the model is generating.
+
+    The active sequence comes from the active-sequence cache as a
+    SequenceSnapshot, checked against the stored version, so a returning
+    user usually costs one small query here.
+
+    Returns (error_response, ctx); error_response is None when the request
+    can go ahead.
+    """
+    error = _chat_request_error(data)
+    if error:
+        return error, None
+
+    user_id = data.get("user_id")
+    active_sequence = load_active_sequence(user_id, verify=True)
+    return None, {
+        "user_id": user_id,
+        "user_input": data.get("message", "").strip(),
+        "received_at": datetime.utcnow(),
+        "is_new_user": active_sequence is None and User.query.get(user_id) is None,
+        "active_sequence": active_sequence,
+        "existing_steps": active_sequence.steps if active_sequence else [],
+        "as_job": _use_async_job(data),
+        "webhook_url": data.get("webhookUrl"),
+        "idempotency_key": request.headers.get(IDEMPOTENCY_HEADER),
+        "request_hash": request_hash(data),
+        "sequence_format": data.get("sequenceFormat", "full"),
+    }
+
+
+def _stage_incoming_messages(ctx):
+    """
+    Add the user (on first contact), the default greeting and the user's
+    message to the session without flushing. They are written by the
+    request's single commit together with the AI reply.
+    """
+    user_id = ctx["user_id"]
+    if ctx["is_new_user"]:
+        db.session.add(User(id=user_id, created_at=ctx["received_at"]))
+        db.session.add(ChatMessage(
+            user_id=user_id, message="How can I help you?", sender="ai", created_at=ctx["received_at"]
+        ))
+    db.session.add(ChatMessage(
+        user_id=user_id, message=ctx["user_input"], sender="user", created_at=ctx["received_at"]
+    ))
+
+
+def _conversation_for(ctx):
+    """
+    Load the stored conversation plus this request's not-yet-written
+    greeting and user message.
+    """
+    pending = []
+    if ctx["is_new_user"]:
+        pending.append({"role": "assistant", "content": "How can I help you?"})
+    pending.append({"role": "user", "content": ctx["user_input"]})
+    with db.session.no_autoflush:
+        return load_db_conversation(ctx["user_id"], pending)
+
+
+def _bump_sequence_version(sequence_id, expected_version=None):
+    """
+    Increment a sequence's version in the current transaction. Returns the
+    new version, or None if expected_version is given and the sequence is
+    no longer at it.
+    """
+    statement = update(Sequence).where(Sequence.id == sequence_id)
+    if expected_version is not None:
+        statement = statement.where(Sequence.version == expected_version)
+    result = db.session.execute(statement.values(version=Sequence.version + 1).returning(Sequence.version))
+    if expected_version is not None:
+        return result.scalar_one_or_none()
+    return result.scalar_one()
+
+
+def _stale_sequence_reply(user_id):
+    """
+    The answer when the active sequence changed after this request read it
+    (in another server process, or while the model was generating). The
+    user's cache entry is dropped with the commit, so a retry starts from
+    the stored sequence.
+    """
+    stage_active_sequence(user_id)
+    response = jsonify({"reply": "The sequence was changed by another request. Please try again.", "sequence": []})
+    response.status_code = 409
+    return response
+
+
+def _insert_index(steps, step_number):
+    """
+    Where a new step with the given number goes in steps; None (or a
+    number past the end) appends.
+    """
+    if step_number is None:
+        return len(steps)
+    return max(0, min(step_number - 1, len(steps)))
+
+
+def _apply_added_step(user_id, active_sequence, existing_steps, new_step, intent, step_number=None):
+    """
+    Add a step as step_number (appending by default). The new row gets a
+    position between its neighbours', so no other step is written unless
+    their positions have run out of room and the sequence is rebalanced.
+    """
+    version = _bump_sequence_version(active_sequence.id, active_sequence.version)
+    if version is None:
+        return _stale_sequence_reply(user_id)
+
+    index = _insert_index(existing_steps, step_number)
+    positions = [s.position for s in existing_steps]
+    positions.insert(index, None)
+    positions = reposition(positions, set(range(len(positions))) - {index})
+    _bulk_update_steps(active_sequence.id, "position", {
+        s.id: position
+        for s, position in zip(existing_steps, positions[:index] + positions[index + 1:])
+        if position != s.position
+    })
+
+    title = new_step.get("step_title", f"Step {index + 1}")
+    content = new_step.get("step_content", "")
+    step_id = db.session.execute(
+        insert(SequenceStep)
+        .values(sequence_id=active_sequence.id, position=positions[index], title=title, content=content)
+        .returning(SequenceStep.id)
+    ).scalar_one()
+    steps = list(existing_steps)
+    steps.insert(index, StepSnapshot(index + 1, title, content, step_id))
+    steps = number_steps(steps, positions)
+    stage_active_sequence(user_id, active_sequence.with_steps(steps, version))
+
+    if index == len(existing_steps):
+        ai_reply = "New step added to the sequence."
+    else:
+        ai_reply = f"New step added as step {index + 1}."
+    db.session.add(ChatMessage(user_id=user_id, message=ai_reply, sender="ai"))
+
+    # Every step from the new one on has a new number.
+    return _sequence_change_response(
+        {"reply": ai_reply, "intent": intent, "sequenceId": active_sequence.id}, steps, steps[index:], version
+    )
+
+
+def _apply_edited_step(user_id, active_sequence, existing_steps, target_step, new_title, new_content, intent):
+    version = _bump_sequence_version(active_sequence.id, active_sequence.version)
+    if version is None:
+        return _stale_sequence_reply(user_id)
+    record_step_revisions(version, {target_step.id: (new_title, new_content)})
+    db.session.execute(
+        update(SequenceStep)
+        .where(SequenceStep.id == target_step.id)
+        .values(title=new_title, content=new_content)
+    )
+    edited_step = StepSnapshot(target_step.step_number, new_title, new_content, target_step.id, target_step.position)
+    steps = [edited_step if s is target_step else s for s in existing_steps]
+    stage_active_sequence(user_id, active_sequence.with_steps(steps, version))
+
+    ai_confirm = f"Step {target_step.step_number} updated."
+    db.session.add(ChatMessage(user_id=user_id, message=ai_confirm, sender="ai"))
+
+    return _sequence_change_response(
+        {"reply": ai_confirm, "intent": intent, "sequenceId": active_sequence.id}, steps, [edited_step], version
+    )
+
+
+def _apply_edit_responses(user_id, active_sequence, existing_steps, target_steps, ai_responses, intent):
+    """
+    Apply the rewrite of each target step. If the model asked for
+    clarification on any of them, nothing is changed and its question is
+    the reply.
+    """
+    for ai_response in ai_responses:
+        if "clarify" in ai_response.lower():
+            return _apply_clarification(user_id, active_sequence, existing_steps, ai_response)
+
+    if len(target_steps) == 1:
+        new_title, final_revision = parse_edited_step(ai_responses[0], target_steps[0])
+        return _apply_edited_step(
+            user_id, active_sequence, existing_steps, target_steps[0], new_title, final_revision, intent
+        )
+
+    edits = {
+        target_step.id: parse_edited_step(ai_response, target_step)
+        for target_step, ai_response in zip(target_steps, ai_responses)
+    }
+    return _apply_edited_steps(user_id, active_sequence, existing_steps, edits, intent)
+
+
+def _apply_edited_steps(user_id, active_sequence, existing_steps, edits, intent):
+    """
+    Write several step edits ({step_id: (title, content)}) with one
+    UPDATE per column and a single version bump.
+    """
+    version = _bump_sequence_version(active_sequence.id, active_sequence.version)
+    if version is None:
+        return _stale_sequence_reply(user_id)
+    record_step_revisions(version, edits)
+    _bulk_update_steps(active_sequence.id, "title", {i: title for i, (title, _) in edits.items()})
+    _bulk_update_steps(active_sequence.id, "content", {i: content for i, (_, content) in edits.items()})
+    steps = [
+        StepSnapshot(s.step_number, *edits[s.id], s.id, s.position) if s.id in edits else s
+        for s in existing_steps
+    ]
+    stage_active_sequence(user_id, active_sequence.with_steps(steps, version))
+
+    numbers = [str(s.step_number) for s in steps if s.id in edits]
+    ai_confirm = f"Steps {', '.join(numbers[:-1])} and {numbers[-1]} updated."
+    db.session.add(ChatMessage(user_id=user_id, message=ai_confirm, sender="ai"))
+
+    return _sequence_change_response(
+        {"reply": ai_confirm, "intent": intent, "sequenceId": active_sequence.id},
+        steps, [s for s in steps if s.id in edits], version
+    )
+
+
+def _apply_clarification(user_id, active_sequence, existing_steps, ai_response):
+    db.session.add(ChatMessage(user_id=user_id, message=ai_response, sender="ai"))
+
+    return _sequence_change_response(
+        {"reply": ai_response, "intent": "clarification", "sequenceId": active_sequence.id},
+        existing_steps, [], active_sequence.version
+    )
+
+
+def _sequence_change_response(payload, steps, changed_steps, version):
+    """
+    Answer a chat that changed (or looked at) the active sequence: with
+    every step, or for requests with sequenceFormat "diff" only the changed
+    steps and the step count. Both carry the sequence's new version.
+    """
+    payload["version"] = version
+    if g.get("sequence_format") == "diff":
+        payload["changedSteps"] = _serialize_steps(changed_steps)
+        payload["stepCount"] = len(steps)
+    else:
+        payload["sequence"] = _serialize_steps(steps)
+    return jsonify(payload)
+
+
+def _archive_sequence(user_id, active_sequence):
+    """
+    Archive the active sequence, keeping it and its steps for
+    /api/sequence/<id>/restore. The user's next most recent unarchived
+    sequence, if any, becomes active, so their cache entry is reloaded
+    after the commit.
+    """
+    db.session.execute(
+        update(Sequence).where(Sequence.id == active_sequence.id).values(archived_at=datetime.utcnow())
+    )
+    stage_active_sequence(user_id)
+
+
+def _replace_sequence(user_id, active_sequence, args):
+    """
+    Archive the active sequence and stage its replacement. The new sequence
+    is flushed for its ID and the steps are written with one bulk INSERT.
+    Returns (new_sequence, steps) with steps as StepSnapshots.
+    """
+    if active_sequence:
+        _archive_sequence(user_id, active_sequence)
+
+    new_sequence = Sequence(user_id=user_id, title=args.get("sequence_title", "No Title"))
+    db.session.add(new_sequence)
+    db.session.flush()
+
+    new_steps = args.get("steps", [])[:4]
+    step_rows = [
+        {
+            "sequence_id": new_sequence.id,
+            "position": position,
+            "title": step.get("step_title", f"Step {i}"),
+            "content": step.get("step_content", "")
+        }
+        for (i, step), position in zip(enumerate(new_steps, start=1), initial_ranks(len(new_steps)))
+    ]
+    step_ids = []
+    if step_rows:
+        step_ids = db.session.execute(
+            insert(SequenceStep).returning(SequenceStep.id, sort_by_parameter_order=True), step_rows
+        ).scalars().all()
+    steps = number_steps(
+        StepSnapshot(None, row["title"], row["content"], step_id, row["position"])
+        for row, step_id in zip(step_rows, step_ids)
+    )
+    stage_active_sequence(user_id, SequenceSnapshot(new_sequence.id, new_sequence.title, steps, new_sequence.version))
+    return new_sequence, steps
+
+
+def _apply_new_sequence(user_id, active_sequence, args, intent):
+    new_sequence, steps = _replace_sequence(user_id, active_sequence, args)
+
+    ai_reply = "Here's your sequence. See the Sequence panel."
+    db.session.add(ChatMessage(user_id=user_id, message=ai_reply, sender="ai"))
+
+    return jsonify({
+        "reply": ai_reply,
+        "intent": intent,
+        "sequence": _serialize_steps(steps),
+        "sequenceId": new_sequence.id
+    })
+
+
+def _apply_text_reply(user_id, ai_reply, intent):
+    db.session.add(ChatMessage(user_id=user_id, message=ai_reply, sender="ai"))
+    return jsonify({"reply": ai_reply, "intent": intent, "sequence": []})
+
+
+def _resolve_edit_targets(user_input, existing_steps):
+    """
+    Find the steps an edit request refers to ("step 3", "steps 2-4", "all
+    steps"). Returns (target_steps, error_response).
+    """
+    last_step_number = existing_steps[-1].step_number if existing_steps else 0
+    target_nums = extract_step_numbers(user_input, last_step_number)
+    if not target_nums:
+        if not existing_steps:
+            return None, (jsonify({"reply": "No steps available to edit.", "sequence": []}), 400)
+        return None, (jsonify({"reply": "Could not determine which step to edit.", "sequence": []}), 400)
+
+    steps_by_number = {s.step_number: s for s in existing_steps}
+    missing = [n for n in target_nums if n not in steps_by_number]
+    if missing:
+        return None, (jsonify({"reply": f"Step {missing[0]} not found.", "sequence": []}), 404)
+    return [steps_by_number[n] for n in target_nums], None
+
+
+def _rewrite_steps(existing_steps, target_steps, user_input):
+    """
+    Ask the model to rewrite each target step, running up to
+    EDIT_STEP_MAX_PARALLEL calls at once. Returns the replies in target
+    order; the first failed call's exception is raised.
+    """
+    def rewrite(target_step):
+        response = chat_completion(
+            "edit_step",
+            model="gpt-4o",
+            messages=build_edit_step_messages(existing_steps, target_step, user_input),
+            temperature=0.7
+        )
+        return response.choices[0].message.content.strip()
+
+    if len(target_steps) == 1:
+        return [rewrite(target_steps[0])]
+    workers = max(1, min(len(target_steps), current_app.config["EDIT_STEP_MAX_PARALLEL"]))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="helix-edit") as executor:
+        return list(executor.map(in_current_trace(rewrite), target_steps))
+
+
+def _openai_error_reply(e, reply):
+    if isinstance(e, LLMUnavailableError):
+        return LLM_UNAVAILABLE_REPLY
+    return reply
+
+
+def _openai_error(e, reply):
+    """
+    Log a failed OpenAI call and build its error response. Calls refused
+    by the client (circuit open, too many in flight) get a 503 with
+    Retry-After; anything else is a 500 with reply.
+    """
+    print("OpenAI API Error:", e)
+    body = jsonify({"reply": _openai_error_reply(e, reply), "sequence": []})
+    if isinstance(e, LLMUnavailableError):
+        return body, 503, {"Retry-After": str(e.retry_after)}
+    return body, 500
+
+
+def _use_single_call(data):
+    single_call = data.get("singleCall")
+    if single_call is None:
+        single_call = current_app.config["CHAT_SINGLE_CALL"]
+    return bool(single_call)
+
+
+def _use_async_job(data):
+    as_job = data.get("async")
+    if as_job is None:
+        as_job = current_app.config["CHAT_ASYNC_JOBS"]
+    return bool(as_job)
+
+
+def _stage_generation_job(ctx, mode):
+    """
+    Stage a job that generates the sequence in the background and answer
+    202 with its ID. mode is "new_sequence" or "single_call".
+    """
+    job = GenerationJob(id=new_job_id(), user_id=ctx["user_id"], mode=mode, webhook_url=ctx["webhook_url"])
+    stage_generation_job(job, _run_generation_job)
+    status_url = url_for("main_bp.get_job", job_id=job.id)
+    return jsonify({
+        "reply": "Generating your sequence...",
+        "jobId": job.id,
+        "status": "queued",
+        "statusUrl": status_url,
+        "sequence": []
+    }), 202, {"Location": status_url}
+
+
+def _run_generation_job(job_id):
+    """
+    Worker side of an async chat. The user's message was committed with the
+    job, so the conversation is read back from the database; the generated
+    sequence, the AI reply and the job's result are committed together.
+    """
+    job = db.session.get(GenerationJob, job_id)
+    if not job or job.status != "queued":
+        return
+    job.status = "running"
+    job.started_at = datetime.utcnow()
+    db.session.commit()
+
+    user_id = job.user_id
+    active_sequence = load_active_sequence(user_id)
+    existing_steps = active_sequence.steps if active_sequence else []
+    conversation = load_db_conversation(user_id)
+
+    try:
+        if job.mode == "single_call":
+            response = chat_completion(
+                "single_call",
+                model="gpt-4o",
+                messages=build_single_call_messages(existing_steps, conversation),
+                functions=single_call_function_definitions,
+                function_call="auto",
+                temperature=0.7
+            )
+        else:
+            response = chat_completion(
+                "new_sequence",
+                model="gpt-4o",
+                messages=conversation,
+                functions=function_definitions,
+                function_call="auto",
+                temperature=0.7
+            )
+    except Exception as e:
+        rv = _openai_error(e, "Error calling OpenAI API")
+    else:
+        choice = response.choices[0]
+        with db.session.no_autoflush:
+            # Another request may have changed the sequence meanwhile.
+            active_sequence = load_active_sequence(user_id, verify=True)
+            existing_steps = active_sequence.steps if active_sequence else []
+            if job.mode == "single_call":
+                rv = _apply_single_call_choice(user_id, active_sequence, existing_steps, choice)
+            else:
+                prompt = next((m["content"] for m in reversed(conversation) if m["role"] == "user"), None)
+                rv = _apply_new_sequence_choice(user_id, active_sequence, choice, "new_sequence", prompt, conversation)
+
+    response = current_app.make_response(rv)
+    finish_job(job, response.get_json(), response.status_code)
+    commit_with_cache()
+
+
 @main_bp.route("/api/chat", methods=["POST"])
 def chat():
     data = request.get_json()
-    user_id = data.get("user_id")
-    if not user_id:
-        return jsonify({"reply": "Missing user_id.", "sequence": []}), 400
+    error, ctx = _load_chat_context(data)
+    if error:
+        return error
+    stored = _stored_chat_response(ctx)
+    if stored:
+        return stored
 
-    
-    user = User.query.get(user_id)
-    if not user:
-        user = User(id=user_id)
-        db.session.add(user)
-        db.session.commit()
+    # A double submit shares the first request's generation and write; the
+    # duplicates answer with a copy of its response.
+    frozen, shared = _chat_flights.do(
+        _chat_flight_key(data, ctx["active_sequence"]), lambda: _freeze(_run_chat(data, ctx))
+    )
+    response = current_app.response_class(*frozen)
+    if shared:
+        _record_shared_chat(ctx, response)
+    return response
+
+
+def _run_chat(data, ctx):
+    # One unit of work per request: everything below is staged in the
+    # session and written by the single commit at the end.
+    g.sequence_format = ctx["sequence_format"]
+    _stage_incoming_messages(ctx)
+    with db.session.no_autoflush:
+        if _use_single_call(data):
+            rv = _chat_single_call(ctx)
+        else:
+            rv = _chat_two_calls(ctx)
+    return _commit_chat(ctx, rv)
+
+
+def _normalized_message(message):
+    return " ".join(message.lower().split())
+
+
+def _chat_flight_key(data, active_sequence):
+    """
+    Chats are coalesced when they come from the same user with the same
+    (normalized) message and options, against the same version of the
+    active sequence.
+    """
+    return (
+        data.get("user_id"),
+        _normalized_message(data.get("message", "")),
+        active_sequence.id if active_sequence else None,
+        active_sequence.version if active_sequence else None,
+        _use_single_call(data),
+        _use_async_job(data),
+        data.get("sequenceFormat", "full"),
+    )
+
+
+def _freeze(response):
+    return response.get_data(), response.status_code, list(response.headers.items())
 
-        default_msg = ChatMessage(user_id=user_id, message="How can I help you?", sender="ai")
-        db.session.add(default_msg)
+
+def _stored_chat_response(ctx):
+    if not ctx["idempotency_key"]:
+        return None
+    response = find_stored_response(ctx["user_id"], ctx["idempotency_key"], ctx["request_hash"])
+    if response is not None:
+        DEDUPLICATED_REQUESTS.labels("chat", "idempotent_replay").inc()
+    return response
+
+
+def _commit_chat(ctx, rv):
+    """
+    Commit a chat's unit of work, storing the response under the request's
+    Idempotency-Key in the same transaction. Returns the response to send.
+    """
+    response = current_app.make_response(rv)
+    key = ctx["idempotency_key"]
+    if key:
+        stage_stored_response(ctx["user_id"], key, ctx["request_hash"], response)
+    try:
+        commit_with_cache()
+    except IntegrityError:
+        if not key:
+            raise
+        # Another process committed a request with the same key first;
+        # answer with its response and drop this one's writes.
+        db.session.rollback()
+        discard_staged_jobs()
+        stored = find_stored_response(ctx["user_id"], key, ctx["request_hash"])
+        if stored is None:
+            raise
+        return current_app.make_response(stored)
+    submit_staged_jobs()
+    return response
+
+
+def _record_shared_chat(ctx, response):
+    """
+    Account for a chat answered with another request's response, and store
+    that response under this request's Idempotency-Key too.
+    """
+    DEDUPLICATED_REQUESTS.labels("chat", "coalesced").inc()
+    if not ctx["idempotency_key"]:
+        return
+    stage_stored_response(ctx["user_id"], ctx["idempotency_key"], ctx["request_hash"], response)
+    try:
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
 
-    user_input = data.get("message", "").strip()
-    if not user_input:
-        return jsonify({"reply": "Empty message.", "sequence": []}), 400
 
-    
-    user_msg = ChatMessage(user_id=user_id, message=user_input, sender="user")
-    db.session.add(user_msg)
-    db.session.commit()
+def _chat_two_calls(ctx):
+    user_id = ctx["user_id"]
+    user_input = ctx["user_input"]
+    active_sequence = ctx["active_sequence"]
+    existing_steps = ctx["existing_steps"]
 
-    
     intent = classify_intent(user_input)
-    print("Classified intent:", intent)
-
-    active_sequence = Sequence.query.filter_by(user_id=user_id).order_by(Sequence.created_at.desc()).first()
+    set_request_intent(intent)
 
     if intent == "add_step":
         if not active_sequence:
             return jsonify({"reply": "No active sequence to add a step to.", "sequence": []}), 400
 
-        existing_steps = SequenceStep.query.filter_by(sequence_id=active_sequence.id).order_by(SequenceStep.step_number).all()
-        steps_text = "\n".join([f"{s.title} - {s.content}" for s in existing_steps])
-
-        prompt = (
-            "You are Helix, an AI assistant that appends a new step to an existing sequence. "
-            "Do not modify any existing steps. The current sequence is:\n"
-            + steps_text +
-            "\nBased on the following user request, generate one new step as a JSON object with keys 'step_title' and 'step_content'. "
-            "Ensure the style matches the existing steps. Do not change any other step."
-        )
-        messages_to_send = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": user_input},
-        ]
-
         try:
-            response = openai.chat.completions.create(
+            response = chat_completion(
+                "add_step",
                 model="gpt-4o",
-                messages=messages_to_send,
+                messages=build_add_step_messages(existing_steps, user_input),
                 temperature=0.7
             )
         except Exception as e:
-            print("OpenAI API Error:", e)
-            return jsonify({"reply": "Error calling OpenAI API", "sequence": []}), 500
+            return _openai_error(e, "Error calling OpenAI API")
+
+        new_step = parse_added_step(response.choices[0].message.content)
+        step_number = extract_insert_position(user_input, len(existing_steps))
+        return _apply_added_step(user_id, active_sequence, existing_steps, new_step, intent, step_number)
+
+    elif intent == "edit_step":
+        if not active_sequence:
+            return jsonify({"reply": "No active sequence to edit.", "sequence": []}), 400
 
-        ai_output = response.choices[0].message.content.strip()
-        
-        if ai_output.startswith("```json"):
-            ai_output = ai_output[len("```json"):].strip()
-        if ai_output.endswith("```"):
-            ai_output = ai_output[:-3].strip()
+        target_steps, error = _resolve_edit_targets(user_input, existing_steps)
+        if error:
+            return error
 
-        
         try:
-            new_step = json.loads(ai_output)
-        except json.JSONDecodeError:
-            
-            new_step = {"step_title": ai_output, "step_content": ai_output}
-
-        
-        last_step = existing_steps[-1] if existing_steps else None
-        new_num = last_step.step_number + 1 if last_step else 1
-
-        seq_step = SequenceStep(
-            sequence_id=active_sequence.id,
-            step_number=new_num,
-            title=new_step.get("step_title", f"Step {new_num}"),
-            content=new_step.get("step_content", "")
-        )
-        db.session.add(seq_step)
-        db.session.commit()
+            ai_responses = _rewrite_steps(existing_steps, target_steps, user_input)
+        except Exception as e:
+            return _openai_error(e, "Error calling OpenAI API for step edit")
 
-        updated_steps = [
-            {
-                "stepNumber": s.step_number,
-                "stepTitle": s.title,
-                "stepContent": s.content
-            }
-            for s in SequenceStep.query.filter_by(sequence_id=active_sequence.id).order_by(SequenceStep.step_number)
-        ]
+        return _apply_edit_responses(user_id, active_sequence, existing_steps, target_steps, ai_responses, intent)
 
-        ai_reply = "New step added to the sequence."
-        conf_msg = ChatMessage(user_id=user_id, message=ai_reply, sender="ai")
-        db.session.add(conf_msg)
-        db.session.commit()
+    elif intent == "new_sequence":
+        conversation, similar, action = None, None, "miss"
+        if similar_sequence_cache_enabled():
+            conversation = _conversation_for(ctx)
+            similar, action = find_similar_sequence(user_id, user_input, conversation)
+        if action == "serve":
+            return _apply_new_sequence(user_id, active_sequence, similar.args, intent)
+        if ctx["as_job"]:
+            return _stage_generation_job(ctx, "new_sequence")
+
+        if conversation is None:
+            conversation = _conversation_for(ctx)
+        messages = conversation
+        if action == "seed":
+            messages = build_seeded_sequence_messages(conversation, similar.args)
+        try:
+            response = chat_completion(
+                "new_sequence",
+                model="gpt-4o",
+                messages=messages,
+                functions=function_definitions,
+                function_call="auto",
+                temperature=0.7
+            )
+        except Exception as e:
+            return _openai_error(e, "Error calling OpenAI API")
 
+        return _apply_new_sequence_choice(
+            user_id, active_sequence, response.choices[0], intent, user_input, conversation
+        )
+
+    else:
         return jsonify({
-            "reply": ai_reply,
-            "intent": intent,
-            "sequence": updated_steps,
-            "sequenceId": active_sequence.id
+            "reply": "Unable to classify request. Please try again.",
+            "sequence": []
         })
 
+
+def _chat_single_call(ctx):
+    """
+    Classify and generate in one model round trip. The model is offered a
+    function per intent and the function it calls decides the branch.
+    """
+    if ctx["as_job"]:
+        return _stage_generation_job(ctx, "single_call")
+
+    existing_steps = ctx["existing_steps"]
+    messages = build_single_call_messages(existing_steps, _conversation_for(ctx))
+
+    try:
+        response = chat_completion(
+            "single_call",
+            model="gpt-4o",
+            messages=messages,
+            functions=single_call_function_definitions,
+            function_call="auto",
+            temperature=0.7
+        )
+    except Exception as e:
+        return _openai_error(e, "Error calling OpenAI API")
+
+    return _apply_single_call_choice(ctx["user_id"], ctx["active_sequence"], existing_steps, response.choices[0])
+
+
+def _apply_new_sequence_choice(user_id, active_sequence, choice, intent, prompt=None, conversation=None):
+    """
+    Apply the new_sequence call's answer. With prompt and the conversation
+    it was generated from, a generated sequence is also added to the
+    similar-sequence cache.
+    """
+    if choice.finish_reason == "function_call":
+        fn_name = choice.message.function_call.name
+        if fn_name == "performTaskInSequences":
+            args = _parse_function_args(choice.message.function_call.arguments)
+            if prompt and conversation:
+                remember_sequence(user_id, prompt, conversation, args)
+            return _apply_new_sequence(user_id, active_sequence, args, intent)
+        else:
+            ai_reply = "I attempted to call an unknown function."
+            return jsonify({"reply": ai_reply, "sequence": []})
+    else:
+        if active_sequence:
+            _archive_sequence(user_id, active_sequence)
+        return _apply_text_reply(user_id, choice.message.content, intent)
+
+
+def _apply_single_call_choice(user_id, active_sequence, existing_steps, choice):
+    if choice.finish_reason != "function_call":
+        if active_sequence:
+            return _apply_clarification(user_id, active_sequence, existing_steps, choice.message.content)
+        return _apply_text_reply(user_id, choice.message.content, "new_sequence")
+
+    fn_name = choice.message.function_call.name
+    intent = SINGLE_CALL_FUNCTION_INTENTS.get(fn_name)
+    args = _parse_function_args(choice.message.function_call.arguments)
+    set_request_intent(intent)
+
+    if intent == "add_step":
+        if not active_sequence:
+            return jsonify({"reply": "No active sequence to add a step to.", "sequence": []}), 400
+        step_number = args.get("step_number") if isinstance(args.get("step_number"), int) else None
+        return _apply_added_step(user_id, active_sequence, existing_steps, args, intent, step_number)
+
     elif intent == "edit_step":
         if not active_sequence:
             return jsonify({"reply": "No active sequence to edit.", "sequence": []}), 400
+        target_num = args.get("step_number")
+        target_step = next((s for s in existing_steps if s.step_number == target_num), None)
+        if not target_step:
+            return jsonify({"reply": f"Step {target_num} not found.", "sequence": []}), 404
+        new_title = args.get("step_title") or target_step.title
+        return _apply_edited_step(
+            user_id, active_sequence, existing_steps, target_step, new_title, args.get("step_content", ""), intent
+        )
 
-        target_num = extract_step_number(user_input)
-        if target_num == "last":
-            existing_steps = SequenceStep.query.filter_by(
-                sequence_id=active_sequence.id
-            ).order_by(SequenceStep.step_number.desc()).all()
-            if existing_steps:
-                target_num = existing_steps[0].step_number
-            else:
-                return jsonify({"reply": "No steps available to edit.", "sequence": []}), 400
+    elif intent == "new_sequence":
+        return _apply_new_sequence(user_id, active_sequence, args, intent)
 
-        if not target_num:
-            return jsonify({"reply": "Could not determine which step to edit.", "sequence": []}), 400
+    else:
+        ai_reply = "I attempted to call an unknown function."
+        return jsonify({"reply": ai_reply, "sequence": []})
 
-        target_step = SequenceStep.query.filter_by(
-            sequence_id=active_sequence.id,
-            step_number=target_num
-        ).first()
 
-        if not target_step:
-            return jsonify({"reply": f"Step {target_num} not found.", "sequence": []}), 404
+@main_bp.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    data = request.get_json()
+    error, ctx = _load_chat_context(data)
+    if error:
+        return error
 
-        
-        existing_steps = SequenceStep.query.filter_by(
-            sequence_id=active_sequence.id
-        ).order_by(SequenceStep.step_number).all()
-
-        context_str = "\n".join([
-            f"Step {s.step_number}: {s.title} - {s.content}"
-            for s in existing_steps
-        ])
-
-        prompt = (
-            f"You are Helix, a friendly AI assistant. The current sequence is:\n{context_str}\n"
-            f"Your task is to update only the content of step {target_num} (currently titled '{target_step.title}') "
-            "so that it fits naturally with the rest of the sequence in a warm, human tone. "
-            f"Incorporate the following user request into the revised content: {user_input}\n"
-            "Return only the final revised version of the step content as a single paragraph without any step number, title, or markdown formatting. "
-            "If a new title is warranted due to a topic shift, output the new title on the first line (without markdown symbols), "
-            "followed by the revised content on the next line. Do not modify any other step."
-        )
+    intent = classify_intent(ctx["user_input"])
+    set_request_intent(intent)
 
+    if intent == "add_step" and not ctx["active_sequence"]:
+        return jsonify({"reply": "No active sequence to add a step to.", "sequence": []}), 400
+
+    target_steps = None
+    if intent == "edit_step":
+        if not ctx["active_sequence"]:
+            return jsonify({"reply": "No active sequence to edit.", "sequence": []}), 400
+        target_steps, error = _resolve_edit_targets(ctx["user_input"], ctx["existing_steps"])
+        if error:
+            return error
+
+    return Response(
+        stream_with_context(_chat_stream_events(ctx, intent, target_steps)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _chat_stream_events(ctx, intent, target_steps):
+    """
+    Generate the SSE events for /api/chat/stream. Nothing is written until
+    generation has finished; the user message, any sequence changes and the
+    AI reply are then committed together in a single transaction.
+    """
+    user_id = ctx["user_id"]
+    user_input = ctx["user_input"]
+    active_sequence = ctx["active_sequence"]
+    existing_steps = ctx["existing_steps"]
+
+    yield sse_event("intent", {"intent": intent})
+
+    def fail(reply):
+        _stage_incoming_messages(ctx)
+        commit_with_cache()
+        return sse_event("error", {"reply": reply, "sequence": []})
+
+    if intent == "add_step":
         try:
-            response = openai.chat.completions.create(
+            response = chat_completion(
+                "add_step",
                 model="gpt-4o",
-                messages=[{"role": "system", "content": prompt}],
+                messages=build_add_step_messages(existing_steps, user_input),
                 temperature=0.7
             )
         except Exception as e:
             print("OpenAI API Error:", e)
-            return jsonify({"reply": "Error calling OpenAI API for step edit", "sequence": []}), 500
+            yield fail(_openai_error_reply(e, "Error calling OpenAI API"))
+            return
 
-        ai_response = response.choices[0].message.content.strip()
+        new_step = parse_added_step(response.choices[0].message.content)
+        step_number = extract_insert_position(user_input, len(existing_steps))
+        _stage_incoming_messages(ctx)
+        rv = _apply_added_step(user_id, active_sequence, existing_steps, new_step, intent, step_number)
+        if rv.status_code != 200:
+            commit_with_cache()
+            yield sse_event("error", rv.get_json())
+            return
+        result = rv.get_json()
+        yield sse_event("step", result["sequence"][_insert_index(existing_steps, step_number)])
 
-        if "clarify" in ai_response.lower():
-            clar_msg = ChatMessage(user_id=user_id, message=ai_response, sender="ai")
-            db.session.add(clar_msg)
-            db.session.commit()
-
-            updated_steps = [
-                {
-                    "stepNumber": s.step_number,
-                    "stepTitle": s.title,
-                    "stepContent": s.content
-                }
-                for s in existing_steps
-            ]
-            return jsonify({
-                "reply": ai_response,
-                "intent": "clarification",
-                "sequence": updated_steps,
-                "sequenceId": active_sequence.id
-            })
-        else:
-            
-            if "\n" in ai_response:
-                parts = ai_response.split("\n", 1)
-                proposed_title = parts[0].strip()
-                proposed_content = parts[1].strip()
-                
-                new_title = (
-                    proposed_title if proposed_title.lower() != target_step.title.lower()
-                    else target_step.title
-                )
-                final_revision = proposed_content
-            else:
-                new_title = target_step.title
-                final_revision = ai_response
-
-            
-            pattern = r"^" + re.escape(target_step.title) + r"[\s:\-]*"
-            final_revision = re.sub(pattern, "", final_revision).strip()
-
-            target_step.title = new_title
-            target_step.content = final_revision
-            db.session.add(target_step)
-            db.session.commit()
-
-            updated_steps = [
-                {
-                    "stepNumber": s.step_number,
-                    "stepTitle": s.title,
-                    "stepContent": s.content
-                }
-                for s in SequenceStep.query.filter_by(sequence_id=active_sequence.id).order_by(SequenceStep.step_number)
-            ]
-            ai_confirm = f"Step {target_num} updated."
-            confirm_msg = ChatMessage(user_id=user_id, message=ai_confirm, sender="ai")
-            db.session.add(confirm_msg)
-            db.session.commit()
-
-            return jsonify({
-                "reply": ai_confirm,
-                "intent": intent,
-                "sequence": updated_steps,
-                "sequenceId": active_sequence.id
-            })
-
-    elif intent == "new_sequence":
-        if active_sequence:
-            db.session.delete(active_sequence)
-            db.session.commit()
+    elif intent == "edit_step":
+        try:
+            ai_responses = _rewrite_steps(existing_steps, target_steps, user_input)
+        except Exception as e:
+            print("OpenAI API Error:", e)
+            yield fail(_openai_error_reply(e, "Error calling OpenAI API for step edit"))
+            return
 
-        from .utils import load_db_conversation
-        db_history = load_db_conversation(user_id)
+        _stage_incoming_messages(ctx)
+        rv = _apply_edit_responses(user_id, active_sequence, existing_steps, target_steps, ai_responses, intent)
+        if rv.status_code != 200:
+            commit_with_cache()
+            yield sse_event("error", rv.get_json())
+            return
+        result = rv.get_json()
+        if result["intent"] != "clarification":
+            for target_step in target_steps:
+                yield sse_event("step", result["sequence"][existing_steps.index(target_step)])
 
+    else:
         try:
-            response = openai.chat.completions.create(
+            response = chat_completion(
+                "new_sequence",
                 model="gpt-4o",
-                messages=db_history,
+                messages=_conversation_for(ctx),
                 functions=function_definitions,
                 function_call="auto",
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
+            arguments = SequenceArgumentStream()
+            fn_name = None
+            reply_parts = []
+            streamed_steps = 0
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.function_call:
+                    fn_name = fn_name or delta.function_call.name
+                    for kind, value in arguments.feed(delta.function_call.arguments or ""):
+                        if kind == "title":
+                            yield sse_event("title", {"sequenceTitle": value})
+                        elif streamed_steps < 4:
+                            streamed_steps += 1
+                            yield sse_event("step", {
+                                "stepNumber": streamed_steps,
+                                "stepTitle": value.get("step_title", f"Step {streamed_steps}"),
+                                "stepContent": value.get("step_content", "")
+                            })
+                elif delta.content:
+                    reply_parts.append(delta.content)
+                    yield sse_event("delta", {"content": delta.content})
         except Exception as e:
             print("OpenAI API Error:", e)
-            return jsonify({"reply": "Error calling OpenAI API", "sequence": []}), 500
+            yield fail(_openai_error_reply(e, "Error calling OpenAI API"))
+            return
 
-        choice = response.choices[0]
-        if choice.finish_reason == "function_call":
-            fn_name = choice.message.function_call.name
-            fn_args_json = choice.message.function_call.arguments
-            if fn_name == "performTaskInSequences":
-                try:
-                    args = json.loads(fn_args_json) if isinstance(fn_args_json, str) else fn_args_json
-                except json.JSONDecodeError:
-                    args = {}
-
-                title = args.get("sequence_title", "No Title")
-                steps_data = args.get("steps", [])
-
-                new_sequence = Sequence(user_id=user_id, title=title)
-                db.session.add(new_sequence)
-                db.session.commit()
-
-                formatted_steps = []
-                for i, step in enumerate(steps_data[:4], start=1):
-                    seq_step = SequenceStep(
-                        sequence_id=new_sequence.id,
-                        step_number=i,
-                        title=step.get("step_title", f"Step {i}"),
-                        content=step.get("step_content", "")
-                    )
-                    db.session.add(seq_step)
-                    formatted_steps.append({
-                        "stepNumber": i,
-                        "stepTitle": seq_step.title,
-                        "stepContent": seq_step.content
-                    })
-                db.session.commit()
-
-                ai_reply = "Here's your sequence. See the Sequence panel."
-                confirm_msg = ChatMessage(user_id=user_id, message=ai_reply, sender="ai")
-                db.session.add(confirm_msg)
-                db.session.commit()
-
-                return jsonify({
-                    "reply": ai_reply,
-                    "intent": intent,
-                    "sequence": formatted_steps,
-                    "sequenceId": new_sequence.id
-                })
-            else:
-                ai_reply = "I attempted to call an unknown function."
-                return jsonify({"reply": ai_reply, "sequence": []})
+        if fn_name and fn_name != "performTaskInSequences":
+            yield fail("I attempted to call an unknown function.")
+            return
+
+        _stage_incoming_messages(ctx)
+        if fn_name:
+            result = _apply_new_sequence(user_id, active_sequence, arguments.arguments(), intent).get_json()
         else:
-           
-            ai_reply = choice.message.content
-            ai_msg = ChatMessage(user_id=user_id, message=ai_reply, sender="ai")
-            db.session.add(ai_msg)
-            db.session.commit()
-            return jsonify({"reply": ai_reply, "intent": intent, "sequence": []})
+            if active_sequence:
+                _archive_sequence(user_id, active_sequence)
+            result = _apply_text_reply(user_id, "".join(reply_parts), intent).get_json()
 
-    else:
-        return jsonify({
-            "reply": "Unable to classify request. Please try again.",
-            "sequence": []
-        })
+    commit_with_cache()
+    yield sse_event("done", result)
+
+
+def _encode_history_cursor(cursor):
+    created_at, msg_id = cursor
+    return f"{created_at.isoformat()},{msg_id}"
+
+
+def _decode_history_cursor(cursor):
+    timestamp, _, msg_id = cursor.rpartition(",")
+    return datetime.fromisoformat(timestamp), int(msg_id)
+
+
+def _oldest_cursor(chats, before):
+    return (chats[0].created_at, chats[0].id) if chats else before
+
+
+def _load_chat_page(user_id, before, limit):
+    """
+    Return (messages, has_more) for the newest `limit` messages older than
+    the (created_at, id) cursor `before`, in chronological order.
+    """
+    query = ChatMessage.query.filter_by(user_id=user_id)
+    if before:
+        before_at, before_id = before
+        query = query.filter(or_(
+            ChatMessage.created_at < before_at,
+            and_(ChatMessage.created_at == before_at, ChatMessage.id < before_id)
+        ))
+    rows = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
 
 
 @main_bp.route("/api/load", methods=["GET"])
@@ -372,53 +1443,195 @@ def load_history():
     if not user_id:
         return jsonify({"error": "Missing user_id"}), 400
 
-    chats = ChatMessage.query.filter_by(
-        user_id=user_id
-    ).order_by(ChatMessage.created_at.asc()).all()
+    include = request.args.get("include", "all")
+    if include not in ("all", "chat", "sequences"):
+        return jsonify({"error": "include must be one of all, chat or sequences."}), 400
+    include_archived = request.args.get("include_archived", "false").lower() in ("1", "true", "yes")
 
-    chat_history = [
-        {
-            "sender": msg.sender,
-            "message": msg.message,
-            "timestamp": msg.created_at.isoformat()
-        }
-        for msg in chats
-    ]
-    if not chat_history or (
-        chat_history[0]["sender"] != "ai"
-        or chat_history[0]["message"] != "How can I help you?"
-    ):
-        default_intro = {
-            "sender": "ai",
-            "message": "How can I help you?",
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        chat_history.insert(0, default_intro)
-
-    sequences = Sequence.query.filter_by(
-        user_id=user_id
-    ).order_by(Sequence.created_at.asc()).all()
-
-    sequences_data = []
-    for seq in sequences:
-        steps = SequenceStep.query.filter_by(sequence_id=seq.id).order_by(
-            SequenceStep.step_number.asc()
-        ).all()
-        sequences_data.append({
-            "sequence_id": seq.id,
-            "title": seq.title,
-            "steps": [
-                {
-                    "stepNumber": s.step_number,
-                    "stepTitle": s.title,
-                    "stepContent": s.content
-                }
-                for s in steps
-            ]
-        })
+    try:
+        limit = int(request.args.get("limit", current_app.config["HISTORY_PAGE_SIZE"]))
+        before = request.args.get("before")
+        before = _decode_history_cursor(before) if before else None
+        since = request.args.get("since")
+        since = _decode_sync_token(since) if since else None
+    except ValueError:
+        return jsonify({"error": "Invalid limit, before cursor or since token."}), 400
+    limit = max(1, min(limit, current_app.config["HISTORY_MAX_PAGE_SIZE"]))
 
-    print(f"Loaded history for user {user_id}: {len(chat_history)} messages, {len(sequences_data)} sequences")
-    return jsonify({
-        "chat_history": chat_history,
-        "sequences": sequences_data
-    })
+    # Answer a revalidation from one aggregate query, before loading or
+    # serializing anything.
+    state = _history_state(user_id)
+    etag = _history_etag(state, request.args)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        if since:
+            payload = _load_history_delta(user_id, include, since, limit, state.archived_through_id or 0)
+        else:
+            payload = _load_history_page(user_id, include, before, limit, include_archived)
+            if not before:
+                payload["sync_token"] = _encode_sync_token(max(state.max_message_id or 0, state.archived_through_id or 0))
+
+        annotate_request(
+            user_id=user_id,
+            messages=len(payload.get("chat_history", [])),
+            sequences=len(payload.get("sequences", []))
+        )
+        response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _load_history_page(user_id, include, before, limit, include_archived=False):
+    payload = {}
+
+    if include in ("all", "chat"):
+        chats, has_more = _load_chat_page(user_id, before, limit)
+        has_archived = False
+        if not has_more:
+            # Archived messages are all older than the ones still in the
+            # hot table, so paging simply continues into the archive.
+            if include_archived:
+                archived, has_more = load_archived_page(user_id, _oldest_cursor(chats, before), limit - len(chats))
+                chats = archived + chats
+            else:
+                has_archived = has_archived_messages(user_id)
+
+        chat_history = [_serialize_message(msg) for msg in chats]
+        if not has_more and not has_archived and (not chat_history or (
+            chat_history[0]["sender"] != "ai"
+            or chat_history[0]["message"] != "How can I help you?"
+        )):
+            default_intro = {
+                "sender": "ai",
+                "message": "How can I help you?",
+                "timestamp": datetime.utcnow().isoformat()
+            }
+            chat_history.insert(0, default_intro)
+
+        payload["chat_history"] = chat_history
+        payload["has_more"] = has_more
+        payload["has_archived"] = has_archived
+        oldest = _oldest_cursor(chats, before)
+        payload["next_before"] = _encode_history_cursor(oldest) if (has_more or has_archived) and oldest else None
+
+    if include in ("all", "sequences"):
+        sequences = Sequence.query.filter_by(
+            user_id=user_id, archived_at=None
+        ).options(selectinload(Sequence.steps)).order_by(Sequence.created_at.asc()).all()
+
+        payload["sequences"] = [_serialize_sequence(seq) for seq in sequences]
+
+    return payload
+
+
+def _load_history_delta(user_id, include, since, limit, archived_through_id=0):
+    """
+    Changes since a sync token: messages with a higher id (oldest first,
+    at most limit; has_more says whether to ask again with the new
+    sync_token), sequences updated since the token was issued, and the IDs
+    of all current sequences so clients can drop deleted ones. Messages
+    created within HISTORY_SYNC_OVERLAP_SECONDS before the token are
+    repeated ahead of the new ones.
+    """
+    since_message_id, since_at = since
+    payload = {}
+    last_message_id = since_message_id
+
+    if include in ("all", "chat"):
+        rows = ChatMessage.query.filter(
+            ChatMessage.user_id == user_id, ChatMessage.id > since_message_id
+        ).order_by(ChatMessage.id).limit(limit + 1).all()
+        if since_message_id < archived_through_id:
+            # Some messages newer than the token have been archived since.
+            archived = archived_messages_since(user_id, since_message_id, limit + 1)
+            rows = sorted(archived + rows, key=lambda msg: msg.id)[:limit + 1]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if rows:
+            last_message_id = rows[-1].id
+
+        # IDs are taken when a request flushes, so on PostgreSQL a lower ID
+        # can commit after the token was issued. Such a message was in
+        # flight then, so it was created (a user message when its request
+        # arrived) at most one request's duration before the token. Those
+        # are sent again and the client merges by id.
+        recent = ChatMessage.query.filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.id <= since_message_id,
+            ChatMessage.created_at >= since_at - timedelta(seconds=current_app.config["HISTORY_SYNC_OVERLAP_SECONDS"])
+        ).order_by(ChatMessage.id).all()
+        payload["chat_history"] = [_serialize_message(msg) for msg in recent + rows]
+        payload["has_more"] = has_more
+
+    if include in ("all", "sequences"):
+        # Overlap the window a little: updated_at is taken when a write is
+        # flushed, a moment before it commits.
+        changed_after = since_at - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        sequences = Sequence.query.filter(
+            Sequence.user_id == user_id, Sequence.archived_at.is_(None), Sequence.updated_at > changed_after
+        ).options(selectinload(Sequence.steps)).order_by(Sequence.created_at.asc()).all()
+        payload["sequences"] = [_serialize_sequence(seq) for seq in sequences]
+        payload["sequence_ids"] = db.session.execute(
+            select(Sequence.id)
+            .where(Sequence.user_id == user_id, Sequence.archived_at.is_(None))
+            .order_by(Sequence.created_at.asc())
+        ).scalars().all()
+
+    payload["sync_token"] = _encode_sync_token(last_message_id)
+    return payload
+
+
+def _serialize_message(msg):
+    return {
+        "id": msg.id,
+        "sender": msg.sender,
+        "message": msg.message,
+        "timestamp": msg.created_at.isoformat()
+    }
+
+
+def _serialize_sequence(seq):
+    return {
+        "sequence_id": seq.id,
+        "title": seq.title,
+        "version": seq.version,
+        "steps": _serialize_steps(number_steps(seq.steps))
+    }
+
+
+def _history_state(user_id):
+    """
+    Everything /api/load's output depends on, in one round trip: the
+    newest message ID, the newest archived message ID (which moves when
+    history is compacted), and the count, newest ID, last update and summed
+    versions of the user's sequences (every step change bumps a version).
+    """
+    messages = select(func.max(ChatMessage.id)).where(ChatMessage.user_id == user_id).scalar_subquery()
+    archived = select(func.max(ChatMessageArchive.last_message_id)).where(
+        ChatMessageArchive.user_id == user_id
+    ).scalar_subquery()
+    sequences = and_(Sequence.user_id == user_id, Sequence.archived_at.is_(None))
+    return db.session.execute(select(
+        messages.label("max_message_id"),
+        archived.label("archived_through_id"),
+        select(func.count()).where(sequences).scalar_subquery().label("sequence_count"),
+        select(func.max(Sequence.id)).where(sequences).scalar_subquery().label("max_sequence_id"),
+        select(func.max(Sequence.updated_at)).where(sequences).scalar_subquery().label("sequences_updated_at"),
+        select(func.sum(Sequence.version)).where(sequences).scalar_subquery().label("version_sum"),
+    )).one()
+
+
+def _history_etag(state, args):
+    key = json.dumps([list(state), sorted(args.items(multi=True))], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _encode_sync_token(message_id):
+    return f"{message_id},{datetime.utcnow().isoformat()}"
+
+
+def _decode_sync_token(token):
+    message_id, _, timestamp = token.partition(",")
+    return int(message_id), datetime.fromisoformat(timestamp)
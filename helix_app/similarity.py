@@ -0,0 +1,211 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .metrics import SIMILAR_SEQUENCE_LOOKUPS, annotate_request
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Messages at the end of the conversation (the new prompt and the turns
+# just before it) that a cached sequence is keyed on, with the summary.
+CONTEXT_MESSAGES = 4
+
+
+def shingles(prompt):
+    """
+    The words of a prompt plus its word pairs, lowercased. Word pairs keep
+    "cold email for founders" and "founders email for cold" apart.
+    """
+    words = _TOKEN.findall(prompt.lower())
+    return frozenset(words) | frozenset(zip(words, words[1:]))
+
+
+def context_key(conversation):
+    """
+    The text a new-sequence request is cached under: the running summary
+    of the conversation (the output of load_db_conversation) and its last
+    CONTEXT_MESSAGES messages, which end with the new prompt. Follow-ups
+    such as "yes please" only mean something together with what came
+    before them.
+    """
+    summaries = [m["content"] for m in conversation[1:] if m["role"] == "system"]
+    recent = [m["content"] for m in conversation if m["role"] != "system"][-CONTEXT_MESSAGES:]
+    return "\n".join(summaries + recent)
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarSequence:
+    __slots__ = ("prompt", "shingles", "signature", "scope", "args", "created_at")
+
+    def __init__(self, prompt, shingles, signature, scope, args, created_at):
+        self.prompt = prompt
+        self.shingles = shingles
+        self.signature = signature
+        self.scope = scope
+        # The performTaskInSequences arguments generated for prompt:
+        # {"sequence_title": ..., "steps": [{"step_title": ..., "step_content": ...}]}
+        self.args = args
+        self.created_at = created_at
+
+
+class SimilarSequenceIndex:
+    """
+    Past new-sequence prompts and the sequences generated for them, indexed
+    with MinHash signatures split into LSH bands: prompts sharing a band are
+    candidates, and the candidate with the highest exact Jaccard similarity
+    of its shingles is the match. Entries are kept per scope (a user, or
+    None for everyone), evicted least recently used first beyond
+    max_entries, and expire after ttl seconds.
+    """
+
+    def __init__(self, max_entries, ttl, num_perm=64, bands=16):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        # (a, b) of each permutation h(x) = (a * x + b) mod p, fixed so
+        # signatures are comparable between runs.
+        seeds = hashlib.sha256(b"helix-minhash").digest()
+        self.permutations = []
+        for i in range(self.rows * bands):
+            digest = hashlib.blake2b(seeds + i.to_bytes(2, "big"), digest_size=16).digest()
+            a = int.from_bytes(digest[:8], "big") % (_MERSENNE_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:], "big") % _MERSENNE_PRIME
+            self.permutations.append((a, b))
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def signature(self, shingle_set):
+        hashes = [
+            int.from_bytes(hashlib.blake2b(repr(shingle).encode(), digest_size=8).digest(), "big")
+            for shingle in shingle_set
+        ] or [0]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self.permutations
+        )
+
+    def _band_keys(self, scope, signature):
+        return [
+            (scope, band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, scope, prompt):
+        """
+        Returns (entry, similarity) for the closest unexpired prompt in
+        scope, or (None, 0.0).
+        """
+        query = shingles(prompt)
+        keys = self._band_keys(scope, self.signature(query))
+        now = time.monotonic()
+        best, best_similarity = None, 0.0
+        with self.lock:
+            candidates = set()
+            for key in keys:
+                candidates.update(self.buckets.get(key, ()))
+            for entry_prompt in candidates:
+                entry = self.entries[(scope, entry_prompt)]
+                if now - entry.created_at > self.ttl:
+                    self._remove((scope, entry_prompt))
+                    continue
+                similarity = jaccard(query, entry.shingles)
+                if similarity > best_similarity:
+                    best, best_similarity = entry, similarity
+            if best is not None:
+                self.entries.move_to_end((scope, best.prompt))
+        return best, best_similarity
+
+    def add(self, scope, prompt, args):
+        prompt_shingles = shingles(prompt)
+        signature = self.signature(prompt_shingles)
+        entry = SimilarSequence(prompt, prompt_shingles, signature, scope, args, time.monotonic())
+        with self.lock:
+            self._remove((scope, prompt))
+            self.entries[(scope, prompt)] = entry
+            for key in self._band_keys(scope, signature):
+                self.buckets.setdefault(key, set()).add(prompt)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, entry_key):
+        entry = self.entries.pop(entry_key, None)
+        if entry is None:
+            return
+        for key in self._band_keys(entry.scope, entry.signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry.prompt)
+                if not bucket:
+                    del self.buckets[key]
+
+
+def init_similar_sequence_index(app):
+    if app.config["SIMILAR_SEQUENCE_CACHE_ENABLED"]:
+        app.extensions["similar_sequences"] = SimilarSequenceIndex(
+            app.config["SIMILAR_SEQUENCE_MAX_ENTRIES"], app.config["SIMILAR_SEQUENCE_TTL_SECONDS"]
+        )
+
+
+def similar_sequence_cache_enabled():
+    return "similar_sequences" in current_app.extensions
+
+
+def _scope(user_id):
+    return user_id if current_app.config["SIMILAR_SEQUENCE_SCOPE"] == "user" else None
+
+
+def _too_short(prompt):
+    return len(shingles(prompt)) < current_app.config["SIMILAR_SEQUENCE_MIN_SHINGLES"]
+
+
+def find_similar_sequence(user_id, prompt, conversation):
+    """
+    Look a new-sequence request up in the similar-sequence cache, by its
+    context_key(conversation). Returns (entry, action): action is "serve"
+    when the match is close enough to answer with
+    (SIMILAR_SEQUENCE_THRESHOLD), "seed" when it is close enough to show
+    the model as a starting point (SIMILAR_SEQUENCE_SEED_THRESHOLD), else
+    entry is None and action "miss", or "skip" for a prompt with fewer
+    than SIMILAR_SEQUENCE_MIN_SHINGLES shingles.
+    """
+    index = current_app.extensions.get("similar_sequences")
+    if index is None:
+        return None, "miss"
+    if _too_short(prompt):
+        SIMILAR_SEQUENCE_LOOKUPS.labels("skip").inc()
+        annotate_request(similar_sequence="skip")
+        return None, "skip"
+    entry, similarity = index.lookup(_scope(user_id), context_key(conversation))
+    if entry is not None and similarity >= current_app.config["SIMILAR_SEQUENCE_THRESHOLD"]:
+        action = "serve"
+    elif entry is not None and similarity >= current_app.config["SIMILAR_SEQUENCE_SEED_THRESHOLD"]:
+        action = "seed"
+    else:
+        entry, action = None, "miss"
+    SIMILAR_SEQUENCE_LOOKUPS.labels(action).inc()
+    annotate_request(similar_sequence=action, similarity=round(similarity, 3))
+    return entry, action
+
+
+def remember_sequence(user_id, prompt, conversation, args):
+    """
+    Add a sequence generated for prompt in conversation
+    (performTaskInSequences arguments) to the similar-sequence cache, unless
+    the prompt is too short to be matched.
+    """
+    index = current_app.extensions.get("similar_sequences")
+    if index is None or not args.get("steps") or _too_short(prompt):
+        return
+    index.add(_scope(user_id), context_key(conversation), {"sequence_title": args.get("sequence_title", "No Title"), "steps": args["steps"]})
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import weakref
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs fn, later callers block until it finishes and share its result or
+    exception. Only calls in flight at the same time are collapsed; nothing
+    is cached afterwards.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """
+        Returns (result, shared); shared is True for callers that waited on
+        another caller's fn.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines. fn returns an awaitable; calls are collapsed
+    per event loop.
+    """
+
+    def __init__(self):
+        self.loops = weakref.WeakKeyDictionary()
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        calls = self.loops.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            # shield: a waiter that is cancelled must not cancel the leader.
+            return await asyncio.shield(future), True
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del calls[key]
+        return result, False
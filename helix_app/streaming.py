@@ -0,0 +1,86 @@
+import json
+
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Events message with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SequenceArgumentStream:
+    """
+    Incrementally scan the streamed arguments of a performTaskInSequences
+    function call.
+
+    The arguments arrive as JSON text split across arbitrary chunks. feed()
+    returns ("title", str) once sequence_title is complete and ("step", dict)
+    for every object in the steps array as soon as its closing brace
+    arrives, so steps can be shown before the whole call has finished.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.current_key = None
+        self.expecting_value = False
+        self.step_start = None
+
+    def feed(self, text):
+        events = []
+        self.buffer += text
+        while self.pos < len(self.buffer):
+            i = self.pos
+            char = self.buffer[i]
+            self.pos += 1
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        value = json.loads(self.buffer[self.string_start:i + 1])
+                        if self.expecting_value:
+                            if self.current_key == "sequence_title":
+                                events.append(("title", value))
+                            self.expecting_value = False
+                        else:
+                            self.current_key = value
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char == ":" and self.depth == 1:
+                self.expecting_value = True
+            elif char == "," and self.depth == 1:
+                self.expecting_value = False
+            elif char in "{[":
+                self.depth += 1
+                if char == "{" and self.depth == 3 and self.current_key == "steps":
+                    self.step_start = i
+            elif char in "}]":
+                if char == "}" and self.depth == 3 and self.step_start is not None:
+                    try:
+                        events.append(("step", json.loads(self.buffer[self.step_start:i + 1])))
+                    except json.JSONDecodeError:
+                        pass
+                    self.step_start = None
+                self.depth -= 1
+        return events
+
+    def arguments(self):
+        """
+        Parse the complete arguments once the stream has finished.
+        """
+        try:
+            return json.loads(self.buffer)
+        except json.JSONDecodeError:
+            return {}
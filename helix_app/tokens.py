@@ -0,0 +1,33 @@
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Per-message framing tokens the chat format adds on top of the content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print("Falling back to approximate token counts:", e)
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """
+    Count the tokens gpt-4o would see for text. Uses tiktoken when it is
+    installed and otherwise approximates with four characters per token.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
@@ -0,0 +1,158 @@
+import base64
+import json
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, select, text
+
+from .app import db
+from .models import ChatMessage, ChatMessageArchive, ConversationSummary, Sequence, SequenceStep, StepRevision, User
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Record types in foreign-key order: every record only references records
+# of an earlier type.
+RECORD_TYPES = {
+    "user": User,
+    "sequence": Sequence,
+    "step": SequenceStep,
+    "step_revision": StepRevision,
+    "message": ChatMessage,
+    "message_archive": ChatMessageArchive,
+    # Keyed by user; its through-marker refers to the message IDs above,
+    # which an import keeps.
+    "conversation_summary": ConversationSummary,
+}
+
+
+def _dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record).decode()
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def _datetime_columns(model):
+    """
+    {name: datetime or date} for the model's date and time columns.
+    """
+    return {
+        column.name: column.type.python_type
+        for column in model.__table__.columns
+        if isinstance(column.type, (db.DateTime, db.Date))
+    }
+
+
+def _binary_columns(model):
+    return {column.name for column in model.__table__.columns if isinstance(column.type, db.LargeBinary)}
+
+
+def export_records(out, batch_size=1000):
+    """
+    Write every user, sequence, step, step revision, chat message, archived
+    chat day and conversation summary to out as NDJSON, one {"type": ...,
+    <columns>} object per line, in foreign-key order. Binary columns are base64 encoded.
+    Rows are read through a server-side cursor batch_size at a time, so
+    memory use does not grow with the database. Returns a Counter of
+    records per type.
+    """
+    counts = Counter()
+    with db.engine.connect() as conn:
+        for record_type, model in RECORD_TYPES.items():
+            table = model.__table__
+            datetimes = _datetime_columns(model)
+            binaries = _binary_columns(model)
+            result = conn.execution_options(yield_per=batch_size).execute(
+                select(table).order_by(*table.primary_key.columns)
+            )
+            for row in result.mappings():
+                record = {"type": record_type}
+                for name, value in row.items():
+                    if value is not None and name in datetimes:
+                        value = value.isoformat()
+                    elif value is not None and name in binaries:
+                        value = base64.b64encode(value).decode()
+                    record[name] = value
+                out.write(_dumps(record))
+                out.write("\n")
+                counts[record_type] += 1
+    return counts
+
+
+def import_records(stream, batch_size=1000):
+    """
+    Insert the records of an export_records() NDJSON stream with one bulk
+    INSERT per type and batch, keeping their IDs. Each batch is written in
+    foreign-key order and committed, so a record may reference anything
+    earlier in the stream. Returns a Counter of records per type.
+    """
+    datetimes = {record_type: _datetime_columns(model) for record_type, model in RECORD_TYPES.items()}
+    binaries = {record_type: _binary_columns(model) for record_type, model in RECORD_TYPES.items()}
+    pending = {record_type: [] for record_type in RECORD_TYPES}
+    buffered = 0
+    counts = Counter()
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        record = _loads(line)
+        record_type = record.pop("type", None)
+        if record_type not in RECORD_TYPES:
+            raise ValueError(f"Line {line_number}: unknown record type {record_type!r}.")
+        for name, python_type in datetimes[record_type].items():
+            if record.get(name):
+                record[name] = python_type.fromisoformat(record[name])
+        for name in binaries[record_type]:
+            if record.get(name) is not None:
+                record[name] = base64.b64decode(record[name])
+        pending[record_type].append(record)
+        buffered += 1
+        if buffered >= batch_size:
+            _flush(pending, counts)
+            buffered = 0
+
+    _flush(pending, counts)
+    _reset_id_sequences()
+    return counts
+
+
+def _flush(pending, counts):
+    for record_type, model in RECORD_TYPES.items():
+        rows = pending[record_type]
+        if rows and model is ConversationSummary:
+            # A user has one summary; the imported one replaces any already
+            # there, so it stays linked to the imported messages.
+            db.session.execute(
+                delete(ConversationSummary).where(ConversationSummary.user_id.in_([row["user_id"] for row in rows]))
+            )
+        if rows:
+            db.session.execute(insert(model), rows)
+            counts[record_type] += len(rows)
+            pending[record_type] = []
+    db.session.commit()
+
+
+def _reset_id_sequences():
+    """
+    Imported rows keep their IDs, which bypasses PostgreSQL's ID sequences;
+    move them past the highest imported ID. SQLite needs nothing.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in (Sequence, SequenceStep, StepRevision, ChatMessage, ChatMessageArchive):
+        table = model.__tablename__
+        max_id = db.session.execute(select(func.max(model.id))).scalar()
+        if max_id:
+            db.session.execute(
+                text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :max_id)"),
+                {"table": table, "max_id": max_id}
+            )
+    db.session.commit()
@@ -1,11 +1,11 @@
-import os
 import re
 import json
-import openai
-from .models import ChatMessage
+from flask import current_app, has_app_context
 from .app import db
+from .llm import chat_completion, chat_completion_async
+from .metrics import span
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+DEFAULT_INTENT_CONFIDENCE_THRESHOLD = 0.85
 
 SYSTEM_PROMPT = (
     "You are Helix, an AI assistant that generates fully personalized and actionable multi-step sequences "
@@ -45,19 +45,197 @@ function_definitions = [
 ]
 
 
-def load_db_conversation(user_id):
+add_step_function = {
+    "name": "addStepToSequence",
+    "description": (
+        "Add one new step to the user's current sequence without changing existing steps, at the end unless "
+        "the user asks for another place. Match the style of the existing steps."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "step_number": {
+                "type": "integer",
+                "description": "The number the new step should have, when it goes before an existing step."
+            },
+            "step_title": {"type": "string"},
+            "step_content": {"type": "string"}
+        },
+        "required": ["step_title", "step_content"]
+    }
+}
+
+edit_step_function = {
+    "name": "editStepInSequence",
+    "description": (
+        "Rewrite exactly one existing step of the user's current sequence. "
+        "Keep the current title unless the topic changes, and do not modify any other step."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "step_number": {"type": "integer"},
+            "step_title": {"type": "string"},
+            "step_content": {"type": "string"}
+        },
+        "required": ["step_number", "step_title", "step_content"]
+    }
+}
+
+single_call_function_definitions = function_definitions + [add_step_function, edit_step_function]
+
+SINGLE_CALL_FUNCTION_INTENTS = {
+    "performTaskInSequences": "new_sequence",
+    "addStepToSequence": "add_step",
+    "editStepInSequence": "edit_step",
+}
+
+
+def load_db_conversation(user_id, pending_messages=()):
     """
     Load conversation history from the DB and prepend the system prompt.
     Map 'ai' messages to 'assistant' for OpenAI context.
+
+    Only the most recent turns that fit in CONVERSATION_TOKEN_BUDGET are
+    included; older turns are represented by a running summary. Messages
+    in pending_messages have not been stored yet and are appended last.
+    """
+    from .conversation import build_conversation_window
+    return build_conversation_window(user_id, SYSTEM_PROMPT, pending_messages)
+
+
+def build_single_call_messages(existing_steps, conversation):
+    """
+    Build the conversation for single-call mode: the current sequence (if
+    any) is added as a second system message after the system prompt of
+    conversation, the output of load_db_conversation. The model picks one
+    of single_call_function_definitions, which decides the intent.
+    """
+    messages = list(conversation)
+    if existing_steps:
+        context_str = "\n".join([
+            f"Step {s.step_number}: {s.title} - {s.content}"
+            for s in existing_steps
+        ])
+        instructions = (
+            "The user's current sequence is:\n" + context_str + "\n"
+            "Call addStepToSequence to add a step, editStepInSequence to change one existing step, "
+            "or performTaskInSequences to replace it with a new sequence."
+        )
+    else:
+        instructions = "The user has no sequence yet. Call performTaskInSequences to create one."
+    messages.insert(1, {"role": "system", "content": instructions})
+    return messages
+
+
+def build_seeded_sequence_messages(conversation, args):
+    """
+    Add a sequence generated for a similar earlier request to conversation
+    (the output of load_db_conversation) as a starting point for the new
+    one. args are that sequence's performTaskInSequences arguments.
     """
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    chats = ChatMessage.query.filter_by(user_id=user_id).order_by(ChatMessage.created_at).all()
-    for msg in chats:
-        role = "assistant" if msg.sender == "ai" else "user"
-        messages.append({"role": role, "content": msg.message})
+    messages = list(conversation)
+    title = args.get("sequence_title", "")
+    steps = args.get("steps", [])
+    steps_text = "\n".join(
+        f"Step {i}: {step.get('step_title', '')} - {step.get('step_content', '')}"
+        for i, step in enumerate(steps, start=1)
+    )
+    messages.insert(1, {"role": "system", "content": (
+        f"A very similar request was answered with the sequence \"{title}\":\n" + steps_text + "\n"
+        "Use it as a starting point and adapt it to what the user is asking for now."
+    )})
     return messages
 
 
+def build_add_step_messages(existing_steps, user_input):
+    steps_text = "\n".join([f"{s.title} - {s.content}" for s in existing_steps])
+    prompt = (
+        "You are Helix, an AI assistant that adds a new step to an existing sequence. "
+        "Do not modify any existing steps. The current sequence is:\n"
+        + steps_text +
+        "\nBased on the following user request, generate one new step as a JSON object with keys 'step_title' and 'step_content'. "
+        "Ensure the style matches the existing steps. Do not change any other step."
+    )
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": user_input},
+    ]
+
+
+def parse_added_step(ai_output):
+    """
+    Parse the add-step reply into a dict with 'step_title' and 'step_content',
+    tolerating a ```json fence or a plain-text answer.
+    """
+    ai_output = ai_output.strip()
+    if ai_output.startswith("```json"):
+        ai_output = ai_output[len("```json"):].strip()
+    if ai_output.endswith("```"):
+        ai_output = ai_output[:-3].strip()
+
+    try:
+        return json.loads(ai_output)
+    except json.JSONDecodeError:
+        return {"step_title": ai_output, "step_content": ai_output}
+
+
+def build_edit_step_messages(existing_steps, target_step, user_input):
+    context_str = "\n".join([
+        f"Step {s.step_number}: {s.title} - {s.content}"
+        for s in existing_steps
+    ])
+    prompt = (
+        f"You are Helix, a friendly AI assistant. The current sequence is:\n{context_str}\n"
+        f"Your task is to update only the content of step {target_step.step_number} (currently titled '{target_step.title}') "
+        "so that it fits naturally with the rest of the sequence in a warm, human tone. "
+        f"Incorporate the following user request into the revised content: {user_input}\n"
+        "Return only the final revised version of the step content as a single paragraph without any step number, title, or markdown formatting. "
+        "If a new title is warranted due to a topic shift, output the new title on the first line (without markdown symbols), "
+        "followed by the revised content on the next line. Do not modify any other step."
+    )
+    return [{"role": "system", "content": prompt}]
+
+
+def parse_edited_step(ai_response, target_step):
+    """
+    Split the edit-step reply into (title, content). A first line that
+    differs from the current title is taken as the new title, and a
+    repeated title at the start of the content is stripped.
+    """
+    if "\n" in ai_response:
+        parts = ai_response.split("\n", 1)
+        proposed_title = parts[0].strip()
+        proposed_content = parts[1].strip()
+
+        new_title = (
+            proposed_title if proposed_title.lower() != target_step.title.lower()
+            else target_step.title
+        )
+        final_revision = proposed_content
+    else:
+        new_title = target_step.title
+        final_revision = ai_response
+
+    pattern = r"^" + re.escape(target_step.title) + r"[\s:\-]*"
+    final_revision = re.sub(pattern, "", final_revision).strip()
+    return new_title, final_revision
+
+
+STEP_ORDINALS = {
+    "first": 1,
+    "second": 2,
+    "third": 3,
+    "fourth": 4,
+    "fifth": 5,
+    "sixth": 6,
+    "seventh": 7,
+    "eighth": 8,
+    "ninth": 9,
+    "tenth": 10
+}
+
+
 def extract_step_number(user_input):
     """
     Extract a step number from the user input, supporting:
@@ -81,31 +259,205 @@ def extract_step_number(user_input):
     ordinal_pattern = r"(first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth)"
     match = re.search(r"(?:the\s+)?(" + ordinal_pattern + r")\s+step", lower_input)
     if match:
-        ordinals = {
-            "first": 1,
-            "second": 2,
-            "third": 3,
-            "fourth": 4,
-            "fifth": 5,
-            "sixth": 6,
-            "seventh": 7,
-            "eighth": 8,
-            "ninth": 9,
-            "tenth": 10
-        }
-        return ordinals.get(match.group(1))
+        return STEP_ORDINALS.get(match.group(1))
+    return None
+
+
+_STEP_WORD = r"(?:" + "|".join(STEP_ORDINALS) + r"|last|final)"
+_STEP_SEPARATOR = r"\s*(?:,|&|\band\b|\bor\b|-|–|\bto\b|\bthrough\b|\bthru\b)\s*(?:the\s+)?"
+# A number that is a step, not a length ("step 2 to 5 sentences").
+_STEP_DIGITS = r"\d+(?!\s*(?:sentences?|words?|lines?|paragraphs?|bullets?|points?|characters?|chars?|%))"
+# "steps 2, 3 and the last", "steps 2-4" / "the second and last steps"
+_STEP_LIST_AFTER = re.compile(
+    r"\bsteps?\s+((?:" + _STEP_DIGITS + "|" + _STEP_WORD + r")"
+    r"(?:" + _STEP_SEPARATOR + r"(?:" + _STEP_DIGITS + "|" + _STEP_WORD + r"))*)\b"
+)
+_STEP_LIST_BEFORE = re.compile(
+    r"\b(" + _STEP_WORD + r"(?:" + _STEP_SEPARATOR + _STEP_WORD + r")*)\s+steps?\b"
+)
+_STEP_ALL = re.compile(r"\b(?:all|every|each)\s+(?:of\s+)?(?:the\s+)?steps?\b")
+_STEP_FIRST_LAST_N = re.compile(r"\b(first|last)\s+(\d+|two|three|four|five)\s+steps\b")
+_COUNT_WORDS = {"two": 2, "three": 3, "four": 4, "five": 5}
+
+
+def _step_list_numbers(text, last_step_number):
+    """
+    Step numbers in a list such as "2, 3 and the last" or "2-4". A range
+    ends at last_step_number at the latest; a reversed range adds nothing
+    past its start.
+    """
+    numbers = []
+    in_range = False
+    for token in re.findall(r"\d+|[a-z]+|[-–]", text):
+        if token in ("-", "–", "to", "through", "thru"):
+            in_range = True
+            continue
+        if token.isdigit():
+            value = int(token)
+        elif token in ("last", "final"):
+            value = last_step_number
+        else:
+            value = STEP_ORDINALS.get(token)
+        if value is None:
+            continue
+        if in_range and numbers:
+            numbers.extend(range(numbers[-1] + 1, min(value, last_step_number) + 1))
+        else:
+            numbers.append(value)
+        in_range = False
+    return numbers
+
+
+def extract_step_numbers(user_input, last_step_number):
+    """
+    Extract every step an edit request refers to, as a sorted list of step
+    numbers (empty if none), supporting:
+      - Everything extract_step_number understands
+      - Lists and ranges: "steps 2, 3 and 4", "steps 2-4", "step 1 to 3"
+      - Ordinal lists: "the second and last steps"
+      - "all steps", "every step", "the first 2 steps", "the last three steps"
+    last_step_number resolves "last" and "all", and bounds ranges and
+    counts, so "steps 1-30000000" costs no more than "all steps".
+    """
+    lower_input = user_input.lower()
+
+    if _STEP_ALL.search(lower_input):
+        return list(range(1, last_step_number + 1))
+
+    numbers = set()
+    match = _STEP_FIRST_LAST_N.search(lower_input)
+    if match:
+        count = min(_COUNT_WORDS.get(match.group(2)) or int(match.group(2)), last_step_number)
+        if match.group(1) == "first":
+            numbers.update(range(1, count + 1))
+        else:
+            numbers.update(range(last_step_number - count + 1, last_step_number + 1))
+
+    for pattern in (_STEP_LIST_AFTER, _STEP_LIST_BEFORE):
+        for match in pattern.finditer(lower_input):
+            numbers.update(_step_list_numbers(match.group(1), last_step_number))
+
+    if not numbers:
+        single = extract_step_number(user_input)
+        numbers.add(last_step_number if single == "last" else single)
+    return sorted(n for n in numbers if n and n > 0)
+
+
+_INSERT_REF = r"(\d+|" + "|".join(STEP_ORDINALS) + r"|last|final)"
+_INSERT_BETWEEN = re.compile(
+    r"\bbetween\s+(?:the\s+)?(?:steps?\s+)?" + _INSERT_REF + r"(?:\s+steps?)?\s+(?:and|&)\s+(?:the\s+)?(?:steps?\s+)?"
+    + _INSERT_REF + r"\b"
+)
+_INSERT_RELATIVE = re.compile(
+    r"\b(after|before)\s+(?:the\s+)?(?:steps?\s+" + _INSERT_REF + r"\b|" + _INSERT_REF + r"\s+(?:step|one|email)\b)"
+)
+_INSERT_AS = re.compile(r"\bas\s+(?:the\s+)?(?:new\s+)?(?:steps?\s+(\d+)\b|(" + "|".join(STEP_ORDINALS) + r")\s+step\b)")
+_INSERT_START = re.compile(r"\b(?:at|to)\s+the\s+(?:very\s+)?(?:start|beginning|top)\b")
+
+
+def extract_insert_position(user_input, last_step_number):
+    """
+    The step number an add-step request wants the new step to have, or None
+    to append it:
+      - "between steps 2 and 3", "after step 2", "before the third step"
+      - "as step 2", "as the first step", "at the beginning"
+    last_step_number resolves "last"; "after the last step" appends.
+    """
+    lower_input = user_input.lower()
+
+    def number(token):
+        if token in ("last", "final"):
+            return last_step_number
+        return int(token) if token.isdigit() else STEP_ORDINALS[token]
+
+    match = _INSERT_BETWEEN.search(lower_input)
+    if match:
+        return min(number(match.group(1)), number(match.group(2))) + 1
+
+    match = _INSERT_RELATIVE.search(lower_input)
+    if match:
+        reference = number(match.group(2) or match.group(3))
+        if match.group(1) == "before":
+            return reference
+        return None if reference >= last_step_number else reference + 1
+
+    match = _INSERT_AS.search(lower_input)
+    if match:
+        return int(match.group(1)) if match.group(1) else STEP_ORDINALS[match.group(2)]
+
+    if _INSERT_START.search(lower_input):
+        return 1
     return None
 
 
 def classify_intent(user_input):
     """
-    Use GPT to classify the user's intent based on natural phrasing.
+    Classify the user's intent based on natural phrasing.
 
     Possible outputs:
       - "add_step"
       - "edit_step"
       - "new_sequence"
     """
+    intent, _confidence, _source = classify_intent_with_confidence(user_input)
+    return intent
+
+
+def classify_intent_with_confidence(user_input, threshold=None):
+    """
+    Try the local classifier first and only ask GPT when its confidence is
+    below INTENT_CONFIDENCE_THRESHOLD.
+
+    Returns a tuple of (intent, confidence, source) where source is
+    "local" or "llm". GPT answers carry no confidence score (None).
+    """
+    with span("classify") as attrs:
+        result = _classify_locally(user_input, threshold)
+        if not result:
+            result = _record_llm_intent(classify_intent_llm(user_input))
+        attrs["source"] = result[2]
+    return result
+
+
+async def classify_intent_with_confidence_async(user_input, threshold=None):
+    """
+    Same as classify_intent_with_confidence, using the async OpenAI client
+    for the fallback call.
+    """
+    with span("classify") as attrs:
+        result = _classify_locally(user_input, threshold)
+        if not result:
+            result = _record_llm_intent(await classify_intent_llm_async(user_input))
+        attrs["source"] = result[2]
+    return result
+
+
+def _classify_locally(user_input, threshold):
+    from .intent import local_classify, record_classification
+
+    if threshold is None:
+        threshold = DEFAULT_INTENT_CONFIDENCE_THRESHOLD
+        if has_app_context():
+            threshold = current_app.config.get("INTENT_CONFIDENCE_THRESHOLD", threshold)
+
+    intent, confidence = local_classify(user_input)
+    if confidence >= threshold:
+        record_classification("local")
+        return intent, confidence, "local"
+    return None
+
+
+def _record_llm_intent(llm_intent):
+    from .intent import record_classification
+
+    if llm_intent is None:
+        record_classification("llm_error")
+        return "new_sequence", None, "llm"
+    record_classification("llm")
+    return llm_intent, None, "llm"
+
+
+def build_classification_messages(user_input):
     prompt = (
         "Based on the following user request, classify the intent into one of three categories: "
         "'add_step', 'edit_step', or 'new_sequence'.\n\n"
@@ -116,15 +468,43 @@ def classify_intent(user_input):
         f"User request: {user_input}\n\n"
         "Output only one word: add_step, edit_step, or new_sequence."
     )
+    return [{"role": "system", "content": prompt}]
+
+
+def parse_classification(response):
+    intent = response.choices[0].message.content.strip().lower()
+    if intent in ["add_step", "edit_step", "new_sequence"]:
+        return intent
+    return None
+
+
+def classify_intent_llm(user_input):
+    """
+    Use GPT to classify the user's intent. Returns None if the call fails
+    or the answer is not one of the known intents.
+    """
+    try:
+        response = chat_completion(
+            "classify",
+            model="gpt-4o",
+            messages=build_classification_messages(user_input),
+            temperature=0
+        )
+        return parse_classification(response)
+    except Exception as e:
+        print("Classification error:", e)
+    return None
+
+
+async def classify_intent_llm_async(user_input):
     try:
-        response = openai.chat.completions.create(
+        response = await chat_completion_async(
+            "classify",
             model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}],
+            messages=build_classification_messages(user_input),
             temperature=0
         )
-        intent = response.choices[0].message.content.strip().lower()
-        if intent in ["add_step", "edit_step", "new_sequence"]:
-            return intent
+        return parse_classification(response)
     except Exception as e:
         print("Classification error:", e)
-    return "new_sequence"
+    return None
@@ -1,6 +1,19 @@
+import argparse
 import datetime
+from sqlalchemy import func, insert
 from helix_app.app import create_app, db
 from helix_app.models import User, Sequence, SequenceStep, ChatMessage
+from helix_app.ranks import initial_ranks
+
+SYNTHETIC_USER_PREFIX = "synthetic_user_"
+SYNTHETIC_MESSAGES = [
+    ("user", "Write a recruiting sequence for senior backend engineers at fintech startups."),
+    ("ai", "Here's your sequence. See the Sequence panel."),
+    ("user", "Make step 2 shorter and more casual."),
+    ("ai", "Step 2 updated."),
+    ("user", "Add a step that mentions our remote-first culture."),
+    ("ai", "New step added to the sequence."),
+]
 
 def seed_data():
     app = create_app()
@@ -25,14 +38,14 @@ def seed_data():
         
         step1 = SequenceStep(
             sequence_id=dummy_sequence.id,
-            step_number=1,
+            position=initial_ranks(2)[0],
             title="Intro Step",
             content="Hey {{First_Name}}, welcome to our dummy sequence!",
             created_at=datetime.datetime.utcnow()
         )
         step2 = SequenceStep(
             sequence_id=dummy_sequence.id,
-            step_number=2,
+            position=initial_ranks(2)[1],
             title="Follow-Up Step",
             content="Here's more information about our dummy data.",
             created_at=datetime.datetime.utcnow()
@@ -52,5 +65,70 @@ def seed_data():
 
         print("Dummy data inserted successfully!")
 
+def seed_synthetic_data(users, messages_per_user, steps_per_sequence=3, app=None, batch_size=5000):
+    """
+    Bulk insert users synthetic_user_0..users-1, each with one sequence of
+    steps_per_sequence steps and messages_per_user chat messages one minute
+    apart. Used to load test at realistic table sizes.
+
+    Returns a list of (user_id, sequence_id).
+    """
+    app = app or create_app()
+    with app.app_context():
+        now = datetime.datetime.utcnow()
+        first_sequence_id = (db.session.query(func.max(Sequence.id)).scalar() or 0) + 1
+        seeded = [(f"{SYNTHETIC_USER_PREFIX}{i}", first_sequence_id + i) for i in range(users)]
+
+        def insert_in_batches(model, rows):
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    db.session.execute(insert(model), batch)
+                    batch = []
+            if batch:
+                db.session.execute(insert(model), batch)
+
+        insert_in_batches(User, ({"id": user_id, "created_at": now} for user_id, _ in seeded))
+        insert_in_batches(Sequence, (
+            {"id": sequence_id, "user_id": user_id, "title": "Synthetic Sequence", "created_at": now}
+            for user_id, sequence_id in seeded
+        ))
+        positions = initial_ranks(steps_per_sequence)
+        insert_in_batches(SequenceStep, (
+            {
+                "sequence_id": sequence_id,
+                "position": position,
+                "title": f"Step {n}",
+                "content": f"Hi {{{{First_Name}}}}, this is synthetic step {n}."
+            }
+            for _, sequence_id in seeded
+            for n, position in enumerate(positions, start=1)
+        ))
+        insert_in_batches(ChatMessage, (
+            {
+                "user_id": user_id,
+                "sender": SYNTHETIC_MESSAGES[n % len(SYNTHETIC_MESSAGES)][0],
+                "message": SYNTHETIC_MESSAGES[n % len(SYNTHETIC_MESSAGES)][1],
+                "created_at": now - datetime.timedelta(minutes=messages_per_user - n)
+            }
+            for user_id, _ in seeded
+            for n in range(messages_per_user)
+        ))
+        db.session.commit()
+
+        print(f"Seeded {users} synthetic users with {messages_per_user} messages each.")
+        return seeded
+
+
 if __name__ == "__main__":
-    seed_data()
+    parser = argparse.ArgumentParser(description="Insert dummy or synthetic data.")
+    parser.add_argument("--users", type=int, help="seed this many synthetic users instead of the dummy user")
+    parser.add_argument("--messages", type=int, default=50, help="chat messages per synthetic user")
+    parser.add_argument("--steps", type=int, default=3, help="steps per synthetic sequence")
+    args = parser.parse_args()
+
+    if args.users:
+        seed_synthetic_data(args.users, args.messages, args.steps)
+    else:
+        seed_data()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from helix_app import asgi
+from helix_app.app import create_app
+
+SEQUENCE = {
+    "sequence_title": "Outreach",
+    "steps": [{"step_title": f"Step {i}", "step_content": f"Hey {{{{First_Name}}}}, note {i}."} for i in (1, 2, 3)],
+}
+ADDED_STEP = {"step_title": "Pricing", "step_content": "Our pricing is simple."}
+
+
+def _completion(content=None, function=None, arguments=None):
+    function_call = SimpleNamespace(name=function, arguments=json.dumps(arguments)) if function else None
+    message = SimpleNamespace(content=content, function_call=function_call)
+    finish_reason = "function_call" if function else "stop"
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=None)
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    """
+    post(message) against the ASGI app with a fake model. during_add_step,
+    when set, is awaited while the add-step reply is being generated.
+    """
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    app = create_app({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'asgi.db'}",
+        "REQUEST_LOG_ENABLED": False,
+        "INTENT_CONFIDENCE_THRESHOLD": 0,
+    })
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.create_asgi_app(app)), base_url="http://test")
+    hooks = SimpleNamespace(during_add_step=None, client=client)
+
+    async def fake_completion(call_type, **kwargs):
+        if call_type == "add_step":
+            if hooks.during_add_step:
+                await hooks.during_add_step()
+            return _completion("```json\n" + json.dumps(ADDED_STEP) + "\n```")
+        return _completion(function="performTaskInSequences", arguments=SEQUENCE)
+
+    monkeypatch.setattr(asgi, "chat_completion_async", fake_completion)
+
+    async def post(message):
+        return await client.post("/api/chat", json={"user_id": "u", "message": message})
+
+    hooks.post = post
+    return hooks
+
+
+def test_add_step_conflicts_with_a_change_made_during_generation(chat):
+    async def run():
+        created = (await chat.post("Write a sales sequence for CFOs at logistics companies")).json()
+
+        async def edit_step_meanwhile():
+            chat.during_add_step = None
+            response = await chat.client.put("/api/sequence/update", json={
+                "sequenceId": created["sequenceId"], "stepNumber": 1, "field": "stepContent", "value": "Edited.",
+            })
+            assert response.status_code == 200
+
+        chat.during_add_step = edit_step_meanwhile
+        conflict = await chat.post("Add another step about our pricing")
+        retried = await chat.post("Add another step about our pricing")
+        return created, conflict, retried
+
+    created, conflict, retried = asyncio.run(run())
+    assert len(created["sequence"]) == 3
+    assert conflict.status_code == 409
+    assert retried.status_code == 200
+    sequence = retried.json()["sequence"]
+    assert [step["stepTitle"] for step in sequence] == ["Step 1", "Step 2", "Step 3", "Pricing"]
+    assert sequence[0]["stepContent"] == "Edited."
@@ -0,0 +1,59 @@
+import threading
+
+from helix_app.cache import _MISSING, ActiveSequenceCache, SequenceSnapshot, StepSnapshot
+
+
+def _snapshot(sequence_id=1, version=1):
+    steps = [StepSnapshot(i, f"Step {i}", f"Content {i}", 10 + i, chr(64 + i)) for i in (1, 2, 3)]
+    return SequenceSnapshot(sequence_id, "Outreach", steps, version)
+
+
+def test_patch_step_updates_the_cached_sequence():
+    cache = ActiveSequenceCache(10, 1 << 20)
+    cache.set("u", _snapshot())
+    cache.patch_step(1, 12, 2, content="Edited")
+    snapshot = cache.get("u")
+    assert snapshot.version == 2
+    assert [s.content for s in snapshot.steps] == ["Content 1", "Edited", "Content 3"]
+    assert cache.total_bytes == snapshot.size()
+
+
+def test_patch_step_does_not_restore_an_invalidated_entry():
+    cache = ActiveSequenceCache(10, 1 << 20)
+    cache.set("u", _snapshot())
+    cache.invalidate("u")
+    cache.patch_step(1, 12, 2, content="Edited")
+    assert cache.get("u") is _MISSING
+    assert cache.total_bytes == 0
+
+
+def test_patch_step_leaves_a_replaced_sequence_alone():
+    cache = ActiveSequenceCache(10, 1 << 20)
+    cache.set("u", _snapshot())
+    cache.set("u", _snapshot(sequence_id=2))
+    cache.patch_step(1, 12, 2, content="Edited")
+    snapshot = cache.get("u")
+    assert (snapshot.id, snapshot.version) == (2, 1)
+    assert snapshot.steps[1].content == "Content 2"
+
+
+def test_concurrent_patches_and_invalidations_keep_accounting_consistent():
+    cache = ActiveSequenceCache(10, 1 << 20)
+
+    def patch():
+        for version in range(2, 500):
+            cache.patch_step(1, 12, version, content=f"Edit {version}")
+
+    def reset():
+        for _ in range(500):
+            cache.set("u", _snapshot())
+            cache.invalidate("u")
+
+    threads = [threading.Thread(target=patch), threading.Thread(target=reset)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.get("u") is _MISSING
+    assert cache.total_bytes == 0
+    assert cache.sequence_owners == {}
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from helix_app import chat_archive
+from helix_app.app import create_app, db
+from helix_app.chat_archive import archived_messages_since, compact_user_history, load_archived_page, unpack_messages
+from helix_app.models import ChatMessage, ChatMessageArchive, ConversationSummary, User
+
+START = datetime(2024, 3, 1, 9)
+SUMMARIZED_THROUGH = 15
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    20 messages, two a day, of which the first 15 are in the user's
+    conversation summary.
+    """
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(chat_archive, "FETCH_BATCH_DAYS", 2)
+    app = create_app({"DATABASE_URL": f"sqlite:///{tmp_path / 'archive.db'}", "REQUEST_LOG_ENABLED": False})
+    with app.app_context():
+        db.session.add(User(id="u"))
+        db.session.add_all(
+            ChatMessage(
+                id=i, user_id="u", sender="user" if i % 2 else "ai", message=f"message {i}",
+                created_at=START + timedelta(days=(i - 1) // 2, minutes=i),
+            )
+            for i in range(1, 21)
+        )
+        db.session.flush()
+        db.session.add(ConversationSummary(
+            user_id="u", summary="Earlier turns.", token_count=3,
+            summarized_through_at=db.session.get(ChatMessage, SUMMARIZED_THROUGH).created_at,
+            summarized_through_id=SUMMARIZED_THROUGH,
+        ))
+        db.session.commit()
+        yield app
+
+
+def _archived_ids():
+    rows = db.session.execute(select(ChatMessageArchive).order_by(ChatMessageArchive.day)).scalars().all()
+    return [[msg.id for msg in unpack_messages(row.codec, row.data)] for row in rows]
+
+
+def test_compaction_moves_only_summarized_messages(app):
+    assert compact_user_history("u", None, keep=3, batch_size=4) == SUMMARIZED_THROUGH
+    hot = db.session.execute(select(ChatMessage.id).order_by(ChatMessage.id)).scalars().all()
+    assert hot == list(range(16, 21))
+    assert _archived_ids() == [[i, i + 1] for i in range(1, 15, 2)] + [[15]]
+
+    archived = load_archived_page("u", None, 100)[0]
+    assert [(msg.sender, msg.message) for msg in archived] == [
+        ("user" if i % 2 else "ai", f"message {i}") for i in range(1, 16)
+    ]
+    assert compact_user_history("u", None, keep=3, batch_size=4) == 0
+
+
+def test_cutoff_and_keep_limit_what_is_moved(app):
+    assert compact_user_history("u", START + timedelta(days=2), keep=0) == 4
+    assert compact_user_history("u", None, keep=12) == 4
+    assert _archived_ids() == [[1, 2], [3, 4], [5, 6], [7, 8]]
+
+
+def test_archived_pages_continue_the_hot_history(app):
+    compact_user_history("u", None, keep=3)
+    client = app.test_client()
+    seen, before = [], None
+    while True:
+        params = {"user_id": "u", "include": "chat", "include_archived": "true", "limit": 4}
+        if before:
+            params["before"] = before
+        page = client.get("/api/load", query_string=params).get_json()
+        seen = [msg["id"] for msg in page["chat_history"] if "id" in msg] + seen
+        if not page["has_more"]:
+            break
+        before = page["next_before"]
+    assert seen == list(range(1, 21))
+
+
+def test_archived_messages_since(app):
+    compact_user_history("u", None, keep=3)
+    assert [msg.id for msg in archived_messages_since("u", 5, 4)] == [6, 7, 8, 9]
+    assert [msg.id for msg in archived_messages_since("u", 5, 100)] == list(range(6, 16))
+    assert archived_messages_since("u", 15, 100) == []
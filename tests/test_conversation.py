@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert
+
+from helix_app import conversation
+from helix_app.app import create_app, db
+from helix_app.conversation import build_conversation_window
+from helix_app.models import ChatMessage, ConversationSummary, User
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(conversation, "chat_completion", lambda call_type, **kwargs: SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="The user sells to CFOs."))]
+    ))
+    app = create_app({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'conversation.db'}",
+        "REQUEST_LOG_ENABLED": False,
+        "CONVERSATION_TOKEN_BUDGET": 300,
+    })
+    with app.app_context():
+        started = datetime(2024, 1, 1)
+        db.session.add(User(id="u"))
+        db.session.add_all(
+            ChatMessage(user_id="u", sender="user" if i % 2 else "ai", message=f"Message {i} " + "word " * 30,
+                        created_at=started + timedelta(minutes=i))
+            for i in range(20)
+        )
+        db.session.commit()
+        yield app
+
+
+def test_window_folds_old_messages_into_a_new_summary(app):
+    messages = build_conversation_window("u", "System prompt.")
+    db.session.commit()
+
+    assert messages[1]["content"].endswith("The user sells to CFOs.")
+    assert messages[-1]["content"].startswith("Message 19 ")
+    summary = db.session.get(ConversationSummary, "u")
+    assert summary.summary == "The user sells to CFOs."
+    assert summary.summarized_through_id is not None
+
+
+def test_first_summary_tolerates_a_concurrent_insert(app):
+    build_conversation_window("u", "System prompt.")
+    # Another chat of the same user commits its first summary meanwhile.
+    with db.engine.begin() as conn:
+        conn.execute(insert(ConversationSummary).values(user_id="u", summary="Other", token_count=1))
+    db.session.commit()
+
+    db.session.expire_all()
+    assert db.session.get(ConversationSummary, "u").summary == "The user sells to CFOs."
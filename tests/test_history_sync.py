@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from helix_app.app import create_app, db
+from helix_app.chat_archive import pack_messages
+from helix_app.models import ChatMessage, ChatMessageArchive, User
+
+LONG_AGO = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    app = create_app({"DATABASE_URL": f"sqlite:///{tmp_path / 'sync.db'}", "REQUEST_LOG_ENABLED": False})
+    with app.app_context():
+        db.session.add(User(id="u"))
+        db.session.add_all(
+            ChatMessage(id=10 + i, user_id="u", sender="user", message=f"old {i}", created_at=LONG_AGO + timedelta(minutes=i))
+            for i in range(3)
+        )
+        db.session.commit()
+        yield app.test_client()
+
+
+def _add(*messages):
+    db.session.add_all(ChatMessage(user_id="u", sender="ai", **message) for message in messages)
+    db.session.commit()
+
+
+def _load(client, **params):
+    return client.get("/api/load", query_string={"user_id": "u", "include": "chat", **params})
+
+
+def test_etag_revalidation(client):
+    first = _load(client)
+    assert _load(client, limit=5).headers["ETag"] != first.headers["ETag"]
+    assert client.get(
+        "/api/load", query_string={"user_id": "u", "include": "chat"}, headers={"If-None-Match": first.headers["ETag"]}
+    ).status_code == 304
+
+    _add({"message": "new"})
+    assert client.get(
+        "/api/load", query_string={"user_id": "u", "include": "chat"}, headers={"If-None-Match": first.headers["ETag"]}
+    ).status_code == 200
+
+
+def test_since_returns_newer_messages_in_pages(client):
+    token = _load(client).get_json()["sync_token"]
+    _add(*({"id": 20 + i, "message": f"new {i}", "created_at": LONG_AGO + timedelta(hours=1, minutes=i)} for i in range(3)))
+
+    page = _load(client, since=token, limit=2).get_json()
+    assert [msg["id"] for msg in page["chat_history"]] == [20, 21]
+    assert page["has_more"]
+    page = _load(client, since=page["sync_token"], limit=2).get_json()
+    assert [msg["id"] for msg in page["chat_history"]] == [22]
+    assert not page["has_more"]
+    assert _load(client, since=page["sync_token"]).get_json()["chat_history"] == []
+
+
+def test_since_repeats_a_lower_id_committed_after_the_token(client):
+    token = _load(client).get_json()["sync_token"]
+    # A request that took ID 5 before the token was issued commits after it.
+    _add({"id": 5, "message": "late", "created_at": datetime.utcnow() - timedelta(seconds=30)})
+
+    delta = _load(client, since=token).get_json()
+    assert [msg["id"] for msg in delta["chat_history"]] == [5]
+
+
+def test_since_reads_messages_archived_after_the_token(client):
+    token = _load(client).get_json()["sync_token"]
+    _add(*({"id": 20 + i, "message": f"new {i}", "created_at": LONG_AGO + timedelta(hours=1, minutes=i)} for i in range(2)))
+    archived = ChatMessage.query.filter(ChatMessage.id.in_([20, 21])).order_by(ChatMessage.id).all()
+    codec, data = pack_messages(archived)
+    db.session.add(ChatMessageArchive(
+        user_id="u", day=LONG_AGO.date(), first_message_id=20, last_message_id=21, message_count=2, codec=codec, data=data
+    ))
+    for msg in archived:
+        db.session.delete(msg)
+    _add({"id": 22, "message": "hot", "created_at": LONG_AGO + timedelta(hours=2)})
+
+    delta = _load(client, since=token).get_json()
+    assert [(msg["id"], msg["message"]) for msg in delta["chat_history"]] == [(20, "new 0"), (21, "new 1"), (22, "hot")]
@@ -0,0 +1,26 @@
+import json
+from datetime import datetime
+
+from flask import Flask
+
+from helix_app.json_provider import OrjsonProvider
+
+
+def _provider():
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    return app.json
+
+
+def test_matches_the_default_provider_data():
+    provider = _provider()
+    data = {"b": 1, "a": [1.5, "é"], 3: None, "when": datetime(2020, 1, 1)}
+    encoded = provider.dumps(data)
+    assert json.loads(encoded) == {"3": None, "a": [1.5, "é"], "b": 1, "when": "Wed, 01 Jan 2020 00:00:00 GMT"}
+    assert list(json.loads(encoded)) == ["3", "a", "b", "when"]
+
+
+def test_falls_back_for_what_orjson_rejects():
+    provider = _provider()
+    assert provider.loads(provider.dumps({"x": 2 ** 70})) == {"x": 2 ** 70}
+    assert provider.loads('{"a": 1}') == {"a": 1}
@@ -0,0 +1,84 @@
+import time
+
+import httpx
+import openai
+import pytest
+
+from helix_app import llm
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    Results for the fake OpenAI call, consumed in order: an exception is
+    raised, anything else is returned. The attempts made are recorded.
+    """
+    llm.configure_llm({
+        "OPENAI_MAX_RETRIES": 2,
+        "OPENAI_RETRY_BASE_DELAY": 0,
+        "OPENAI_RETRY_MAX_DELAY": 0,
+        "OPENAI_BREAKER_FAILURES": 2,
+        "OPENAI_BREAKER_RESET_SECONDS": 0.2,
+    })
+    results, attempts = [], []
+
+    def create(kwargs, timeout):
+        attempts.append(kwargs)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(llm, "_create", create)
+    yield results, attempts
+    llm.configure_llm({})
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+def test_retries_upstream_errors(calls):
+    results, attempts = calls
+    results.extend([_connection_error(), _connection_error(), "ok"])
+    assert llm.chat_completion("classify", model="gpt-4o") == "ok"
+    assert len(attempts) == 3
+
+
+def test_other_errors_are_not_retried(calls):
+    results, attempts = calls
+    results.append(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        llm.chat_completion("classify", model="gpt-4o")
+    assert len(attempts) == 1
+
+
+def test_breaker_opens_and_a_probe_closes_it(calls):
+    results, attempts = calls
+    results.extend([_connection_error()] * 6)
+    for _ in range(2):
+        with pytest.raises(openai.APIConnectionError):
+            llm.chat_completion("classify", model="gpt-4o")
+    assert len(attempts) == 6
+
+    with pytest.raises(llm.LLMUnavailableError) as error:
+        llm.chat_completion("classify", model="gpt-4o")
+    assert error.value.retry_after >= 1
+    assert len(attempts) == 6
+
+    time.sleep(0.25)
+    results.append("ok")
+    assert llm.chat_completion("classify", model="gpt-4o") == "ok"
+    results.append("ok again")
+    assert llm.chat_completion("classify", model="gpt-4o") == "ok again"
+
+
+def test_failed_probe_opens_the_breaker_again(calls):
+    breaker = llm._breaker
+    for _ in range(2):
+        breaker.record_failure()
+    time.sleep(0.25)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
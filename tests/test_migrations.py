@@ -0,0 +1,53 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from helix_app.app import create_app, db
+from helix_app.models import SequenceStep
+
+EDITED_AT = datetime(2024, 3, 1, 12, 30)
+
+# The tables the migrations change, as they were before migration 1.
+OLD_SCHEMA = """
+CREATE TABLE user (id VARCHAR PRIMARY KEY, created_at DATETIME);
+CREATE TABLE sequence (
+    id INTEGER PRIMARY KEY, user_id VARCHAR NOT NULL, title VARCHAR, created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE sequence_step (
+    id INTEGER PRIMARY KEY, sequence_id INTEGER NOT NULL, step_number INTEGER, title VARCHAR,
+    content VARCHAR, created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE chat_message (
+    id INTEGER PRIMARY KEY, user_id VARCHAR NOT NULL, message VARCHAR, sender VARCHAR, created_at DATETIME
+);
+"""
+
+
+@pytest.fixture
+def upgraded(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+    conn.execute("INSERT INTO user (id) VALUES ('u')")
+    conn.execute("INSERT INTO sequence (id, user_id, title) VALUES (1, 'u', 'Outreach')")
+    conn.executemany(
+        "INSERT INTO sequence_step (id, sequence_id, step_number, title, updated_at) VALUES (?, 1, ?, ?, ?)",
+        # Step 2 is duplicated, so migration 1 renumbers the sequence.
+        [(1, 2, "Second", EDITED_AT), (2, 1, "First", EDITED_AT), (3, 2, "Third", EDITED_AT)]
+    )
+    conn.commit()
+    conn.close()
+
+    app = create_app({"DATABASE_URL": f"sqlite:///{path}", "REQUEST_LOG_ENABLED": False})
+    with app.app_context():
+        yield db.session.query(SequenceStep).order_by(SequenceStep.position).all()
+
+
+def test_step_positions_follow_step_numbers(upgraded):
+    assert [step.title for step in upgraded] == ["First", "Second", "Third"]
+
+
+def test_migrations_keep_updated_at(upgraded):
+    assert [step.updated_at for step in upgraded] == [EDITED_AT] * 3
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import update
+
+from helix_app import routes
+from helix_app.app import create_app, db
+from helix_app.models import Sequence, SequenceStep, User
+from helix_app.ranks import initial_ranks
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    app = create_app({"DATABASE_URL": "sqlite://", "REQUEST_LOG_ENABLED": False})
+    with app.app_context():
+        db.session.add(User(id="u"))
+        sequence = Sequence(user_id="u", title="Outreach")
+        sequence.steps = [
+            SequenceStep(position=rank, title=f"Step {i}", content=f"Note {i}.")
+            for i, rank in enumerate(initial_ranks(3), 1)
+        ]
+        db.session.add(sequence)
+        db.session.commit()
+        yield app.test_client(), sequence.id, sequence.version
+
+
+def _patch(client, sequence_id, version, **body):
+    return client.patch("/api/sequence/steps", json=dict(body, sequenceId=sequence_id, version=version))
+
+
+def test_stale_version_is_rejected_with_the_current_steps(client):
+    client, sequence_id, version = client
+    first = _patch(client, sequence_id, version, steps=[{"stepNumber": 2, "stepContent": "First."}], order=[3, 1, 2])
+    assert first.status_code == 200
+    assert first.get_json()["version"] == version + 1
+
+    stale = _patch(client, sequence_id, version, steps=[{"stepNumber": 1, "stepTitle": "Lost"}])
+    assert stale.status_code == 409
+    body = stale.get_json()
+    assert body["version"] == version + 1
+    assert body["sequence"] == first.get_json()["sequence"]
+    assert [step["stepTitle"] for step in body["sequence"]] == ["Step 3", "Step 1", "Step 2"]
+    assert body["sequence"][2]["stepContent"] == "First."
+
+
+def test_change_between_read_and_write_is_rejected(client, monkeypatch):
+    client, sequence_id, version = client
+    read_state = routes._sequence_state
+
+    def state_then_concurrent_bump(sequence_id):
+        state = read_state(sequence_id)
+        monkeypatch.setattr(routes, "_sequence_state", read_state)
+        db.session.execute(update(Sequence).where(Sequence.id == sequence_id).values(version=Sequence.version + 1))
+        db.session.commit()
+        return state
+
+    monkeypatch.setattr(routes, "_sequence_state", state_then_concurrent_bump)
+    response = _patch(client, sequence_id, version, steps=[{"stepNumber": 1, "stepTitle": "Lost"}])
+    assert response.status_code == 409
+    assert response.get_json()["version"] == version + 1
+    assert response.get_json()["sequence"][0]["stepTitle"] == "Step 1"
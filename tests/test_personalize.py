@@ -0,0 +1,52 @@
+import io
+import json
+from types import SimpleNamespace
+
+from helix_app.personalize import CompiledSequence, read_recipients, render_to_stream
+
+STEPS = [
+    SimpleNamespace(title="Hi {{First_Name}}", content="We help {{Company}} hire {faster}."),
+    SimpleNamespace(title="Follow-up", content="Still interested, {{ First_Name }}?"),
+]
+
+
+def _render(source, fmt, workers=1, chunk_size=1000):
+    compiled = CompiledSequence(1, "Test", STEPS)
+    out = io.StringIO()
+    result = render_to_stream(compiled, read_recipients(io.StringIO(source), fmt), out, workers, chunk_size)
+    return result, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_render_fills_placeholders_and_reports_missing():
+    (rendered, missing, errors), lines = _render('{"First_Name": "Ada", "Company": "Acme"}\n{"Company": "Initech"}\n', "ndjson")
+    assert (rendered, errors) == (2, 0)
+    assert missing == {"First_Name": 1}
+    assert lines[0]["steps"][0] == {"stepNumber": 1, "stepTitle": "Hi Ada", "stepContent": "We help Acme hire {faster}."}
+    assert lines[1]["steps"][1]["stepContent"] == "Still interested, {{First_Name}}?"
+    assert lines[1]["missing"] == ["First_Name"]
+
+
+def test_malformed_ndjson_rows_are_reported_and_skipped():
+    source = '{"First_Name": "Ada"}\n[1, 2]\n{not json\n{"First_Name": "Bob"}\n'
+    (rendered, _, errors), lines = _render(source, "ndjson", chunk_size=2)
+    assert (rendered, errors) == (2, 2)
+    assert [line["row"] for line in lines] == [1, 2, 3, 4]
+    assert lines[1]["error"] == "Expected a JSON object."
+    assert lines[2]["error"].startswith("Invalid JSON")
+    assert lines[3]["steps"][0]["stepTitle"] == "Hi Bob"
+
+
+def test_csv_row_with_extra_fields_is_reported():
+    source = "First_Name,Company\nAda,Acme\nBob,Initech,extra\nCy\n"
+    (rendered, missing, errors), lines = _render(source, "csv")
+    assert (rendered, errors) == (2, 1)
+    assert lines[1] == {"row": 2, "error": "Row has 1 more fields than the header."}
+    assert lines[2]["missing"] == ["Company"]
+    assert missing == {"Company": 1}
+
+
+def test_workers_keep_input_order():
+    source = "".join(json.dumps({"First_Name": f"R{i}"}) + "\n" for i in range(25))
+    (rendered, _, _), lines = _render(source, "ndjson", workers=2, chunk_size=4)
+    assert rendered == 25
+    assert [line["steps"][0]["stepTitle"] for line in lines] == [f"Hi R{i}" for i in range(25)]
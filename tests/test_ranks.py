@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from helix_app.ranks import (
+    MAX_RANK_LENGTH, initial_ranks, rank_between, ranks_between, reposition, unmoved
+)
+
+
+@pytest.mark.parametrize("before, after", [
+    (None, None),
+    (None, "V"),
+    ("V", None),
+    ("A", "B"),
+    ("A", "A1"),
+    ("Az", "B"),
+    ("1", "2"),
+    ("zz", None),
+    (None, "01"),
+])
+def test_rank_between_sorts_between(before, after):
+    rank = rank_between(before, after)
+    assert rank is not None
+    assert not rank.endswith("0")
+    if before is not None:
+        assert before < rank
+    if after is not None:
+        assert rank < after
+
+
+@pytest.mark.parametrize("before, after", [("B", "A"), ("A", "A")])
+def test_rank_between_rejects_unordered_keys(before, after):
+    assert rank_between(before, after) is None
+
+
+def test_rank_between_gives_up_past_max_length():
+    before, after = "A", "B"
+    for _ in range(200):
+        rank = rank_between(before, after)
+        if rank is None:
+            break
+        assert len(rank) <= MAX_RANK_LENGTH
+        after = rank
+    else:
+        pytest.fail("keys never reached MAX_RANK_LENGTH")
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 5, 40])
+def test_ranks_between(count):
+    ranks = ranks_between("A", "B", count)
+    assert len(ranks) == count
+    assert ranks == sorted(set(ranks))
+    assert all("A" < rank < "B" for rank in ranks)
+
+
+@pytest.mark.parametrize("count", [1, 2, 10, 61, 62, 500])
+def test_initial_ranks(count):
+    ranks = initial_ranks(count)
+    assert len(ranks) == count
+    assert ranks == sorted(set(ranks))
+    assert all(rank and not rank.endswith("0") for rank in ranks)
+    assert rank_between(None, ranks[0]) is not None
+    assert rank_between(ranks[-1], None) is not None
+
+
+def test_random_inserts_stay_sorted():
+    rng = random.Random(7)
+    ranks = initial_ranks(3)
+    for _ in range(500):
+        i = rng.randint(0, len(ranks))
+        rank = rank_between(ranks[i - 1] if i else None, ranks[i] if i < len(ranks) else None)
+        if rank is None:
+            ranks = initial_ranks(len(ranks))
+            continue
+        ranks.insert(i, rank)
+        assert ranks == sorted(set(ranks))
+
+
+def test_unmoved_keeps_a_longest_increasing_run():
+    assert unmoved(["B", "C", "A", "D"]) == {0, 1, 3}
+    assert unmoved([None, "A", None]) == {1}
+    assert unmoved([]) == set()
+
+
+def test_reposition_keeps_unmoved_keys():
+    ranks = initial_ranks(4)
+    new_order = [ranks[1], ranks[0], None, ranks[2], ranks[3]]
+    keep = unmoved(new_order)
+    result = reposition(new_order, keep)
+    assert result == sorted(set(result))
+    for i in keep:
+        assert result[i] == new_order[i]
+
+
+def test_reposition_respreads_when_out_of_room():
+    crowded = ["A", None, "A" + "0" * (MAX_RANK_LENGTH - 2) + "1"]
+    result = reposition(crowded, {0, 2})
+    assert result == initial_ranks(3)
@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from helix_app.app import create_app, db
+from helix_app.models import Sequence, SequenceStep, User
+from helix_app.ranks import initial_ranks
+from helix_app.revisions import apply_delta, text_delta
+
+WORDS = ["Hi", "there,", "quick", "note", "about", "{{company}}", "—", "thanks!", "\n\n", "  ", "Best,", "Sam"]
+
+
+@pytest.mark.parametrize("old, new", [
+    ("", ""),
+    ("", "Hello there"),
+    ("Hello there", ""),
+    ("Hello there", "Hello there"),
+    ("Hello there, friend", "Hello, dear friend"),
+    ("Line one\n\nLine two", "Line one\nLine 2\n\n"),
+    ("café  naïve", "café naïve  résumé"),
+])
+def test_delta_round_trip(old, new):
+    assert apply_delta(old, text_delta(old, new)) == new
+
+
+def test_delta_round_trip_random_edits():
+    rng = random.Random(3)
+    for _ in range(300):
+        old = " ".join(rng.choices(WORDS, k=rng.randint(0, 20)))
+        new = old.split(" ")
+        for _ in range(rng.randint(0, 5)):
+            i = rng.randint(0, len(new))
+            if new and rng.random() < 0.5:
+                del new[min(i, len(new) - 1)]
+            else:
+                new.insert(i, rng.choice(WORDS))
+        new = " ".join(new)
+        assert apply_delta(old, text_delta(old, new)) == new
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    app = create_app({
+        "DATABASE_URL": "sqlite://",
+        "REQUEST_LOG_ENABLED": False,
+        "STEP_REVISION_SNAPSHOT_INTERVAL": 3,
+    })
+    with app.app_context():
+        db.session.add(User(id="u"))
+        sequence = Sequence(user_id="u", title="Outreach")
+        sequence.steps = [
+            SequenceStep(position=rank, title=f"Step {i}", content=f"Hello {{{{first_name}}}}, note {i}.")
+            for i, rank in enumerate(initial_ranks(2), 1)
+        ]
+        db.session.add(sequence)
+        db.session.commit()
+        yield app.test_client(), sequence.id
+
+
+def test_revisions_rebuild_every_edit(client):
+    client, sequence_id = client
+    contents = ["Hello {{first_name}}, note 1."]
+    for i in range(8):
+        contents.append(contents[-1].replace("note", "quick note", 1) + f" P.S. {i}")
+        response = client.put("/api/sequence/update", json={
+            "sequenceId": sequence_id, "stepNumber": 1, "field": "stepContent", "value": contents[-1],
+        })
+        assert response.status_code == 200
+
+    revisions = client.get(f"/api/sequence/{sequence_id}/steps/1/revisions").get_json()["revisions"]
+    assert [row["revision"] for row in revisions] == list(range(len(contents), 0, -1))
+    assert any(not row["snapshot"] for row in revisions)
+
+    for revision, content in enumerate(contents, 1):
+        found = client.get(f"/api/sequence/{sequence_id}/steps/1/revisions/{revision}").get_json()
+        assert (found["stepTitle"], found["stepContent"]) == ("Step 1", content)
+
+
+def test_restore_round_trip(client):
+    client, sequence_id = client
+    for content in ["First edit.", "Second edit, longer than the first."]:
+        client.put("/api/sequence/update", json={
+            "sequenceId": sequence_id, "stepNumber": 2, "field": "stepContent", "value": content,
+        })
+
+    restored = client.post(f"/api/sequence/{sequence_id}/steps/2/revisions/1/restore").get_json()
+    assert restored["step"]["stepContent"] == "Hello {{first_name}}, note 2."
+
+    # The restore is revision 4; restoring revision 3 undoes it.
+    undone = client.post(f"/api/sequence/{sequence_id}/steps/2/revisions/3/restore").get_json()
+    assert undone["step"]["stepContent"] == "Second edit, longer than the first."
+    assert undone["version"] == restored["version"] + 1
+
+    missing = client.post(f"/api/sequence/{sequence_id}/steps/2/revisions/9/restore")
+    assert missing.status_code == 404
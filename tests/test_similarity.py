@@ -0,0 +1,87 @@
+import pytest
+
+from helix_app import similarity
+from helix_app.app import create_app
+from helix_app.similarity import (
+    SimilarSequenceIndex, find_similar_sequence, jaccard, remember_sequence, shingles
+)
+
+PROMPT = "Write a five step cold email sequence for CFOs at mid-sized logistics companies"
+ARGS = {"sequence_title": "CFO outreach", "steps": [{"step_title": "Intro", "step_content": "Hi {{first_name}}."}]}
+
+
+def _conversation(*messages):
+    return [{"role": "system", "content": "You write sequences."}] + [
+        {"role": role, "content": content} for role, content in messages
+    ]
+
+
+def test_near_duplicate_prompt_is_found():
+    index = SimilarSequenceIndex(max_entries=10, ttl=60)
+    index.add("u", PROMPT, ARGS)
+    index.add("u", "Draft a LinkedIn message to a product designer about our design tool", {"steps": []})
+
+    entry, found = index.lookup("u", PROMPT.replace("five", "5"))
+    assert entry.args is ARGS
+    assert found == jaccard(shingles(PROMPT), shingles(PROMPT.replace("five", "5")))
+    assert index.lookup("u", "Plan a team offsite in Lisbon with hiking and a boat trip") == (None, 0.0)
+
+
+def test_entries_are_scoped():
+    index = SimilarSequenceIndex(max_entries=10, ttl=60)
+    index.add("u", PROMPT, ARGS)
+    assert index.lookup("other", PROMPT) == (None, 0.0)
+    assert index.lookup(None, PROMPT) == (None, 0.0)
+
+
+def test_least_recently_used_entry_is_evicted():
+    index = SimilarSequenceIndex(max_entries=2, ttl=60)
+    prompts = [f"{PROMPT} in region {region}" for region in ("north", "south", "east")]
+    index.add("u", prompts[0], ARGS)
+    index.add("u", prompts[1], ARGS)
+    assert index.lookup("u", prompts[0])[0].prompt == prompts[0]
+    index.add("u", prompts[2], ARGS)
+
+    assert set(prompt for _, prompt in index.entries) == {prompts[0], prompts[2]}
+    assert all(prompts[1] not in bucket for bucket in index.buckets.values())
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    index = SimilarSequenceIndex(max_entries=10, ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(similarity.time, "monotonic", lambda: now[0])
+    index.add("u", PROMPT, ARGS)
+    now[0] += 61
+    assert index.lookup("u", PROMPT) == (None, 0.0)
+    assert not index.entries and not index.buckets
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    app = create_app({
+        "DATABASE_URL": "sqlite://",
+        "REQUEST_LOG_ENABLED": False,
+        "SIMILAR_SEQUENCE_CACHE_ENABLED": True,
+    })
+    with app.app_context():
+        yield app
+
+
+def test_lookup_is_keyed_on_the_conversation(app):
+    conversation = _conversation(("user", PROMPT))
+    remember_sequence("u", PROMPT, conversation, ARGS)
+
+    entry, action = find_similar_sequence("u", PROMPT, _conversation(("user", PROMPT)))
+    assert (entry.args, action) == (ARGS, "serve")
+
+    follow_up = _conversation(("user", "Tell me about logistics"), ("assistant", "Sure, here goes."), ("user", PROMPT))
+    # The same prompt after other turns is only close enough to seed the model.
+    entry, action = find_similar_sequence("u", PROMPT, follow_up)
+    assert (entry.args, action) == (ARGS, "seed")
+
+
+def test_short_prompts_are_skipped(app):
+    remember_sequence("u", "yes please", _conversation(("user", "yes please")), ARGS)
+    assert not app.extensions["similar_sequences"].entries
+    assert find_similar_sequence("u", "yes please", _conversation(("user", "yes please"))) == (None, "skip")
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from helix_app import routes
+from helix_app.app import create_app
+from helix_app.singleflight import AsyncSingleFlight, SingleFlight
+
+SEQUENCE = {
+    "sequence_title": "Outreach",
+    "steps": [{"step_title": f"Step {i}", "step_content": f"Hey {{{{First_Name}}}}, note {i}."} for i in (1, 2)],
+}
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    runs, results = [], []
+
+    def fn():
+        runs.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", fn))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    assert sorted(results) == [("result", False)] + [("result", True)] * 3
+    assert flights.calls == {}
+
+
+def test_errors_are_shared_but_not_cached():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait()
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flights.do("key", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert flights.do("key", lambda: "again") == ("again", False)
+
+
+def test_async_calls_share_one_run_per_key():
+    flights = AsyncSingleFlight()
+    runs = []
+
+    async def fn():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(3)), flights.do("other", fn))
+
+    assert asyncio.run(run()) == [("result", False), ("result", True), ("result", True), ("result", False)]
+    assert len(runs) == 2
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    A test client whose model always answers with SEQUENCE; the returned
+    list records one entry per model call.
+    """
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    app = create_app({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'replay.db'}",
+        "REQUEST_LOG_ENABLED": False,
+        "INTENT_CONFIDENCE_THRESHOLD": 0,
+    })
+    calls = []
+
+    def fake_completion(call_type, **kwargs):
+        calls.append(call_type)
+        function_call = SimpleNamespace(name="performTaskInSequences", arguments=json.dumps(SEQUENCE))
+        message = SimpleNamespace(content=None, function_call=function_call)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="function_call")], usage=None)
+
+    monkeypatch.setattr(routes, "chat_completion", fake_completion)
+    return app.test_client(), calls
+
+
+def test_idempotency_key_replays_the_stored_response(client):
+    client, calls = client
+    body = {"user_id": "u", "message": "Write a sales sequence for CFOs at logistics companies"}
+    headers = {"Idempotency-Key": "retry-1"}
+
+    first = client.post("/api/chat", json=body, headers=headers)
+    model_calls = len(calls)
+    replay = client.post("/api/chat", json=body, headers=headers)
+
+    assert calls and first.status_code == replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert replay.get_json() == first.get_json()
+    assert len(calls) == model_calls
+
+    mismatch = client.post("/api/chat", json=dict(body, message="Something else"), headers=headers)
+    assert mismatch.status_code == 422
+    assert len(calls) == model_calls
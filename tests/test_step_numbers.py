@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from helix_app.utils import extract_step_number, extract_step_numbers
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("make step 3 shorter", [3]),
+    ("rewrite the last step", [5]),
+    ("shorten steps 2, 3 and 4", [2, 3, 4]),
+    ("shorten steps 2-4", [2, 3, 4]),
+    ("edit step 1 to 3", [1, 2, 3]),
+    ("the second and last steps are too long", [2, 5]),
+    ("make all steps friendlier", [1, 2, 3, 4, 5]),
+    ("tweak the first 2 steps", [1, 2]),
+    ("tweak the last three steps", [3, 4, 5]),
+    ("make step 2 to 5 sentences", [2]),
+    ("make it friendlier", []),
+])
+def test_extract_step_numbers(message, expected):
+    assert extract_step_numbers(message, 5) == expected
+
+
+def test_extract_step_number_ordinals():
+    assert extract_step_number("change the third step") == 3
+    assert extract_step_number("change the final step") == "last"
+
+
+def test_ranges_end_at_the_last_step():
+    assert extract_step_numbers("edit steps 2-30000000", 5) == [2, 3, 4, 5]
+    assert extract_step_numbers("edit the first 99999999999 steps", 4) == [1, 2, 3, 4]
+    assert extract_step_numbers("edit the last 9999999 steps", 3) == [1, 2, 3]
+
+
+def test_step_past_the_end_is_kept_for_the_not_found_reply():
+    assert extract_step_numbers("edit step 7", 5) == [7]
+    assert extract_step_numbers("edit steps 7-9", 5) == [7]
+
+
+def test_reversed_range_adds_nothing():
+    assert extract_step_numbers("edit steps 4-2", 5) == [4]
+
+
+def test_huge_range_is_cheap():
+    # The intent classifier calls this with last_step_number=1 on every message.
+    started = time.perf_counter()
+    assert extract_step_numbers("edit steps 1-30000000", 1) == [1]
+    assert time.perf_counter() - started < 0.1
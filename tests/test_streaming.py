@@ -0,0 +1,79 @@
+import json
+import random
+
+import pytest
+
+from helix_app.streaming import SequenceArgumentStream, sse_event
+
+ARGUMENTS = {
+    "sequence_title": "Founders \"cold\" outreach {v2}",
+    "steps": [
+        {"step_number": 1, "step_title": "Intro", "content": "Hi {{first_name}},\n\nquick note \\ [1]"},
+        {"step_number": 2, "step_title": "Follow-up: {no}", "content": "Still keen? é— \"yes\"}"},
+        {"step_number": 3, "step_title": "Break-up", "content": ""},
+    ],
+}
+
+
+def _feed(chunks):
+    stream = SequenceArgumentStream()
+    events = []
+    for chunk in chunks:
+        events.extend(stream.feed(chunk))
+    return stream, events
+
+
+def _expected_events():
+    return [("title", ARGUMENTS["sequence_title"])] + [("step", step) for step in ARGUMENTS["steps"]]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_whole_arguments(ensure_ascii):
+    text = json.dumps(ARGUMENTS, ensure_ascii=ensure_ascii, indent=2)
+    stream, events = _feed([text])
+    assert events == _expected_events()
+    assert stream.arguments() == ARGUMENTS
+
+
+def test_arbitrary_chunking():
+    text = json.dumps(ARGUMENTS)
+    rng = random.Random(5)
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 30)))
+        chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+        stream, events = _feed(chunks)
+        assert events == _expected_events()
+        assert stream.arguments() == ARGUMENTS
+
+
+def test_one_character_at_a_time():
+    stream, events = _feed(json.dumps(ARGUMENTS))
+    assert events == _expected_events()
+
+
+def test_steps_are_emitted_as_they_close():
+    text = json.dumps(ARGUMENTS)
+    first_step = json.dumps(ARGUMENTS["steps"][0])
+    first_step_end = text.index(first_step) + len(first_step)
+    stream = SequenceArgumentStream()
+    assert stream.feed(text[:first_step_end - 1]) == [("title", ARGUMENTS["sequence_title"])]
+    assert stream.feed(text[first_step_end - 1:first_step_end]) == [("step", ARGUMENTS["steps"][0])]
+
+
+def test_other_keys_are_ignored():
+    text = json.dumps({"note": "steps", "extra": [{"a": 1}], "steps": [{"step_number": 1}]})
+    stream, events = _feed([text])
+    assert events == [("step", {"step_number": 1})]
+
+
+def test_incomplete_arguments():
+    text = json.dumps(ARGUMENTS)
+    stream, events = _feed([text[:-10]])
+    assert events[0] == ("title", ARGUMENTS["sequence_title"])
+    assert stream.arguments() == {}
+
+
+def test_sse_event():
+    message = sse_event("step", {"stepTitle": "Line\nbreak"})
+    assert message == 'event: step\ndata: {"stepTitle": "Line\\nbreak"}\n\n'
+    assert message.count("\n\n") == 1